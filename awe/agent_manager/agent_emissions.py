@@ -1,12 +1,16 @@
 from awe.db import engine
-from sqlmodel import Session, select, or_
+from sqlmodel import Session, select, or_, update
 from awe.settings import settings
 from datetime import datetime
 import logging
 from awe.models import UserAgent, UserAgentData, UserAgentWeeklyEmissions, TotalCycleEmissions, UserStaking
-from awe.models.user_staking import UserStakingStatus
-from awe.models import TgUserAccount, PlayerWeeklyEmissions, CreatorWeeklyEmissions, StakerWeeklyEmissions, StakerGlobalWeeklyEmissions
-from sqlalchemy import func
+from awe.models.user_staking import UserStakingStatus, get_staking_multiplier
+from .emission_writer import write_weekly_emissions, with_emissions, update_emissions_by_score
+from awe.models import TgUserAccount, PlayerWeeklyEmissions, CreatorWeeklyEmissions, StakerWeeklyEmissions, StakerGlobalWeeklyEmissions, \
+    EmissionBalanceProgress
+from awe.models.utils import unix_timestamp_in_seconds
+from sqlalchemy import func, case
+from typing import List
 import math
 
 
@@ -28,6 +32,15 @@ logger = logging.getLogger("[Agent Emissions]")
 
 page_size = 500
 
+# Shares of the cycle emissions, also used by the simulator
+global_staking_emission_share = 0.08 # 8% to stakers
+top_agent_emission_share = 0.603 # 60.3% (67% * 0.9)
+new_agent_emission_share = 0.18 # 18% (20% * 0.9)
+
+
+def get_num_top_agents(num_total_agents: int) -> int:
+    return math.ceil(2 * max([5, math.sqrt(num_total_agents)]))
+
 
 def update_total_cycle_emissions(cycle_end_timestamp: int, dry_run: bool):
     cycle_start_timestamp = cycle_end_timestamp - settings.tn_emission_interval_days * 86400
@@ -86,107 +99,57 @@ def distribute_global_staking_emissions(cycle_end_timestamp: int, dry_run: bool)
 
     total_cycle_emissions = get_total_cycle_emissions(cycle_end_timestamp)
 
-    total_global_staking_emissions = math.floor(total_cycle_emissions * 0.08) # 8% to stakers
+    total_global_staking_emissions = math.floor(total_cycle_emissions * global_staking_emission_share)
 
     logger.info(f"total cycle emissions: {total_cycle_emissions}, total global staking emissions: {total_global_staking_emissions}")
 
     # calculate staking scores
-    current_page = 0
+    staking_rows = []
+    last_staking_id = 0
     while True:
         with Session(engine) as session:
-            statement = select(UserStaking).where(
+            statement = select(UserStaking.id, UserStaking.tg_user_id, UserStaking.amount, UserStaking.created_at).where(
                 UserStaking.status == UserStakingStatus.SUCCESS,
                 UserStaking.created_at < cycle_start_timestamp,
                 or_(
                     UserStaking.released_at.is_(None),
                     UserStaking.released_at >= cycle_end_timestamp
-                )
-            ).order_by(UserStaking.id.asc()).offset(current_page * page_size).limit(page_size)
+                ),
+                UserStaking.id > last_staking_id
+            ).order_by(UserStaking.id.asc()).limit(page_size)
 
             user_stakings = session.exec(statement).all()
 
-            logger.info(f"{len(user_stakings)} user stakings in page {current_page}")
-
-            staking_ids = [staking.id for staking in user_stakings]
-
-            logger.info("global staking scores")
+        logger.info(f"{len(user_stakings)} user stakings after {last_staking_id}")
 
-            staking_scores = {}
-            for user_staking in user_stakings:
-                multiplier = user_staking.get_multiplier(cycle_end_timestamp)
-                staking_score = math.floor(user_staking.amount * multiplier)
-                logger.info(f"[Global Staking Score] user id: {user_staking.tg_user_id}, staking_id: {user_staking.id}, staking_amount: {user_staking.amount}, multiplier: {multiplier}, staking_score: {staking_score}")
-                staking_scores[user_staking.id] = [user_staking.tg_user_id, staking_score]
+        for staking_id, tg_user_id, amount, created_at in user_stakings:
+            multiplier = get_staking_multiplier(created_at, cycle_end_timestamp)
+            staking_score = math.floor(amount * multiplier)
+            logger.debug(f"[Global Staking Score] user id: {tg_user_id}, staking_id: {staking_id}, staking_amount: {amount}, multiplier: {multiplier}, staking_score: {staking_score}")
+            staking_rows.append({
+                "staking_id": staking_id,
+                "tg_user_id": tg_user_id,
+                "score": staking_score
+            })
 
-            # Get old records
-            statement = select(StakerGlobalWeeklyEmissions).where(
-                StakerGlobalWeeklyEmissions.staking_id.in_(staking_ids),
-                StakerGlobalWeeklyEmissions.day==cycle_start_timestamp,
-            )
-
-            global_staking_emissions = session.exec(statement).all()
-
-            # Update / delete old records
-            for global_staking_emission in global_staking_emissions:
-                if global_staking_emission.staking_id in staking_scores:
-                    global_staking_emission.score = staking_scores[global_staking_emission.staking_id][1]
-                    session.add(global_staking_emission)
-                    del staking_scores[global_staking_emission.staking_id]
-                else:
-                    session.delete(global_staking_emission)
-
-            # Add new records
-            for staking_id in staking_scores:
-                staking_emission = StakerGlobalWeeklyEmissions(
-                    staking_id=staking_id,
-                    tg_user_id=staking_scores[staking_id][0],
-                    score=staking_scores[staking_id][1],
-                    day=cycle_start_timestamp
-                )
+        if len(user_stakings) < page_size:
+            break
 
-                session.add(staking_emission)
-
-            if not dry_run:
-                session.commit()
-
-            if len(user_stakings) < page_size:
-                break
-
-            current_page += 1
-
-    # Get total staking scores
-    with Session(engine) as session:
-        statement = select(func.sum(StakerGlobalWeeklyEmissions.score)).where(
-            StakerGlobalWeeklyEmissions.day == cycle_start_timestamp
-        )
-
-        total_score = session.exec(statement).one()
-        logger.info(f"total global staking score {total_score}")
+        last_staking_id = user_stakings[-1][0]
 
     # Update staking emissions
-    current_page = 0
-    while True:
-        with Session(engine) as session:
-            statement = select(StakerGlobalWeeklyEmissions).where(
-                StakerGlobalWeeklyEmissions.day==cycle_start_timestamp,
-            ).order_by(StakerGlobalWeeklyEmissions.id).offset(current_page * page_size).limit(page_size)
-
-            global_staking_emissions = session.exec(statement).all()
+    with_emissions(staking_rows, total_global_staking_emissions)
 
-            logger.info(f"{len(global_staking_emissions)} staking emissions in page {current_page}")
+    logger.info(f"total global staking score {sum([row['score'] for row in staking_rows])}")
 
-            for global_staking_emission in global_staking_emissions:
-                global_staking_emission.emission = math.floor(total_global_staking_emissions * global_staking_emission.score / total_score)
-                logger.info(f"[Global Staking Emissions] emission id: {global_staking_emission.id}, staking id: {global_staking_emission.staking_id}, staking score: {global_staking_emission.score}, emission: {global_staking_emission.emission}")
-                session.add(global_staking_emission)
-
-            if not dry_run:
-                session.commit()
-
-            if len(global_staking_emissions) < page_size:
-                break
-
-            current_page += 1
+    if not dry_run:
+        write_weekly_emissions(
+            StakerGlobalWeeklyEmissions,
+            cycle_start_timestamp,
+            ["staking_id"],
+            ["day", "staking_id"],
+            staking_rows
+        )
 
     logger.info(f"All global staking emissions updated")
 
@@ -210,22 +173,23 @@ def distribute_top_agent_emissions(cycle_end_timestamp: int, dry_run: bool):
 
         num_total_agents = session.exec(statement).one()
 
-    top_N = math.ceil(2 * max([5, math.sqrt(num_total_agents)]))
+    top_N = get_num_top_agents(num_total_agents)
 
     logger.info(f"top_N: {top_N}")
 
     total_emissions = get_total_cycle_emissions(cycle_end_timestamp)
     logger.info(f"total_emissions: {total_emissions}")
 
-    total_agent_emissions = math.floor(total_emissions * 0.603) # 60.3% (67% * 0.9)
+    total_agent_emissions = math.floor(total_emissions * top_agent_emission_share)
     logger.info(f"total_agent_emissions: {total_agent_emissions}")
 
     # Calculate the total scores of top agents
+    # Note the sum covers all the agents, not only the top N
 
     with Session(engine) as session:
         statement = select(func.sum(UserAgentWeeklyEmissions.score)).where(
             UserAgentWeeklyEmissions.day == cycle_start_timestamp
-        ).order_by(UserAgentWeeklyEmissions.score.desc()).limit(top_N)
+        )
 
         score_sum = session.exec(statement).one()
 
@@ -234,38 +198,14 @@ def distribute_top_agent_emissions(cycle_end_timestamp: int, dry_run: bool):
     if score_sum == 0:
         raise Exception("score_sum is zero!")
 
-    # Update agent emission in batch
-    current_page = 0
-    num_agent_processed = 0
-
-    while True:
-        with Session(engine) as session:
-            statement = select(UserAgentWeeklyEmissions).where(
-                UserAgentWeeklyEmissions.day == cycle_start_timestamp
-            ).order_by(UserAgentWeeklyEmissions.score.desc()).offset(current_page * page_size).limit(page_size)
-
-            top_agent_emissions = session.exec(statement).all()
-            logger.info(f"num of top_agent_emissions in page {current_page}: {len(top_agent_emissions)}")
-
-            for emission in top_agent_emissions:
-
-                emission.emission = math.floor(total_agent_emissions * emission.score / score_sum)
-                session.add(emission)
-
-                logger.info(f"Agent emission: {emission.user_agent_id}: {emission.emission}")
-
-                num_agent_processed += 1
-
-                if num_agent_processed >= top_N:
-                    break
-
-            if not dry_run:
-                session.commit()
-
-            if len(top_agent_emissions) < page_size:
-                break
-
-            current_page += 1
+    # Update top agent emissions in one statement
+    num_agent_processed = update_emissions_by_score(
+        UserAgentWeeklyEmissions,
+        [UserAgentWeeklyEmissions.day == cycle_start_timestamp],
+        total_agent_emissions,
+        top_n=top_N,
+        dry_run=dry_run
+    )
 
     logger.info(f"Updated emission for {num_agent_processed} agents!")
 
@@ -283,7 +223,7 @@ def distribute_new_agent_emissions(cycle_end_timestamp: int, dry_run: bool):
     total_emissions = get_total_cycle_emissions(cycle_end_timestamp)
     logger.info(f"total_emissions: {total_emissions}")
 
-    total_agent_emissions = math.floor(total_emissions * 0.18) # 18% (20% * 0.9)
+    total_agent_emissions = math.floor(total_emissions * new_agent_emission_share)
     logger.info(f"total_agent_emissions: {total_agent_emissions}")
 
     # Calculate the total scores of all new agents
@@ -301,42 +241,30 @@ def distribute_new_agent_emissions(cycle_end_timestamp: int, dry_run: bool):
     if score_sum == 0:
         raise Exception("score_sum is zero!")
 
-    # Update agent emission in batch
-    current_page = 0
-    num_agent_processed = 0
-
-    while True:
-        with Session(engine) as session:
-            statement = select(UserAgentWeeklyEmissions).where(
-                UserAgentWeeklyEmissions.day == cycle_start_timestamp,
-                UserAgentWeeklyEmissions.score != 0
-            ).offset(current_page * page_size).limit(page_size)
-
-            new_agent_emissions = session.exec(statement).all()
-            logger.info(f"num of new_agent_emissions in page {current_page}: {len(new_agent_emissions)}")
-
-            for emission in new_agent_emissions:
-
-                new_agent_emission = math.floor(total_agent_emissions * emission.score / score_sum)
-
-                logger.info(f"New agent emission: {emission.user_agent_id}: {new_agent_emission}")
-                logger.info(f"Total agent emission: {emission.emission + new_agent_emission}")
-
-                emission.emission = UserAgentWeeklyEmissions.emission + new_agent_emission
-                session.add(emission)
-
-                num_agent_processed += 1
+    # Add the new agent emissions in one statement
+    num_agent_processed = update_emissions_by_score(
+        UserAgentWeeklyEmissions,
+        [
+            UserAgentWeeklyEmissions.day == cycle_start_timestamp,
+            UserAgentWeeklyEmissions.score != 0
+        ],
+        total_agent_emissions,
+        accumulate=True,
+        dry_run=dry_run
+    )
 
-            if not dry_run:
-                session.commit()
+    logger.info(f"Updated emission for {num_agent_processed} agents!")
 
-            if len(new_agent_emissions) < page_size:
-                break
 
-            current_page += 1
-
-    logger.info(f"Updated emission for {num_agent_processed} agents!")
 
+# The emission records credited to the account balances
+# (source, emission model, key column, account model, balance columns)
+emission_balance_sources = [
+    ("global_stakers", StakerGlobalWeeklyEmissions, "tg_user_id", TgUserAccount, ["balance"]),
+    ("players", PlayerWeeklyEmissions, "tg_user_id", TgUserAccount, ["balance"]),
+    ("creators", CreatorWeeklyEmissions, "user_agent_id", UserAgentData, ["awe_token_creator_balance", "total_emissions"]),
+    ("agent_stakers", StakerWeeklyEmissions, "tg_user_id", TgUserAccount, ["balance"]),
+]
 
 
 def update_all_emission_account_balances(cycle_end_timestamp: int, dry_run: bool):
@@ -347,160 +275,101 @@ def update_all_emission_account_balances(cycle_end_timestamp: int, dry_run: bool
 
     logger.info(f"Updating account balances for emissions cycle: [{start_datetime}, {end_datetime})")
 
-    #TODO: paging for large scale
-
-    # Global stakers emissions
-    update_global_staking_emission_account_balances(cycle_start_timestamp, dry_run)
-
-    # Memegent - players
-    update_agent_player_emission_account_balances(cycle_start_timestamp, dry_run)
-
-    # Memegent - creators
-    update_agent_creator_emission_account_balances(cycle_start_timestamp, dry_run)
-
-    # Memegent - stakers
-    update_agent_staking_emission_account_balances(cycle_start_timestamp, dry_run)
-
-
-def update_global_staking_emission_account_balances(cycle_start_timestamp: int, dry_run: bool):
-    logger.info(f"Updating Global staking reward balances")
-
-    with Session(engine) as session:
-        statement = select(StakerGlobalWeeklyEmissions).where(StakerGlobalWeeklyEmissions.day == cycle_start_timestamp)
-        staker_emissions = session.exec(statement).all()
-
-        tg_user_ids = []
-        tg_user_emissions = {}
-
-        for staker_emission in staker_emissions:
-            # Might be multiple staking for a single user
-            tg_user_id = staker_emission.tg_user_id
+    for source, emission_model, key_column, account_model, balance_columns in emission_balance_sources:
+        credit_emission_balances(cycle_start_timestamp, source, emission_model, key_column, account_model, balance_columns, dry_run)
 
-            logger.info(f"Global staking emissions: {tg_user_id}: {staker_emission.emission}")
 
-            if tg_user_id not in tg_user_emissions:
-                tg_user_emissions[tg_user_id] = 0
-                tg_user_ids.append(tg_user_id)
+def credit_emission_balances(cycle_start_timestamp: int, source: str, emission_model, key_column: str, account_model, balance_columns: List[str], dry_run: bool):
+    # Add the emissions summed up by account key to the account balances
+    # Keyset paged by the account key, one UPDATE per page
+    # The progress is saved with each page so a rerun resumes without crediting twice
 
-            tg_user_emissions[tg_user_id] += staker_emission.emission
+    logger.info(f"[{source}] Crediting emission balances")
 
-            logger.info(f"Global user emissions: {tg_user_id}: {tg_user_emissions[tg_user_id]}")
+    progress = get_emission_balance_progress(cycle_start_timestamp, source, dry_run)
 
-        statement = select(TgUserAccount).where(TgUserAccount.tg_user_id.in_(tg_user_ids))
-        tg_user_accounts = session.exec(statement).all()
+    if progress.done:
+        logger.info(f"[{source}] Credited before, skipped")
+        return
 
-        for tg_user_account in tg_user_accounts:
-            logger.info(f"Adding balance for user {tg_user_account.tg_user_id}: {tg_user_account.balance} -> {tg_user_emissions[tg_user_account.tg_user_id] + tg_user_account.balance}")
-            tg_user_account.balance = TgUserAccount.balance + tg_user_emissions[tg_user_account.tg_user_id]
-            session.add(tg_user_account)
+    emission_key = getattr(emission_model, key_column)
+    account_key = getattr(account_model, key_column)
 
-        if not dry_run:
-            session.commit()
+    # The keys are saved as strings
+    last_key = None
+    if progress.last_key is not None:
+        last_key = int(progress.last_key) if key_column == "user_agent_id" else progress.last_key
 
-    logger.info(f"Global staking reward balances updated!")
-
-
-def update_agent_player_emission_account_balances(cycle_start_timestamp: int, dry_run: bool):
-    logger.info(f"Update agent player emission balances")
-    with Session(engine) as session:
-        statement = select(PlayerWeeklyEmissions).where(PlayerWeeklyEmissions.day == cycle_start_timestamp)
-        player_emissions = session.exec(statement).all()
-        tg_user_ids = []
-        tg_user_emissions = {}
-
-        for player_emission in player_emissions:
-            # Might be multiple emissions for a single user in multiple agents
-            tg_user_id = player_emission.tg_user_id
-
-            logger.info(f"Single agent player emissions: {tg_user_id}: {player_emission.emission}")
-
-            if tg_user_id not in tg_user_emissions:
-                tg_user_emissions[tg_user_id] = 0
-                tg_user_ids.append(tg_user_id)
-
-            tg_user_emissions[player_emission.tg_user_id] += player_emission.emission
-
-            logger.info(f"All agent player emissions: {tg_user_id}: {tg_user_emissions[tg_user_id]}")
+    while True:
+        with Session(engine) as session:
+            statement = select(emission_key, func.sum(emission_model.emission)).where(
+                emission_model.day == cycle_start_timestamp
+            ).group_by(emission_key).order_by(emission_key.asc()).limit(page_size)
 
-        statement = select(TgUserAccount).where(TgUserAccount.tg_user_id.in_(tg_user_ids))
-        tg_user_accounts = session.exec(statement).all()
+            if last_key is not None:
+                statement = statement.where(emission_key > last_key)
 
-        for tg_user_account in tg_user_accounts:
-            logger.info(f"Adding balance for user {tg_user_account.tg_user_id}: {tg_user_account.balance} -> {tg_user_emissions[tg_user_account.tg_user_id] + tg_user_account.balance}")
-            tg_user_account.balance = TgUserAccount.balance + tg_user_emissions[tg_user_account.tg_user_id]
-            session.add(tg_user_account)
+            emissions = session.exec(statement).all()
 
-        if not dry_run:
-            session.commit()
+            credits = {key: int(emission) for key, emission in emissions if emission}
+            total_credited = sum(credits.values())
 
-    logger.info(f"Agent player emission balances updated!")
+            if len(credits) != 0:
+                statement = update(account_model).where(account_key.in_(credits.keys())).values({
+                    column: getattr(account_model, column) + case(credits, value=account_key, else_=0) for column in balance_columns
+                }).execution_options(synchronize_session=False)
 
+                num_updated = session.execute(statement).rowcount
 
-def update_agent_creator_emission_account_balances(cycle_start_timestamp: int, dry_run: bool):
-    logger.info(f"Update agent creator emission balances")
-    with Session(engine) as session:
-        statement = select(CreatorWeeklyEmissions).where(CreatorWeeklyEmissions.day == cycle_start_timestamp)
-        creator_emissions = session.exec(statement).all()
+                if num_updated != len(credits):
+                    logger.warning(f"[{source}] {len(credits) - num_updated} accounts not found")
 
-        user_agent_ids = []
-        user_agent_emissions = {}
+            if len(emissions) != 0:
+                last_key = emissions[-1][0]
 
-        for creator_emission in creator_emissions:
-            user_agent_ids.append(creator_emission.user_agent_id)
-            user_agent_emissions[creator_emission.user_agent_id] = creator_emission.emission
-            logger.info(f"Agent emissions: {creator_emission.user_agent_id}: {user_agent_emissions[creator_emission.user_agent_id]}")
+            done = len(emissions) < page_size
 
-        statement = select(UserAgentData).where(UserAgentData.user_agent_id.in_(user_agent_ids))
-        user_agent_data = session.exec(statement).all()
+            if progress.id is not None:
+                statement = update(EmissionBalanceProgress).where(EmissionBalanceProgress.id == progress.id).values(
+                    last_key=None if last_key is None else str(last_key),
+                    credited=EmissionBalanceProgress.credited + total_credited,
+                    done=done,
+                    updated_at=unix_timestamp_in_seconds()
+                )
+                session.execute(statement)
 
-        for agent_data in user_agent_data:
-            logger.info(f"Adding balance for creator of agent {agent_data.user_agent_id}: {agent_data.awe_token_creator_balance} -> {agent_data.awe_token_creator_balance + user_agent_emissions[agent_data.user_agent_id]}")
-            agent_data.awe_token_creator_balance = UserAgentData.awe_token_creator_balance + user_agent_emissions[agent_data.user_agent_id]
-            agent_data.total_emissions = UserAgentData.total_emissions + user_agent_emissions[agent_data.user_agent_id]
-            session.add(agent_data)
+            logger.info(f"[{source}] {len(credits)} accounts credited with {total_credited} till {last_key}")
 
-        if not dry_run:
-            session.commit()
+            if dry_run:
+                session.rollback()
+            else:
+                session.commit()
 
-    logger.info(f"Agent creator emission balances updated!")
+        if done:
+            break
 
+    logger.info(f"[{source}] Emission balances credited!")
 
-def update_agent_staking_emission_account_balances(cycle_start_timestamp, dry_run):
-    logger.info(f"Updating Global staking reward balances")
 
+def get_emission_balance_progress(cycle_start_timestamp: int, source: str, dry_run: bool) -> EmissionBalanceProgress:
     with Session(engine) as session:
-        statement = select(StakerWeeklyEmissions).where(StakerWeeklyEmissions.day == cycle_start_timestamp)
-        staking_emissions = session.exec(statement).all()
-
-        tg_user_ids = []
-        tg_user_emissions = {}
-
-        for staking_emission in staking_emissions:
-            # Might be multiple staking for a single user
-            tg_user_id = staking_emission.tg_user_id
-
-            logger.info(f"Agent staking emissions: {tg_user_id}: {staking_emission.emission}")
-
-            if tg_user_id not in tg_user_emissions:
-                tg_user_emissions[tg_user_id] = 0
-                tg_user_ids.append(tg_user_id)
-
-            tg_user_emissions[tg_user_id] += staking_emission.emission
-
-            logger.info(f"User emissions: {tg_user_id}: {tg_user_emissions[tg_user_id]}")
+        statement = select(EmissionBalanceProgress).where(
+            EmissionBalanceProgress.day == cycle_start_timestamp,
+            EmissionBalanceProgress.source == source
+        )
 
-        statement = select(TgUserAccount).where(TgUserAccount.tg_user_id.in_(tg_user_ids))
-        tg_user_accounts = session.exec(statement).all()
+        progress = session.exec(statement).first()
 
-        for tg_user_account in tg_user_accounts:
-            logger.info(f"Adding balance for user {tg_user_account.tg_user_id}: {tg_user_account.balance} -> {tg_user_emissions[tg_user_account.tg_user_id] + tg_user_account.balance}")
-            tg_user_account.balance = TgUserAccount.balance + tg_user_emissions[tg_user_account.tg_user_id]
-            session.add(tg_user_account)
+        if progress is None:
+            progress = EmissionBalanceProgress(day=cycle_start_timestamp, source=source)
 
-        if not dry_run:
-            session.commit()
+            # Not saved in dry run, the progress is only in memory
+            if not dry_run:
+                session.add(progress)
+                session.commit()
+                session.refresh(progress)
 
-    logger.info(f"Agent staking reward balances updated!")
+        return progress
 
 
 def get_total_cycle_emissions(cycle_end_timestamp: int) -> int:
@@ -3,6 +3,7 @@ from awe.models import TgUserDeposit, \
                         TGBotUserWallet, UserAgent, TgUserAccount, UserReferrals, AweDeveloperAccount
 from awe.models.tg_user_deposit import TgUserDepositStatus
 from awe.models.user_staking import UserStakingStatus
+from awe.models.user_staking_aggregates import UserStakingAggregates
 from awe.models.tg_user_withdraw import TgUserWithdrawStatus
 from awe.models.game_pool_charge import GamePoolCharge, GamePoolChargeStatus
 from awe.models.user_agent_refund import UserAgentRefund, UserAgentRefundStatus
@@ -11,15 +12,18 @@ from awe.models.user_agent_staking import UserAgentStaking, UserAgentStakingStat
 from awe.blockchain import awe_on_chain
 from awe.settings import settings
 from sqlalchemy.orm import joinedload
+from sqlalchemy import func
 from sqlmodel import Session, select
 from awe.db import engine
 import logging
 import traceback
 from threading import Lock
-from typing import Dict
+from typing import Dict, Optional
 from awe.models.utils import unix_timestamp_in_seconds
-from .agent_stats import record_user_staking, record_user_staking_release
+from .agent_stats import record_user_staking, record_user_staking_release, invalidate_stats_dashboard
 from awe.tg_bot.user_notification import send_user_notification
+from .transfer_queue import enqueue_transfer
+from .agent_leaderboard import mark_agent_dirty
 
 logger = logging.getLogger("[Agent Fund]")
 
@@ -54,20 +58,34 @@ def collect_agent_creation_staking(
 
     logger.info(f"[Collect Agent Creation] [{agent_creation_staking_id}] Request recorded!")
 
-    try:
-        # Wait for the approve tx to be confirmed before next step
-        awe_on_chain.wait_for_tx_confirmation(approve_tx, settings.solana_tx_wait_timeout)
-    except Exception as e:
-        logger.error(e)
-        logger.error(f"[Collect Agent Creation] [{agent_creation_staking_id}] Error waiting for approve tx confirmation")
-        UserAgentStaking.update_status(agent_creation_staking_id, UserAgentStakingStatus.FAILED)
-        return
+    # The approve tx will be confirmed by the payment processor
+    # before collecting the staking
+
+
+def collect_approved_agent_creation_staking(agent_creation_staking_id: int):
+
+    with Session(engine) as session:
+        statement = select(UserAgentStaking).where(
+            UserAgentStaking.id == agent_creation_staking_id
+        )
+        agent_creation_staking = session.exec(statement).first()
+        creator_address = agent_creation_staking.address
+        amount = agent_creation_staking.amount
 
     UserAgentStaking.update_status(agent_creation_staking_id, UserAgentStakingStatus.APPROVED)
     logger.info(f"[Collect Agent Creation] [{agent_creation_staking_id}] Approve tx confirmed!")
 
     # Collect user deposit
-    tx, last_valid_block_height = awe_on_chain.collect_agent_creation_staking(agent_creation_staking_id, creator_address, settings.tn_agent_staking_amount)
+    if settings.solana_tx_async_dispatch:
+        # The tx will be recorded by the task
+        awe_on_chain.collect_agent_creation_staking(agent_creation_staking_id, creator_address, amount, write_back=True)
+        return
+
+    tx, last_valid_block_height = awe_on_chain.collect_agent_creation_staking(agent_creation_staking_id, creator_address, amount)
+    record_agent_creation_staking_tx(agent_creation_staking_id, tx, last_valid_block_height)
+
+
+def record_agent_creation_staking_tx(agent_creation_staking_id: int, tx: str, last_valid_block_height: int):
 
     logger.info(f"[Collect Agent Creation] [{agent_creation_staking_id}] Transfer tx sent! {tx}")
 
@@ -88,6 +106,11 @@ def collect_agent_creation_staking(
     logger.info(f"[Collect Agent Creation] [{agent_creation_staking_id}] Transfer tx recorded!")
 
 
+def fail_agent_creation_staking_approval(agent_creation_staking_id: int):
+    logger.error(f"[Collect Agent Creation] [{agent_creation_staking_id}] Error confirming the approve tx")
+    UserAgentStaking.update_status(agent_creation_staking_id, UserAgentStakingStatus.FAILED)
+
+
 def finalize_agent_creation_staking(agent_creation_staking_id: int):
     logger.info(f"[Collect Agent Creation] [{agent_creation_staking_id}] Finalizing agent creation")
 
@@ -96,6 +119,7 @@ def finalize_agent_creation_staking(agent_creation_staking_id: int):
             UserAgentStaking.id == agent_creation_staking_id
         )
         agent_creation_staking = session.exec(statement).first()
+        address = agent_creation_staking.address
 
         # 1. Update the agent creation staking status
 
@@ -113,6 +137,8 @@ def finalize_agent_creation_staking(agent_creation_staking_id: int):
 
         session.commit()
 
+    awe_on_chain.add_known_token_account(address)
+
     logger.info(f"[Collect Agent Creation] [{agent_creation_staking_id}] Agent creation finalized!")
 
 
@@ -149,8 +175,6 @@ def collect_user_deposit(agent_id: int, tg_user_id: str, amount: int, approve_tx
         statement = select(UserAgent).options(joinedload(UserAgent.agent_data)).where(UserAgent.id == agent_id)
         user_agent = session.exec(statement).first()
 
-        user_wallet_address = user_wallet.address
-
         user_deposit = TgUserDeposit(
             user_agent_id=agent_id,
             tg_user_id=tg_user_id,
@@ -167,21 +191,32 @@ def collect_user_deposit(agent_id: int, tg_user_id: str, amount: int, approve_tx
 
     logger.info(f"[Collect User Deposit] [User Deposit {user_deposit_id}] User Deposit created! {approve_tx}")
 
-    try:
-        # Wait for the approve tx to be confirmed before next step
-        awe_on_chain.wait_for_tx_confirmation(approve_tx, settings.solana_tx_wait_timeout)
-    except Exception as e:
-        logger.error(e)
-        logger.error(f"[Collect User Deposit] [User Deposit {user_deposit_id}] Error waiting for approve tx confirmation")
-        TgUserDeposit.update_status(user_deposit_id, TgUserDepositStatus.FAILED)
-        send_user_notification(agent_id, tg_user_id, f"Payment error: we cannot confirm the approve tx. You can safely try to pay again now.")
-        return
+    # The approve tx will be confirmed by the payment processor
+    # before collecting the deposit
+
+
+def collect_approved_user_deposit(user_deposit_id: int):
+
+    with Session(engine) as session:
+        statement = select(TgUserDeposit).where(TgUserDeposit.id == user_deposit_id)
+        user_deposit = session.exec(statement).first()
+        user_wallet_address = user_deposit.address
+        amount = user_deposit.amount
 
     TgUserDeposit.update_status(user_deposit_id, TgUserDepositStatus.APPROVED)
     logger.info(f"[Collect User Deposit] [User Deposit {user_deposit_id}] Approve tx confirmed!")
 
     # Collect user deposit
+    if settings.solana_tx_async_dispatch:
+        # The tx will be recorded by the task
+        awe_on_chain.collect_user_deposit(user_deposit_id, user_wallet_address, amount, write_back=True)
+        return
+
     tx, last_valid_block_height = awe_on_chain.collect_user_deposit(user_deposit_id, user_wallet_address, amount)
+    record_user_deposit_tx(user_deposit_id, tx, last_valid_block_height)
+
+
+def record_user_deposit_tx(user_deposit_id: int, tx: str, last_valid_block_height: int):
 
     logger.info(f"[Collect User Deposit] [User Deposit {user_deposit_id}] Transfer tx sent! {tx}")
 
@@ -202,8 +237,39 @@ def collect_user_deposit(agent_id: int, tg_user_id: str, amount: int, approve_tx
     logger.info(f"[Collect User Deposit] [User Deposit {user_deposit_id}] Transfer tx recorded!")
 
 
-def finalize_user_deposit(user_deposit_id: int):
-    logger.info(f"[Collect User Deposit] [User Deposit {user_deposit_id}] Finalizing user deposit")
+def fail_user_deposit_approval(user_deposit_id: int):
+    logger.error(f"[Collect User Deposit] [User Deposit {user_deposit_id}] Error confirming the approve tx")
+
+    with Session(engine) as session:
+        statement = select(TgUserDeposit).where(TgUserDeposit.id == user_deposit_id)
+        user_deposit = session.exec(statement).first()
+        agent_id = user_deposit.user_agent_id
+        tg_user_id = user_deposit.tg_user_id
+
+    TgUserDeposit.update_status(user_deposit_id, TgUserDepositStatus.FAILED)
+    send_user_notification(agent_id, tg_user_id, f"Payment error: we cannot confirm the approve tx. You can safely try to pay again now.")
+
+
+def add_user_deposit_balance(user_deposit: TgUserDeposit, session: Session):
+    statement = select(TgUserAccount).where(TgUserAccount.tg_user_id == user_deposit.tg_user_id)
+    tg_user_account = session.exec(statement).first()
+
+    if tg_user_account is None:
+        tg_user_account = TgUserAccount(
+            tg_user_id=user_deposit.tg_user_id,
+            balance=user_deposit.amount
+        )
+    else:
+        tg_user_account.balance = TgUserAccount.balance + user_deposit.amount
+
+    session.add(tg_user_account)
+
+
+def confirm_user_deposit(user_deposit_id: int):
+    # The tx is confirmed but not finalized yet
+    # Credit the balance so that the user can play
+    # The amount is not withdrawable until finalized
+    logger.info(f"[Collect User Deposit] [User Deposit {user_deposit_id}] Confirming user deposit")
     with Session(engine) as session:
 
         statement = select(TgUserDeposit).where(
@@ -213,21 +279,63 @@ def finalize_user_deposit(user_deposit_id: int):
         user_agent_id = user_deposit.user_agent_id
         tg_user_id = user_deposit.tg_user_id
 
-        # 1. Add balance to tg user account
+        add_user_deposit_balance(user_deposit, session)
 
-        statement = select(TgUserAccount).where(TgUserAccount.tg_user_id == user_deposit.tg_user_id)
-        tg_user_account = session.exec(statement).first()
+        user_deposit.status = TgUserDepositStatus.TX_CONFIRMED
+        session.add(user_deposit)
 
-        if tg_user_account is None:
-            tg_user_account = TgUserAccount(
-                tg_user_id=user_deposit.tg_user_id,
-                balance=user_deposit.amount
-            )
-        else:
-            tg_user_account.balance = TgUserAccount.balance + user_deposit.amount
+        session.commit()
 
+    send_user_notification(user_agent_id, tg_user_id, "The deposit is confirmed. Have fun! It will be withdrawable once finalized on chain.")
+    logger.info(f"[Collect User Deposit] [User Deposit {user_deposit_id}] User deposit confirmed!")
+
+
+def revert_user_deposit(user_deposit_id: int):
+    # The confirmed tx failed to finalize
+    # Take back the provisional credit
+    logger.error(f"[Collect User Deposit] [User Deposit {user_deposit_id}] Reverting confirmed user deposit")
+    with Session(engine) as session:
+
+        statement = select(TgUserDeposit).where(
+            TgUserDeposit.id == user_deposit_id
+        )
+        user_deposit = session.exec(statement).first()
+        user_agent_id = user_deposit.user_agent_id
+        tg_user_id = user_deposit.tg_user_id
+
+        statement = select(TgUserAccount).where(TgUserAccount.tg_user_id == tg_user_id)
+        tg_user_account = session.exec(statement).first()
+        tg_user_account.balance = TgUserAccount.balance - user_deposit.amount
         session.add(tg_user_account)
 
+        user_deposit.status = TgUserDepositStatus.FAILED
+        session.add(user_deposit)
+
+        session.commit()
+
+    send_user_notification(user_agent_id, tg_user_id, "Payment error: the deposit tx failed on chain. The deposit is removed from your balance.")
+    logger.error(f"[Collect User Deposit] [User Deposit {user_deposit_id}] User deposit reverted!")
+
+
+def finalize_user_deposit(user_deposit_id: int):
+    logger.info(f"[Collect User Deposit] [User Deposit {user_deposit_id}] Finalizing user deposit")
+    with Session(engine) as session:
+
+        statement = select(TgUserDeposit).where(
+            TgUserDeposit.id == user_deposit_id
+        )
+        user_deposit = session.exec(statement).first()
+        user_agent_id = user_deposit.user_agent_id
+        tg_user_id = user_deposit.tg_user_id
+        address = user_deposit.address
+        provisionally_credited = user_deposit.status == TgUserDepositStatus.TX_CONFIRMED
+
+        # 1. Add balance to tg user account
+        # Already added if the deposit was confirmed provisionally
+
+        if not provisionally_credited:
+            add_user_deposit_balance(user_deposit, session)
+
         # 2. Activate user referral
 
         UserReferrals.activate(tg_user_id, session)
@@ -239,7 +347,12 @@ def finalize_user_deposit(user_deposit_id: int):
 
         session.commit()
 
-    send_user_notification(user_agent_id, tg_user_id, "The deposit is received. Have fun!")
+    awe_on_chain.add_known_token_account(address)
+
+    if provisionally_credited:
+        send_user_notification(user_agent_id, tg_user_id, "The deposit is finalized and now withdrawable.")
+    else:
+        send_user_notification(user_agent_id, tg_user_id, "The deposit is received. Have fun!")
     logger.info(f"[Collect User Deposit] [User Deposit {user_deposit_id}] User deposit finalized!")
 
 
@@ -269,20 +382,32 @@ def collect_user_staking(agent_id: int, tg_user_id: str, amount: int, approve_tx
 
     logger.info(f"[Collect User Staking] [User Staking {staking_id}] User Staking created! {approve_tx}")
 
-    try:
-        # Wait for the approve tx to be confirmed before next step
-        awe_on_chain.wait_for_tx_confirmation(approve_tx, settings.solana_tx_wait_timeout)
-    except Exception as e:
-        logger.error(e)
-        logger.error(f"[Collect User Staking] [User Staking {staking_id}] Error waiting for approve tx confirmation")
-        UserStaking.update_staking_status(staking_id, UserStakingStatus.FAILED)
-        send_user_notification(agent_id, tg_user_id, f"Staking error: we cannot confirm the approve tx. You can safely try to stake again now.")
-        return
+    # The approve tx will be confirmed by the payment processor
+    # before collecting the staking
+
+
+def collect_approved_user_staking(staking_id: int):
 
+    with Session(engine) as session:
+        statement = select(UserStaking).where(UserStaking.id == staking_id)
+        user_staking = session.exec(statement).first()
+        wallet_address = user_staking.address
+        amount = user_staking.amount
+
+    UserStaking.update_staking_status(staking_id, UserStakingStatus.APPROVED)
     logger.info(f"[Collect User Staking] [User Staking {staking_id}] Approve tx confirmed!")
 
     # Collect user staking
+    if settings.solana_tx_async_dispatch:
+        # The tx will be recorded by the task
+        awe_on_chain.collect_user_staking(staking_id, wallet_address, amount, write_back=True)
+        return
+
     tx, last_valid_block_height = awe_on_chain.collect_user_staking(staking_id, wallet_address, amount)
+    record_user_staking_tx(staking_id, tx, last_valid_block_height)
+
+
+def record_user_staking_tx(staking_id: int, tx: str, last_valid_block_height: int):
 
     logger.info(f"[Collect User Staking] [User Staking {staking_id}] Transfer tx sent! {tx}")
 
@@ -301,6 +426,41 @@ def collect_user_staking(agent_id: int, tg_user_id: str, amount: int, approve_tx
     logger.info(f"[Collect User Staking] [User Staking {staking_id}] Transfer tx recorded!")
 
 
+def fail_user_staking_approval(staking_id: int):
+    logger.error(f"[Collect User Staking] [User Staking {staking_id}] Error confirming the approve tx")
+
+    with Session(engine) as session:
+        statement = select(UserStaking).where(UserStaking.id == staking_id)
+        user_staking = session.exec(statement).first()
+        agent_id = user_staking.user_agent_id
+        tg_user_id = user_staking.tg_user_id
+
+    UserStaking.update_staking_status(staking_id, UserStakingStatus.FAILED)
+    send_user_notification(agent_id, tg_user_id, f"Staking error: we cannot confirm the approve tx. You can safely try to stake again now.")
+
+
+def confirm_user_staking(staking_id: int):
+    # The tx is confirmed but not finalized yet
+    # The staking is counted once finalized
+    with Session(engine) as session:
+        statement = select(UserStaking).where(
+            UserStaking.id == staking_id
+        )
+        user_staking = session.exec(statement).first()
+
+        agent_id = user_staking.user_agent_id
+        tg_user_id = user_staking.tg_user_id
+
+        user_staking.status = UserStakingStatus.TX_CONFIRMED
+        session.add(user_staking)
+
+        session.commit()
+
+    logger.info(f"[Collect User Staking] [User Staking {staking_id}] Staking confirmed!")
+
+    send_user_notification(agent_id, tg_user_id, "The staking is confirmed. It will be in position once finalized on chain.")
+
+
 def finalize_user_staking(staking_id: int):
     with Session(engine) as session:
         statement = select(UserStaking).where(
@@ -310,20 +470,27 @@ def finalize_user_staking(staking_id: int):
 
         agent_id = user_staking.user_agent_id
         tg_user_id = user_staking.tg_user_id
+        address = user_staking.address
 
         record_user_staking(user_staking.user_agent_id, user_staking.address, user_staking.amount, session)
+        UserStakingAggregates.add_staking(user_staking.user_agent_id, user_staking.created_at, user_staking.amount, session)
 
         user_staking.status = UserStakingStatus.SUCCESS
         session.add(user_staking)
 
         session.commit()
 
+    mark_agent_dirty(agent_id)
+    invalidate_stats_dashboard(agent_id)
+
+    awe_on_chain.add_known_token_account(address)
+
     logger.info(f"[Collect User Staking] [User Staking {staking_id}] Staking finalized!")
 
     send_user_notification(agent_id, tg_user_id, "The staking is in position. Have fun!")
 
 
-def withdraw_to_user(user_agent_id: int, tg_user_id: str, user_address: str, amount: int) -> str:
+def withdraw_to_user(user_agent_id: int, tg_user_id: str, user_address: str, amount: int) -> Optional[str]:
 
     logger.info(f"[Withdraw To User] Withdraw $AWE {amount} to user {tg_user_id}({user_address})")
 
@@ -337,8 +504,16 @@ def withdraw_to_user(user_agent_id: int, tg_user_id: str, user_address: str, amo
             statement = select(TgUserAccount).where(TgUserAccount.tg_user_id == tg_user_id)
             tg_user_account = session.exec(statement).first()
 
-            if tg_user_account.balance < amount + settings.withdraw_tx_fee:
-                raise WithdrawNotAllowedException(f"Not enough tokens to withdraw in your account: {amount + settings.withdraw_tx_fee}/{tg_user_account.balance}")
+            # The deposits not finalized yet are not withdrawable
+            statement = select(func.sum(TgUserDeposit.amount)).where(
+                TgUserDeposit.tg_user_id == tg_user_id,
+                TgUserDeposit.status == TgUserDepositStatus.TX_CONFIRMED
+            )
+            unfinalized_amount = session.exec(statement).first() or 0
+            withdrawable = tg_user_account.balance - unfinalized_amount
+
+            if withdrawable < amount + settings.withdraw_tx_fee:
+                raise WithdrawNotAllowedException(f"Not enough tokens to withdraw in your account: {amount + settings.withdraw_tx_fee}/{withdrawable}")
 
             tg_user_account.balance = TgUserAccount.balance - (amount + settings.withdraw_tx_fee)
 
@@ -373,7 +548,10 @@ def withdraw_to_user(user_agent_id: int, tg_user_id: str, user_address: str, amo
     logger.info(f"[Withdraw To User] [User Withdraw {user_withdraw_id}] Withdraw created!")
 
     # Send the transaction
-    tx, last_valid_block_height = awe_on_chain.transfer_to_user(f"withdraw_{user_withdraw_id}", user_address, amount)
+    return send_transfer(f"withdraw_{user_withdraw_id}", user_address, amount)
+
+
+def record_withdraw_to_user_tx(user_withdraw_id: int, tx: str, last_valid_block_height: int, notify_user: bool = False):
 
     logger.info(f"[Withdraw To User] [User Withdraw {user_withdraw_id}] Tx sent! {tx}")
 
@@ -386,12 +564,17 @@ def withdraw_to_user(user_agent_id: int, tg_user_id: str, user_address: str, amo
         user_withdraw.tx_last_valid_block_height = last_valid_block_height
         user_withdraw.status = TgUserWithdrawStatus.TX_SENT
 
+        user_agent_id = user_withdraw.user_agent_id
+        tg_user_id = user_withdraw.tg_user_id
+        amount = user_withdraw.amount
+
         session.add(user_withdraw)
         session.commit()
 
     logger.info(f"[Withdraw To User] [User Withdraw {user_withdraw_id}] Tx recorded!")
 
-    return tx
+    if notify_user:
+        send_user_notification(user_agent_id, tg_user_id, f"$AWE {amount}.00 has been transferred to your wallet. The transaction should be confirmed in a short while:\n\n{tx}")
 
 
 def finalize_withdraw_to_user(user_withdraw_id: int):
@@ -401,15 +584,18 @@ def finalize_withdraw_to_user(user_withdraw_id: int):
     with Session(engine) as session:
         statement = select(TgUserWithdraw).where(TgUserWithdraw.id == user_withdraw_id)
         user_withdraw = session.exec(statement).first()
+        address = user_withdraw.address
         user_withdraw.status = TgUserWithdrawStatus.SUCCESS
         session.add(user_withdraw)
 
         session.commit()
 
+    awe_on_chain.add_known_token_account(address)
+
     logger.info(f"[Withdraw To User] [User Withdraw {user_withdraw_id}] User withdraw finalized!")
 
 
-def release_user_staking(agent_id: int, tg_user_id: str, staking_id: int, wallet_address: str) -> str:
+def release_user_staking(agent_id: int, tg_user_id: str, staking_id: int, wallet_address: str) -> Optional[str]:
 
     # Lock the agent to prevent race condition
     if staking_id not in staking_locks:
@@ -452,7 +638,10 @@ def release_user_staking(agent_id: int, tg_user_id: str, staking_id: int, wallet
 
     # Send the transaction
     logger.info(f"[Release User Staking] [{staking_id}] Sending tx: {wallet_address}:{amount}")
-    tx, last_valid_block_height = awe_on_chain.transfer_to_user(f"release_staking_{user_staking_id}", wallet_address, amount)
+    return send_transfer(f"release_staking_{user_staking_id}", wallet_address, amount)
+
+
+def record_release_staking_tx(staking_id: int, tx: str, last_valid_block_height: int, notify_user: bool = False):
 
     logger.info(f"[Release User Staking] [{staking_id}] Release staking tx sent: {tx}")
 
@@ -464,12 +653,17 @@ def release_user_staking(agent_id: int, tg_user_id: str, staking_id: int, wallet
         user_staking.release_tx_hash = tx
         user_staking.tx_last_valid_block_height = last_valid_block_height # reuse the same field
         user_staking.release_status = UserStakingStatus.TX_SENT
+
+        agent_id = user_staking.user_agent_id
+        tg_user_id = user_staking.tg_user_id
+
         session.add(user_staking)
         session.commit()
 
     logger.info(f"[Release User Staking] [{staking_id}] Release staking tx recorded!")
 
-    return tx
+    if notify_user:
+        send_user_notification(agent_id, tg_user_id, f"Your staking has been returned!\n\n{tx}")
 
 
 def finalize_release_staking(staking_id: int):
@@ -479,15 +673,24 @@ def finalize_release_staking(staking_id: int):
     with Session(engine) as session:
         statement = select(UserStaking).where(UserStaking.id == staking_id)
         user_staking = session.exec(statement).first()
+        agent_id = user_staking.user_agent_id
+        address = user_staking.address
 
         record_user_staking_release(user_staking.user_agent_id, user_staking.address, user_staking.amount, session)
 
         user_staking.release_status = UserStakingStatus.SUCCESS
         user_staking.released_at = unix_timestamp_in_seconds()
+
+        UserStakingAggregates.release_staking(user_staking.user_agent_id, user_staking.created_at, user_staking.released_at, user_staking.amount, session)
         session.add(user_staking)
 
         session.commit()
 
+    mark_agent_dirty(agent_id)
+    invalidate_stats_dashboard(agent_id)
+
+    awe_on_chain.add_known_token_account(address)
+
     logger.info(f"[Release User Staking] [{staking_id}] Finalized!")
 
 
@@ -510,16 +713,31 @@ def collect_game_pool_charge(agent_id: int, user_address: str, amount: int, appr
 
     logger.info(f"[Game Pool Charge] [{charge_id}] Game pool charge request recorded! {approve_tx}")
 
-    try:
-        awe_on_chain.wait_for_tx_confirmation(approve_tx, settings.solana_tx_wait_timeout)
-    except Exception as e:
-        logger.error(e)
-        GamePoolCharge.update_status(charge_id, GamePoolChargeStatus.FAILED)
-        raise Exception(f"[Game Pool Charge] [{charge_id}] Cannot confirm the apporve tx.")
+    # The approve tx will be confirmed by the payment processor
+    # before collecting the charge
+
+
+def collect_approved_game_pool_charge(charge_id: int):
 
+    with Session(engine) as session:
+        statement = select(GamePoolCharge).where(GamePoolCharge.id == charge_id)
+        game_pool_charge = session.exec(statement).first()
+        user_address = game_pool_charge.address
+        amount = game_pool_charge.amount
+
+    GamePoolCharge.update_status(charge_id, GamePoolChargeStatus.APPROVED)
     logger.info(f"[Game Pool Charge] [{charge_id}] Approve tx confirmed!")
 
+    if settings.solana_tx_async_dispatch:
+        # The tx will be recorded by the task
+        awe_on_chain.collect_game_pool_charge(charge_id, user_address, amount, write_back=True)
+        return
+
     collect_tx, last_valid_block_height = awe_on_chain.collect_game_pool_charge(charge_id, user_address, amount)
+    record_game_pool_charge_tx(charge_id, collect_tx, last_valid_block_height)
+
+
+def record_game_pool_charge_tx(charge_id: int, collect_tx: str, last_valid_block_height: int):
 
     logger.info(f"[Game Pool Charge] [{charge_id}] Transfer tx sent! {collect_tx}")
 
@@ -535,12 +753,19 @@ def collect_game_pool_charge(agent_id: int, user_address: str, amount: int, appr
     logger.info(f"[Game Pool Charge] [{charge_id}] Transfer tx recorded!")
 
 
+def fail_game_pool_charge_approval(charge_id: int):
+    logger.error(f"[Game Pool Charge] [{charge_id}] Cannot confirm the apporve tx.")
+    GamePoolCharge.update_status(charge_id, GamePoolChargeStatus.FAILED)
+
+
 def finalize_game_pool_charge(charge_id: int):
 
     with Session(engine) as session:
 
         statement = select(GamePoolCharge).where(GamePoolCharge.id == charge_id)
         game_pool_charge = session.exec(statement).first()
+        address = game_pool_charge.address
+        agent_id = game_pool_charge.user_agent_id
 
         statement = select(UserAgent).where(UserAgent.id == game_pool_charge.user_agent_id)
         user_agent = session.exec(statement).first()
@@ -555,6 +780,10 @@ def finalize_game_pool_charge(charge_id: int):
 
         session.commit()
 
+    mark_agent_dirty(agent_id)
+
+    awe_on_chain.add_known_token_account(address)
+
     logger.info(f"[Game Pool Charge] [{charge_id}] Game pool charge finalized!")
 
 
@@ -579,7 +808,10 @@ def refund_agent_staking(agent_id: int, creator_address: str, amount: int):
 
     logger.info(f"[Refund Agent Staking] [{refund_id}] request created!")
 
-    tx, last_valid_block_height = awe_on_chain.transfer_to_user(f"agent_refund_{refund_id}", creator_address, amount)
+    send_transfer(f"agent_refund_{refund_id}", creator_address, amount)
+
+
+def record_refund_agent_staking_tx(refund_id: int, tx: str, last_valid_block_height: int):
 
     logger.info(f"[Refund Agent Staking] [{refund_id}] tx sent! {tx}")
 
@@ -606,12 +838,15 @@ def finalize_refund_agent_staking(refund_id: int):
     with Session(engine) as session:
         statement = select(UserAgentRefund).where(UserAgentRefund.id == refund_id)
         agent_refund = session.exec(statement).first()
+        address = agent_refund.address
 
         agent_refund.status = UserAgentRefundStatus.SUCCESS
 
         session.add(agent_refund)
         session.commit()
 
+    awe_on_chain.add_known_token_account(address)
+
     logger.info(f"[Refund Agent Staking] [{refund_id}] refund finalized!")
 
 
@@ -673,7 +908,10 @@ def withdraw_to_creator(agent_id: int, amount: int):
     logger.info(f"[Withdraw To Creator] [Agent Withdraw {agent_withdraw_id}] Withdraw created!")
 
     # Send the transaction
-    tx, last_valid_block_height = awe_on_chain.transfer_to_user(f"agent_withdraw_{agent_withdraw_id}", agent_creator_address, amount)
+    return send_transfer(f"agent_withdraw_{agent_withdraw_id}", agent_creator_address, amount)
+
+
+def record_withdraw_to_creator_tx(agent_withdraw_id: int, tx: str, last_valid_block_height: int):
 
     logger.info(f"[Withdraw To Creator] [Agent Withdraw {agent_withdraw_id}] Tx sent! {tx}")
 
@@ -691,8 +929,6 @@ def withdraw_to_creator(agent_id: int, amount: int):
 
     logger.info(f"[Withdraw To Creator] [Agent Withdraw {agent_withdraw_id}] Tx recorded!")
 
-    return tx
-
 
 def finalize_withdraw_to_creator(agent_withdraw_id: int):
     logger.info(f"[Withdraw To Creator] [Agent Withdraw {agent_withdraw_id}] finalizing agent account withdraw")
@@ -700,10 +936,61 @@ def finalize_withdraw_to_creator(agent_withdraw_id: int):
     with Session(engine) as session:
         statement = select(AgentAccountWithdraw).where(AgentAccountWithdraw.id == agent_withdraw_id)
         agent_withdraw = session.exec(statement).first()
+        address = agent_withdraw.address
 
         agent_withdraw.status = AgentAccountWithdrawStatus.SUCCESS
 
         session.add(agent_withdraw)
         session.commit()
 
+    awe_on_chain.add_known_token_account(address)
+
     logger.info(f"[Withdraw To Creator] [Agent Withdraw {agent_withdraw_id}] Agent account withdraw finalized!")
+
+
+# Request id prefix => function to record the sent tx
+# The ones in notifying_tx_recorders also take notify_user
+transfer_tx_recorders = {
+    "agent_creation": record_agent_creation_staking_tx,
+    "user_deposit": record_user_deposit_tx,
+    "user_staking": record_user_staking_tx,
+    "game_pool_charge": record_game_pool_charge_tx,
+    "withdraw": record_withdraw_to_user_tx,
+    "release_staking": record_release_staking_tx,
+    "agent_refund": record_refund_agent_staking_tx,
+    "agent_withdraw": record_withdraw_to_creator_tx
+}
+
+# Recorders telling the user the tx is sent, if sent without waiting for it
+notifying_tx_recorders = ["withdraw", "release_staking"]
+
+
+def record_transfer_tx(request_id: str, tx: str, last_valid_block_height: int, notify_user: bool = False):
+    prefix, record_id = request_id.rsplit("_", 1)
+
+    if prefix in notifying_tx_recorders:
+        transfer_tx_recorders[prefix](int(record_id), tx, last_valid_block_height, notify_user)
+    else:
+        transfer_tx_recorders[prefix](int(record_id), tx, last_valid_block_height)
+
+
+def send_transfer(request_id: str, address: str, amount: int) -> Optional[str]:
+    # Send the transfer right away
+    # or queue it to be sent in the next batched tx
+    # Return None if the transfer is queued or dispatched without waiting
+
+    if settings.solana_batch_transfer_enabled:
+        enqueue_transfer(request_id, address, amount)
+        logger.info(f"[Send Transfer] [{request_id}] Transfer queued")
+        return None
+
+    if settings.solana_tx_async_dispatch:
+        # The tx will be recorded by the task
+        awe_on_chain.transfer_to_user(request_id, address, amount, write_back=True)
+        logger.info(f"[Send Transfer] [{request_id}] Transfer dispatched")
+        return None
+
+    tx, last_valid_block_height = awe_on_chain.transfer_to_user(request_id, address, amount)
+    record_transfer_tx(request_id, tx, last_valid_block_height)
+
+    return tx
@@ -0,0 +1,225 @@
+from awe.db import engine
+from awe.cache import cache
+from awe.settings import settings
+from awe.models import UserAgent, UserAgentData
+from sqlmodel import Session, select
+from typing import List, Dict, Any, Tuple
+import logging
+import random
+import json
+
+logger = logging.getLogger("[Agent Leaderboard]")
+
+# The enabled agents by score, and their list items as JSON
+leaderboard_key = "AWE_AGENT_LEADERBOARD"
+leaderboard_items_key = "AWE_AGENT_LEADERBOARD_ITEMS"
+
+# Exists while the leaderboard is fresh, fully rebuilt from the DB once expired
+leaderboard_fresh_key = "AWE_AGENT_LEADERBOARD_FRESH"
+leaderboard_rebuild_lock_key = "AWE_AGENT_LEADERBOARD_REBUILD_LOCK"
+
+# The agents changed since the last refresh
+leaderboard_dirty_key = "AWE_AGENT_LEADERBOARD_DIRTY"
+
+# Increased on every change, used as the ETag of the pages
+leaderboard_version_key = "AWE_AGENT_LEADERBOARD_VERSION"
+
+# Shuffled agent ids, reshuffled once expired
+discover_key = "AWE_AGENT_DISCOVER"
+
+page_size = 20
+load_page_size = 1000
+
+
+def mark_agent_dirty(agent_id: int):
+    # The pool, staking or config of the agent changed
+    # Refreshed on the next read
+    try:
+        cache.sadd(leaderboard_dirty_key, agent_id)
+    except Exception as e:
+        logger.error(e)
+
+
+def invalidate_agent_leaderboard():
+    # Scores of all the agents changed
+    try:
+        cache.delete(leaderboard_fresh_key)
+    except Exception as e:
+        logger.error(e)
+
+
+def agent_items_statement():
+    return select(
+        UserAgent.id,
+        UserAgent.name,
+        UserAgent.score,
+        UserAgent.tg_bot,
+        UserAgent.pfp_hash,
+        UserAgentData.total_invocations,
+        UserAgentData.awe_token_quote,
+        UserAgentData.awe_token_staking
+    ).join(
+        UserAgentData, UserAgentData.user_agent_id == UserAgent.id
+    ).where(
+        UserAgent.enabled == True
+    )
+
+
+def to_agent_item(row) -> Dict[str, Any]:
+    agent_id, name, score, tg_bot, pfp_hash, invocations, pool, staking = row
+    return {
+        "id": agent_id,
+        "name": name,
+        "score": score,
+        "tg_username": tg_bot.username,
+        "description": tg_bot.start_message,
+        "pfp_hash": pfp_hash,
+        "invocations": invocations,
+        "pool": pool,
+        "staking": staking
+    }
+
+
+def rebuild_agent_leaderboard():
+    # Load all the enabled agents paged by id, no sorting in the DB
+    # Swapped in at once so that readers never see a partial leaderboard
+
+    scores = {}
+    items = {}
+
+    last_agent_id = 0
+    while True:
+        with Session(engine) as session:
+            statement = agent_items_statement().where(
+                UserAgent.id > last_agent_id
+            ).order_by(UserAgent.id.asc()).limit(load_page_size)
+
+            rows = session.exec(statement).all()
+
+        for row in rows:
+            item = to_agent_item(row)
+            scores[item["id"]] = item["score"]
+            items[item["id"]] = json.dumps(item)
+
+        if len(rows) < load_page_size:
+            break
+
+        last_agent_id = rows[-1][0]
+
+    pipeline = cache.pipeline()
+    pipeline.delete(f"{leaderboard_key}_NEW", f"{leaderboard_items_key}_NEW")
+
+    if len(scores) != 0:
+        pipeline.zadd(f"{leaderboard_key}_NEW", scores)
+        pipeline.hset(f"{leaderboard_items_key}_NEW", mapping=items)
+        pipeline.rename(f"{leaderboard_key}_NEW", leaderboard_key)
+        pipeline.rename(f"{leaderboard_items_key}_NEW", leaderboard_items_key)
+    else:
+        pipeline.delete(leaderboard_key, leaderboard_items_key)
+
+    pipeline.set(leaderboard_fresh_key, 1, ex=settings.agent_leaderboard_ttl)
+    pipeline.incr(leaderboard_version_key)
+    pipeline.execute()
+
+    logger.info(f"Leaderboard rebuilt with {len(scores)} agents")
+
+
+def refresh_dirty_agents():
+    agent_ids = [int(agent_id) for agent_id in cache.spop(leaderboard_dirty_key, load_page_size)]
+
+    if len(agent_ids) == 0:
+        return
+
+    with Session(engine) as session:
+        statement = agent_items_statement().where(UserAgent.id.in_(agent_ids))
+        rows = session.exec(statement).all()
+
+    items = [to_agent_item(row) for row in rows]
+
+    # Not enabled anymore
+    removed_agent_ids = set(agent_ids) - set([item["id"] for item in items])
+
+    pipeline = cache.pipeline()
+
+    if len(items) != 0:
+        pipeline.zadd(leaderboard_key, {item["id"]: item["score"] for item in items})
+        pipeline.hset(leaderboard_items_key, mapping={item["id"]: json.dumps(item) for item in items})
+
+    if len(removed_agent_ids) != 0:
+        pipeline.zrem(leaderboard_key, *removed_agent_ids)
+        pipeline.hdel(leaderboard_items_key, *removed_agent_ids)
+
+    pipeline.incr(leaderboard_version_key)
+    pipeline.execute()
+
+    logger.debug(f"{len(items)} agents refreshed, {len(removed_agent_ids)} removed")
+
+
+def ensure_agent_leaderboard():
+    if not cache.exists(leaderboard_fresh_key):
+        # Only one rebuild at a time, the others keep serving the stale one
+        # Unless there's nothing to serve yet
+        if cache.set(leaderboard_rebuild_lock_key, 1, nx=True, ex=60):
+            try:
+                rebuild_agent_leaderboard()
+            finally:
+                cache.delete(leaderboard_rebuild_lock_key)
+        elif not cache.exists(leaderboard_key):
+            rebuild_agent_leaderboard()
+
+    if cache.scard(leaderboard_dirty_key) != 0:
+        refresh_dirty_agents()
+
+
+def get_agent_items(agent_ids: List[int]) -> List[Dict[str, Any]]:
+    if len(agent_ids) == 0:
+        return []
+
+    return [json.loads(item) for item in cache.hmget(leaderboard_items_key, agent_ids) if item is not None]
+
+
+def get_leaderboard_version() -> int:
+    return int(cache.get(leaderboard_version_key) or 0)
+
+
+def get_leaderboard_page(page: int) -> Tuple[List[Dict[str, Any]], int]:
+    # Return the agent items of the page and the leaderboard version
+    ensure_agent_leaderboard()
+
+    version = get_leaderboard_version()
+
+    agent_ids = [int(agent_id) for agent_id in cache.zrevrange(leaderboard_key, page * page_size, (page + 1) * page_size - 1)]
+
+    return get_agent_items(agent_ids), version
+
+
+def get_discover_page() -> List[Dict[str, Any]]:
+    # A random window of the shuffled agent list
+    ensure_agent_leaderboard()
+
+    num_agents = cache.llen(discover_key)
+
+    if num_agents == 0:
+        agent_ids = [int(agent_id) for agent_id in cache.zrange(leaderboard_key, 0, -1)]
+
+        if len(agent_ids) == 0:
+            return []
+
+        random.shuffle(agent_ids)
+
+        pipeline = cache.pipeline()
+        pipeline.delete(discover_key)
+        pipeline.rpush(discover_key, *agent_ids)
+        pipeline.expire(discover_key, settings.agent_discover_rotation)
+        pipeline.execute()
+
+        num_agents = len(agent_ids)
+
+    start = random.randrange(num_agents)
+    agent_ids = [int(agent_id) for agent_id in cache.lrange(discover_key, start, start + page_size - 1)]
+
+    # Wrap around the end of the list
+    if len(agent_ids) < page_size and num_agents > len(agent_ids):
+        agent_ids += [int(agent_id) for agent_id in cache.lrange(discover_key, 0, min(page_size, num_agents) - len(agent_ids) - 1)]
+
+    return get_agent_items(agent_ids)
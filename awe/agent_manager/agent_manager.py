@@ -4,13 +4,13 @@ import multiprocessing as mp
 import time
 import logging
 import signal
-from awe.db import engine, init_engine
+from awe.db import engine, init_engine, DBRole, report_connection_footprint
 from awe.cache import init_cache
 from sqlmodel import Session, select
 
 
 def start_user_agent(user_agent_config: UserAgentConfig):
-    init_engine()
+    init_engine(DBRole.AGENT)
     init_cache()
     user_agent = UserAgent(user_agent_config)
     user_agent.start_tg_bot()
@@ -89,6 +89,9 @@ class AgentManager:
                     self.logger.debug(f"Stopping disabled updated agent {updated_agent.id}")
                     self.stop_agent_process(updated_agent.id)
 
+            if first_time_start:
+                report_connection_footprint(len(self.user_agent_processes))
+
             first_time_start = False
             self.logger.debug(f"Updated {len(updated_agents)} user agents")
 
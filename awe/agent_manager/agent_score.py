@@ -1,19 +1,18 @@
 
 from awe.db import engine
-from sqlmodel import Session, select, or_
-from awe.models import UserStaking, UserAgentStatsUserDailyCounts, UserAgent, UserAgentWeeklyEmissions
-from awe.models.user_staking import UserStakingStatus
+from sqlmodel import Session, select, or_, and_, update, delete, insert
+from awe.models import UserAgentStatsUserDailyCounts, UserAgent, UserAgentWeeklyEmissions, UserStakingAggregates
 from sqlalchemy import func
-from typing import List, Dict, Tuple
+from typing import Dict, Tuple
 import logging
 from datetime import datetime
 from awe.settings import settings
-from sqlalchemy.orm import load_only
+from awe.models.utils import unix_timestamp_in_seconds
+from .agent_leaderboard import invalidate_agent_leaderboard
+import numpy as np
 
 logger = logging.getLogger("[Agent Score]")
 
-page_size = 500
-
 def update_all_agent_scores(cycle_end_timestamp: int, dry_run: bool):
 
     cycle_start_timestamp = cycle_end_timestamp - settings.tn_emission_interval_days * 86400
@@ -23,246 +22,194 @@ def update_all_agent_scores(cycle_end_timestamp: int, dry_run: bool):
 
     logger.info(f"Updating agent scores for cycle: [{start_datetime} ({cycle_start_timestamp}), {end_datetime} ({cycle_end_timestamp}))")
 
-    # Get max staking pool size and max players in this cycle
-    max_staking_score, max_player_score = get_max_agent_scores(cycle_start_timestamp, cycle_end_timestamp)
-
-    logger.info(f"max_staking_score: {max_staking_score}, max_player_score: {max_player_score}")
-
-
-    # Check if we have already processed this cycle before
-    with Session(engine) as session:
-        statement = select(func.count(UserAgentWeeklyEmissions.id)).where(
-            UserAgentWeeklyEmissions.day == cycle_start_timestamp
-        )
-
-        count = session.exec(statement).first()
-
-        cycle_processed_before = count != 0
-
-    logger.info(f"Cycle processed before: {cycle_processed_before}")
-
-    current_page = 0
-
-    while(True):
-
-        with Session(engine) as session:
-            statement = select(UserAgent).options(load_only(UserAgent.id, UserAgent.score)).where(
-                or_(UserAgent.deleted_at.is_(None), UserAgent.deleted_at >= cycle_start_timestamp),
-                UserAgent.created_at < cycle_end_timestamp
-            ).order_by(UserAgent.id.asc()).offset(current_page * page_size).limit(page_size)
-
-            user_agents = session.exec(statement).all()
+    # Aggregate the stakings and players of all agents in one query each
+    agent_stakings = get_all_agent_stakings(cycle_start_timestamp, cycle_end_timestamp)
+    agent_players = get_all_agent_players(cycle_start_timestamp, cycle_end_timestamp)
 
-            logger.info(f"Updating scores of {len(user_agents)} agents in page {current_page}")
+    agent_ids, agent_scores = compute_agent_scores(agent_stakings, agent_players)
 
-            if len(user_agents) == 0:
-                break
+    user_agent_scores = dict(zip(agent_ids.tolist(), agent_scores.tolist()))
 
-            current_page = current_page + 1
+    for agent_id, agent_score in user_agent_scores.items():
+        logger.debug(f"Agent {agent_id} score {agent_score}")
 
-            agent_ids = [agent.id for agent in user_agents]
+    logger.info(f"{len(user_agent_scores)} agents have non-zero scores")
 
-            logger.debug("Getting agent stakings...")
-            agent_stakings = get_agent_stakings(agent_ids, cycle_end_timestamp)
-            logger.debug(agent_stakings)
+    if dry_run:
+        return
 
-            logger.debug("Getting agent players...")
-            agent_players = get_agent_players(agent_ids, cycle_end_timestamp)
-            logger.debug(agent_players)
-
-            user_agent_scores = {}
+    with Session(engine) as session:
 
-            logger.debug("Updating agent scores...")
-            for user_agent in user_agents:
+        # Reset all the scores first
+        # The agents without stakings or players keep zero
+        statement = update(UserAgent).where(
+            agent_in_cycle(cycle_start_timestamp, cycle_end_timestamp),
+            UserAgent.score != 0
+        ).values(score=0)
 
-                agent_id = user_agent.id
+        session.execute(statement)
 
-                agent_staking_score = agent_stakings[agent_id] if agent_id in agent_stakings else 0
-                agent_player_score = agent_players[agent_id] if agent_id in agent_players else 0
+        # Bulk update by primary key
+        if len(user_agent_scores) != 0:
+            session.execute(update(UserAgent), [
+                {"id": agent_id, "score": agent_score} for agent_id, agent_score in user_agent_scores.items()
+            ])
 
-                if agent_staking_score == 0 and agent_player_score == 0:
-                    agent_score = 0
-                else:
-                    staking_score = 0 if max_staking_score == 0 else agent_staking_score / max_staking_score
-                    player_score = 0 if max_player_score == 0 else agent_player_score / max_player_score
-                    agent_score = 0 if staking_score + player_score == 0 else 2 * staking_score * player_score / ( staking_score + player_score )
-                    agent_score = int(agent_score * 10000)
+        session.commit()
 
-                logger.info(f"Agent {agent_id} score {agent_score}")
+    logger.info(f"Agent scores updated")
 
-                user_agent.score = agent_score
+    invalidate_agent_leaderboard()
 
-                session.add(user_agent)
+    update_cycle_emission_scores(cycle_start_timestamp, cycle_end_timestamp, user_agent_scores)
 
-                user_agent_scores[agent_id] = agent_score
+    logger.info(f"All agent scores updated")
 
-                if not cycle_processed_before:
-                    if agent_score != 0:
-                        logger.debug("Adding weekly emission record")
-                        # Record weekly agent emissions
-                        weekly_emission = UserAgentWeeklyEmissions(
-                            user_agent_id=agent_id,
-                            day=cycle_start_timestamp,
-                            score=agent_score
-                        )
-                        session.add(weekly_emission)
-                    else:
-                        logger.debug("Agent score zero. Skip record.")
 
-            if not dry_run:
-                session.commit()
+def agent_in_cycle(cycle_start_timestamp: int, cycle_end_timestamp: int):
+    # The agents alive in the cycle
+    return and_(
+        or_(UserAgent.deleted_at.is_(None), UserAgent.deleted_at >= cycle_start_timestamp),
+        UserAgent.created_at < cycle_end_timestamp
+    )
 
-        logger.info(f"{len(user_agents)} agent scores updated")
 
-        if dry_run:
-            return
+def staking_in_position(cycle_start_timestamp: int, cycle_end_timestamp: int):
+    # The staking aggregates created before the cycle and not released during it
+    # Cycle boundaries only, the aggregates are grouped by cycle
+    return and_(
+        UserStakingAggregates.created_cycle < cycle_start_timestamp,
+        or_(UserStakingAggregates.released_cycle == 0, UserStakingAggregates.released_cycle >= cycle_end_timestamp)
+    )
 
-        if cycle_processed_before:
-            logger.info(f"Updating cycle emissions instead of creating")
 
-            # Update instead of insert
-            # Might missing some records
-            with Session(engine) as session:
-                statement = select(UserAgentWeeklyEmissions).where(
-                    UserAgentWeeklyEmissions.user_agent_id.in_(user_agent_scores.keys()),
-                    UserAgentWeeklyEmissions.day == cycle_start_timestamp
-                )
+def compute_agent_scores(agent_stakings: Dict[int, int], agent_players: Dict[int, int]) -> Tuple[np.ndarray, np.ndarray]:
+    # Harmonic mean of the staking score and the player score
+    # Both normalized by the max value among all agents
+    # Return the ids and scores of the agents with non-zero scores
 
-                cycle_emissions = session.exec(statement).all()
+    agent_ids = np.array(sorted(agent_stakings.keys() | agent_players.keys()), dtype=np.int64)
 
-                logger.info(f"{len(cycle_emissions)} agents has cycle emission record before.")
+    if len(agent_ids) == 0:
+        return agent_ids, np.zeros(0, dtype=np.int64)
 
-                # Update existing records
-                for cycle_emission in cycle_emissions:
-                    if user_agent_scores[cycle_emission.user_agent_id] != 0:
-                        cycle_emission.score = user_agent_scores[cycle_emission.user_agent_id]
-                        del user_agent_scores[cycle_emission.user_agent_id]
-                        session.add(cycle_emission)
-                    else:
-                        # Delete the zero score record
-                        session.delete(cycle_emission)
+    stakings = np.array([agent_stakings.get(agent_id, 0) for agent_id in agent_ids.tolist()], dtype=np.float64)
+    players = np.array([agent_players.get(agent_id, 0) for agent_id in agent_ids.tolist()], dtype=np.float64)
 
-                logger.info(f"{len(user_agent_scores.keys())} agents doesn't have cycle emission record before.")
+    max_staking_score = stakings.max()
+    max_player_score = players.max()
 
-                # Add missing records
-                for agent_id in user_agent_scores:
-                    if user_agent_scores[agent_id] != 0:
-                        cycle_emission = UserAgentWeeklyEmissions(
-                            user_agent_id=agent_id,
-                            day=cycle_start_timestamp,
-                            score=user_agent_scores[agent_id]
-                        )
-                        session.add(cycle_emission)
+    logger.info(f"max_staking_score: {int(max_staking_score)}, max_player_score: {int(max_player_score)}")
 
-                session.commit()
+    staking_scores = stakings / max_staking_score if max_staking_score != 0 else np.zeros_like(stakings)
+    player_scores = players / max_player_score if max_player_score != 0 else np.zeros_like(players)
 
-            logger.info(f"Cycle emissions updated!")
+    score_sums = staking_scores + player_scores
+    harmonic_means = np.divide(
+        2 * staking_scores * player_scores,
+        score_sums,
+        out=np.zeros_like(score_sums),
+        where=score_sums != 0
+    )
 
-    logger.info(f"All agent scores updated")
+    agent_scores = (harmonic_means * 10000).astype(np.int64)
 
+    non_zero = agent_scores != 0
 
-def get_max_agent_scores(cycle_start_timestamp: int, cycle_end_timestamp: int) -> Tuple[int, int]:
+    return agent_ids[non_zero], agent_scores[non_zero]
 
-    total_agents = 0
-    max_staking_score = 0
-    max_player_score = 0
 
-    current_page = 0
+def update_cycle_emission_scores(cycle_start_timestamp: int, cycle_end_timestamp: int, user_agent_scores: Dict[int, int]):
 
     with Session(engine) as session:
-        while(True):
-            statement = select(UserAgent.id).where(
-                or_(UserAgent.deleted_at.is_(None), UserAgent.deleted_at >= cycle_start_timestamp),
-                UserAgent.created_at < cycle_end_timestamp
-            ).order_by(UserAgent.id.asc()).offset(current_page * page_size).limit(page_size)
 
-            agent_ids = session.exec(statement).all()
+        # The existing records of the agents in this cycle
+        statement = select(UserAgentWeeklyEmissions.id, UserAgentWeeklyEmissions.user_agent_id).join(
+            UserAgent, UserAgent.id == UserAgentWeeklyEmissions.user_agent_id
+        ).where(
+            UserAgentWeeklyEmissions.day == cycle_start_timestamp,
+            agent_in_cycle(cycle_start_timestamp, cycle_end_timestamp)
+        )
 
-            logger.info(f"Getting max values: fetched {len(agent_ids)} agents for page {current_page}")
+        cycle_emissions = session.exec(statement).all()
 
-            if len(agent_ids) == 0:
-                break
+        logger.info(f"{len(cycle_emissions)} agents has cycle emission record before.")
 
-            total_agents = total_agents + len(agent_ids)
+        updated_records = []
+        deleted_record_ids = []
 
-            current_page = current_page + 1
+        for record_id, agent_id in cycle_emissions:
+            if agent_id in user_agent_scores:
+                updated_records.append({"id": record_id, "score": user_agent_scores[agent_id]})
+            else:
+                # Delete the zero score record
+                deleted_record_ids.append(record_id)
 
-            logger.info("Getting agent stakings...")
-            page_agent_stakings = get_agent_stakings(agent_ids, cycle_end_timestamp)
-            logger.debug(page_agent_stakings)
+        existing_agent_ids = set([agent_id for _, agent_id in cycle_emissions])
 
-            if len(page_agent_stakings.keys()) != 0:
-                page_max_staking_score = max(page_agent_stakings.values())
-                max_staking_score = max(page_max_staking_score, max_staking_score)
+        now = unix_timestamp_in_seconds()
 
-            logger.info("Getting agent players...")
-            page_agent_players = get_agent_players(agent_ids, cycle_end_timestamp)
-            logger.debug(page_agent_players)
+        new_records = [{
+                "user_agent_id": agent_id,
+                "day": cycle_start_timestamp,
+                "score": agent_score,
+                "emission": 0,
+                "created_at": now
+            } for agent_id, agent_score in user_agent_scores.items() if agent_id not in existing_agent_ids
+        ]
 
-            if len(page_agent_players.keys()) != 0:
-                page_max_player_score = max(page_agent_players.values())
-                max_player_score = max(page_max_player_score, max_player_score)
+        logger.info(f"Cycle emissions: {len(updated_records)} to update, {len(deleted_record_ids)} to delete, {len(new_records)} to add")
 
+        if len(updated_records) != 0:
+            session.execute(update(UserAgentWeeklyEmissions), updated_records)
 
-    logger.info(f"Total agents: {total_agents}")
-    logger.info(f"Max agent staking score: {max_staking_score}")
-    logger.info(f"Max agent player score: {max_player_score}")
+        if len(deleted_record_ids) != 0:
+            session.execute(delete(UserAgentWeeklyEmissions).where(UserAgentWeeklyEmissions.id.in_(deleted_record_ids)))
 
-    return max_staking_score, max_player_score
+        if len(new_records) != 0:
+            session.execute(insert(UserAgentWeeklyEmissions), new_records)
 
+        session.commit()
 
-def get_agent_stakings(agent_ids: List[int], day_timestamp: int) -> Dict[int, int]:
+    logger.info(f"Cycle emissions updated!")
 
-    start_timestamp = day_timestamp - settings.tn_emission_interval_days * 86400
-    end_timestamp = day_timestamp
 
-    logger.info(f"Getting agent stakings for {len(agent_ids)} agents")
-    logger.info(f"start before {start_timestamp} - end after {end_timestamp}")
+def get_all_agent_stakings(cycle_start_timestamp: int, cycle_end_timestamp: int) -> Dict[int, int]:
+    # The stakings staying in position during the whole cycle
+    # Read from the aggregates, one row per agent and created/released cycle
 
     with Session(engine) as session:
-        statement = select(UserStaking.user_agent_id, func.sum(UserStaking.amount)).where(
-            UserStaking.user_agent_id.in_(agent_ids),
-            or_(UserStaking.released_at.is_(None), UserStaking.released_at >= end_timestamp),
-            UserStaking.created_at < start_timestamp,
-            UserStaking.status == UserStakingStatus.SUCCESS
-        ).group_by(UserStaking.user_agent_id)
+        statement = select(UserStakingAggregates.user_agent_id, func.sum(UserStakingAggregates.amount)).join(
+            UserAgent, UserAgent.id == UserStakingAggregates.user_agent_id
+        ).where(
+            agent_in_cycle(cycle_start_timestamp, cycle_end_timestamp),
+            staking_in_position(cycle_start_timestamp, cycle_end_timestamp)
+        ).group_by(UserStakingAggregates.user_agent_id)
 
         user_stakings = session.exec(statement).all()
 
-        logger.info(f"Total agent stakings: {len(user_stakings)}")
-
-        agent_staking_scores = {}
-
-        for agent_id, total_amount in user_stakings:
-            agent_staking_scores[agent_id] = int(total_amount)
+    logger.info(f"Total agent stakings: {len(user_stakings)}")
 
+    return {agent_id: int(total_amount) for agent_id, total_amount in user_stakings}
 
-    return agent_staking_scores
 
-
-def get_agent_players(agent_ids: List[int], day_timestamp: int) -> int:
-    start_timestamp = day_timestamp - settings.tn_emission_interval_days * 86400
-    end_timestamp = day_timestamp
-
-    logger.info(f"Getting agent players for {len(agent_ids)} agents")
+def get_all_agent_players(cycle_start_timestamp: int, cycle_end_timestamp: int) -> Dict[int, int]:
 
     with Session(engine) as session:
-
         statement = select(
             UserAgentStatsUserDailyCounts.user_agent_id,
             func.sum(UserAgentStatsUserDailyCounts.users)
+        ).join(
+            UserAgent, UserAgent.id == UserAgentStatsUserDailyCounts.user_agent_id
         ).where(
-            UserAgentStatsUserDailyCounts.user_agent_id.in_(agent_ids),
-            UserAgentStatsUserDailyCounts.day >= start_timestamp,
-            UserAgentStatsUserDailyCounts.day < end_timestamp
+            agent_in_cycle(cycle_start_timestamp, cycle_end_timestamp),
+            UserAgentStatsUserDailyCounts.day >= cycle_start_timestamp,
+            UserAgentStatsUserDailyCounts.day < cycle_end_timestamp
         ).group_by(UserAgentStatsUserDailyCounts.user_agent_id)
 
         agent_users = session.exec(statement).all()
 
-        logger.info(f"{len(agent_users)} agent records found.")
+    logger.info(f"{len(agent_users)} agent player records found.")
 
-        agent_user_scores = {}
-        for agent_id, agent_users in agent_users:
-            agent_user_scores[agent_id] = int(agent_users)
+    return {agent_id: int(users) for agent_id, users in agent_users}
 
-        return agent_user_scores
@@ -1,6 +1,50 @@
 
 from sqlmodel import Session
 from awe.models import UserAgentStatsTokenTransferDailyCounts, UserAgentStatsPaymentDailyCounts, UserAgentData, UserAgentStatsStakingDailyCounts
+from awe.models.utils import get_day_as_timestamp
+from awe.cache import cache
+from awe.settings import settings
+from typing import Optional
+import logging
+
+logger = logging.getLogger("[Agent Stats]")
+
+# Cached dashboard responses of an agent for a day, one hash field per days range
+stats_dashboard_key_prefix = "AWE_AGENT_STATS_DASHBOARD"
+
+
+def get_stats_dashboard_key(user_agent_id: int, day: int) -> str:
+    return f"{stats_dashboard_key_prefix}_{user_agent_id}_{day}"
+
+
+def get_cached_stats_dashboard(user_agent_id: int, days: int) -> Optional[bytes]:
+    try:
+        return cache.hget(get_stats_dashboard_key(user_agent_id, get_day_as_timestamp()), days)
+    except Exception as e:
+        logger.error(e)
+        return None
+
+
+def cache_stats_dashboard(user_agent_id: int, days: int, dashboard: str):
+    key = get_stats_dashboard_key(user_agent_id, get_day_as_timestamp())
+
+    try:
+        pipeline = cache.pipeline()
+        pipeline.hset(key, days, dashboard)
+        pipeline.expire(key, settings.agent_stats_cache_ttl)
+        pipeline.execute()
+    except Exception as e:
+        logger.error(e)
+
+
+def invalidate_stats_dashboard(user_agent_id: int):
+    # Only today's counts change
+    # Called after the recorded stats are committed, or the old counts may be cached again
+    try:
+        cache.delete(get_stats_dashboard_key(user_agent_id, get_day_as_timestamp()))
+    except Exception as e:
+        logger.error(e)
+
 
 def record_user_payment(user_agent_id: int, pool_amount: int, creator_amount: int, session: Session):
     # Add payment daily count
@@ -1,6 +1,6 @@
 from awe.db import engine
 from sqlmodel import Session, select
-from awe.cache import cache
+from awe.cache import pipelined_scard, pipelined_sadd, get_loading_set_key, add_to_loading_set, merge_loaded_set
 import logging
 from typing import Tuple
 
@@ -15,18 +15,24 @@ class CachedDistinctItemSet:
         page_size = 1000
         current_page = 0
 
+        # Loaded aside, never seen half loaded by a concurrent add_item
+        load_key = get_loading_set_key(redis_key)
+
         while(True):
             with Session(engine) as session:
                 current_statement = statement.offset(current_page * page_size).limit(page_size)
                 items = session.exec(current_statement).all()
 
-                if len(items) > 0:
-                    addresses = [item[0] for item in items]
-                    try:
-                        cache.sadd(redis_key, *addresses)
-                    except Exception as e:
-                        self.logger.error(e)
-                        raise Exception("Error writing to Redis cache")
+                try:
+                    if len(items) > 0:
+                        addresses = [item[0] for item in items]
+                        add_to_loading_set(load_key, addresses)
+
+                    if len(items) < page_size:
+                        merge_loaded_set(redis_key, load_key)
+                except Exception as e:
+                    self.logger.error(e)
+                    raise Exception("Error writing to Redis cache")
 
                 if len(items) < page_size:
                     return
@@ -55,27 +61,27 @@ class CachedDistinctItemSet:
         today_items_keys = f"AGENT_STATS_ITEMS_{self.key_prefix}_{day}_{user_agent_id}"
         total_items_keys = f"AGENT_STATS_ITEMS_{self.key_prefix}_TOTAL_{user_agent_id}"
 
-        # Check if the data exists in redis
-
         try:
-            today_addresses = cache.scard(today_items_keys)
+            today_addresses, total_addresses = pipelined_scard([today_items_keys, total_items_keys])
         except Exception as e:
             self.logger.error(e)
-            raise Exception("Error reading from Redis cache")
+            raise Exception("Error writing to Redis cache")
 
+        # The set is not in redis, load it from the DB before adding
         if today_addresses == 0:
             self.load_items_from_db_for_today(day, user_agent_id, today_items_keys)
 
-        try:
-            total_addresses = cache.scard(total_items_keys)
-        except Exception as e:
-            self.logger.error(e)
-            raise Exception("Error reading from Redis cache")
-
         if total_addresses == 0:
             self.load_items_from_db_total(user_agent_id, total_items_keys)
 
-        today_incremented = cache.sadd(today_items_keys, item)
-        total_incremented = cache.sadd(total_items_keys, item)
+        # Add to both sets in one round-trip
+        try:
+            today_incremented, total_incremented = pipelined_sadd([
+                (today_items_keys, item),
+                (total_items_keys, item)
+            ])
+        except Exception as e:
+            self.logger.error(e)
+            raise Exception("Error writing to Redis cache")
 
-        return today_incremented==1, total_incremented==1
+        return today_incremented, total_incremented
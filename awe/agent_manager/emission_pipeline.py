@@ -0,0 +1,195 @@
+from awe.db import engine
+from sqlmodel import Session, select
+from awe.settings import settings
+from awe.models import EmissionPipelineCheckpoint
+from awe.models.emission_pipeline_checkpoint import EmissionPipelineStageStatus
+from awe.models.utils import get_day_as_timestamp, unix_timestamp_in_seconds
+from .agent_score import update_all_agent_scores
+from .agent_emissions import update_total_cycle_emissions, \
+                            distribute_global_staking_emissions, \
+                            distribute_top_agent_emissions, \
+                            distribute_new_agent_emissions, \
+                            update_all_emission_account_balances
+from .in_agent_emissions import distribute_all_in_agent_emissions
+from typing import Dict, List, Optional
+import logging
+import time
+import argparse
+
+logger = logging.getLogger("[Emission Pipeline]")
+
+
+class EmissionPipelineException(Exception):
+    pass
+
+
+def distribute_in_agent_emissions(cycle_end_timestamp: int, dry_run: bool, rerun: bool = False):
+    distribute_all_in_agent_emissions(cycle_end_timestamp, rerun)
+
+
+# The stages of a cycle in order
+# (name, function, safe to rerun after a crash in the middle)
+stages = [
+    ("cycle_emissions", update_total_cycle_emissions, True),
+    ("agent_scores", update_all_agent_scores, True),
+    ("global_staking_emissions", distribute_global_staking_emissions, True),
+    ("top_agent_emissions", distribute_top_agent_emissions, True),
+    # Adds to the top agent emissions, a rerun would add twice
+    ("new_agent_emissions", distribute_new_agent_emissions, False),
+    ("in_agent_emissions", distribute_in_agent_emissions, True),
+    # Resumes from the credit progress saved with each page
+    ("emission_balances", update_all_emission_account_balances, True),
+]
+
+stage_names = [name for name, _, _ in stages]
+
+# Stages keeping their own progress, told to start over when rerun explicitly
+progress_stages = ["in_agent_emissions"]
+
+
+def get_last_emission_cycle_end_before(before_timestamp: int) -> int:
+    if before_timestamp == 0:
+        # Update for the last cycle
+        before_timestamp = get_day_as_timestamp()
+
+    interval_seconds = settings.tn_emission_interval_days * 86400
+
+    # Calculate the end timestamp of last cycle
+    emission_start = settings.tn_emission_start
+
+    if before_timestamp <= emission_start:
+        raise Exception("Invalid for_cycle_before provided")
+
+    elapsed_time  = before_timestamp - emission_start
+    completed_cycles = elapsed_time // interval_seconds
+
+    return emission_start + (completed_cycles * interval_seconds)
+
+
+def run_emission_pipeline(cycle_end_timestamp: int, dry_run: bool = False, rerun_stages: Optional[List[str]] = None) -> Dict[str, int]:
+    # Run all the stages of the cycle in order
+    # Stages done before are skipped so that the pipeline resumes after a crash
+    # Return the time spent (ms) by each stage run
+
+    if rerun_stages is None:
+        rerun_stages = []
+
+    cycle_start_timestamp = cycle_end_timestamp - settings.tn_emission_interval_days * 86400
+
+    logger.info(f"Running emission pipeline for cycle {cycle_start_timestamp} - {cycle_end_timestamp}, dry run: {dry_run}")
+
+    timings = {}
+
+    for name, stage, rerunnable in stages:
+
+        if dry_run:
+            if name == "in_agent_emissions":
+                # No dry run support in this stage
+                logger.info(f"[{name}] Skipped in dry run")
+                continue
+
+            timings[name] = run_stage(name, stage, cycle_end_timestamp, True)
+            continue
+
+        checkpoint = EmissionPipelineCheckpoint.get_checkpoint(cycle_start_timestamp, name)
+
+        if checkpoint is not None and name not in rerun_stages:
+            if checkpoint.status == EmissionPipelineStageStatus.DONE:
+                logger.info(f"[{name}] Done before, skipped")
+                continue
+
+            if not rerunnable:
+                # Interrupted or failed in the middle
+                raise EmissionPipelineException(f"[{name}] Stage not finished before, check the data and rerun it explicitly")
+
+        checkpoint_id = start_checkpoint(cycle_start_timestamp, name)
+
+        stage_args = {"rerun": True} if name in rerun_stages and name in progress_stages else {}
+
+        try:
+            timings[name] = run_stage(name, stage, cycle_end_timestamp, False, **stage_args)
+        except Exception as e:
+            finish_checkpoint(checkpoint_id, EmissionPipelineStageStatus.FAILED, None)
+            raise e
+
+        finish_checkpoint(checkpoint_id, EmissionPipelineStageStatus.DONE, timings[name])
+
+    logger.info(f"Emission pipeline finished: {timings}")
+
+    return timings
+
+
+def run_stage(name: str, stage, cycle_end_timestamp: int, dry_run: bool, **stage_args) -> int:
+    logger.info(f"[{name}] Stage started")
+
+    start = time.perf_counter()
+    stage(cycle_end_timestamp, dry_run, **stage_args)
+    duration_ms = int((time.perf_counter() - start) * 1000)
+
+    logger.info(f"[{name}] Stage finished in {duration_ms} ms")
+
+    return duration_ms
+
+
+def start_checkpoint(cycle_start_timestamp: int, name: str) -> int:
+    with Session(engine) as session:
+        statement = select(EmissionPipelineCheckpoint).where(
+            EmissionPipelineCheckpoint.day == cycle_start_timestamp,
+            EmissionPipelineCheckpoint.stage == name
+        )
+        checkpoint = session.exec(statement).first()
+
+        if checkpoint is None:
+            checkpoint = EmissionPipelineCheckpoint(
+                day=cycle_start_timestamp,
+                stage=name
+            )
+
+        checkpoint.status = EmissionPipelineStageStatus.RUNNING
+        checkpoint.started_at = unix_timestamp_in_seconds()
+        checkpoint.finished_at = None
+        checkpoint.duration_ms = None
+
+        session.add(checkpoint)
+        session.commit()
+        session.refresh(checkpoint)
+
+        return checkpoint.id
+
+
+def finish_checkpoint(checkpoint_id: int, status: int, duration_ms: int | None):
+    with Session(engine) as session:
+        statement = select(EmissionPipelineCheckpoint).where(EmissionPipelineCheckpoint.id == checkpoint_id)
+        checkpoint = session.exec(statement).first()
+        checkpoint.status = status
+        checkpoint.finished_at = unix_timestamp_in_seconds()
+        checkpoint.duration_ms = duration_ms
+        session.add(checkpoint)
+        session.commit()
+
+
+def get_emission_pipeline_checkpoints(cycle_end_timestamp: int) -> List[EmissionPipelineCheckpoint]:
+    cycle_start_timestamp = cycle_end_timestamp - settings.tn_emission_interval_days * 86400
+
+    with Session(engine) as session:
+        statement = select(EmissionPipelineCheckpoint).where(
+            EmissionPipelineCheckpoint.day == cycle_start_timestamp
+        ).order_by(EmissionPipelineCheckpoint.id.asc())
+
+        return session.exec(statement).all()
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Run the emission pipeline of the last cycle")
+    parser.add_argument("--last-cycle-before", type=int, default=0, help="Run for the last cycle ended before this timestamp")
+    parser.add_argument("--dry-run", action="store_true")
+    parser.add_argument("--rerun", nargs="*", default=[], choices=stage_names, help="Run the given stages even if done before")
+    args = parser.parse_args()
+
+    last_cycle_end = get_last_emission_cycle_end_before(args.last_cycle_before)
+
+    timings = run_emission_pipeline(last_cycle_end, args.dry_run, args.rerun)
+
+    for name, duration_ms in timings.items():
+        print(f"{name}: {duration_ms} ms")
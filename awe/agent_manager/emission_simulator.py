@@ -0,0 +1,444 @@
+from awe.db import engine
+from sqlmodel import Session, select
+from awe.settings import settings
+from awe.models import UserAgent, UserStaking, UserAgentStatsUserDailyCounts, TgUserAgentPayment, \
+    UserReferrals, TotalCycleEmissions, UserAgentWeeklyEmissions, PlayerWeeklyEmissions, \
+    CreatorWeeklyEmissions, StakerWeeklyEmissions, StakerGlobalWeeklyEmissions
+from awe.models.awe_agent import AweTokenConfig
+from awe.models.user_staking import UserStakingStatus
+from awe.models.user_referrals import get_referral_multiplier
+from .agent_score import compute_agent_scores
+from .agent_emissions import global_staking_emission_share, \
+                            top_agent_emission_share, \
+                            new_agent_emission_share, \
+                            get_num_top_agents
+from sqlalchemy import func, type_coerce, JSON
+from typing import Dict, Any
+import numpy as np
+import logging
+import argparse
+import math
+import time
+
+# Run the emission computation of a cycle against an in-memory snapshot
+# The snapshot is loaded from the DB once (or from a file saved before)
+# and every stage is computed with NumPy, nothing is written back
+
+logger = logging.getLogger("[Emission Simulator]")
+
+# Columns of each snapshot table, NULLs are stored as -1
+snapshot_tables = {
+    "agents": ["id", "created_at", "deleted_at", "staking_amount", "creator_division"],
+    "stakings": ["id", "user_agent_id", "user", "amount", "created_at", "released_at", "release_status", "status"],
+    "daily_users": ["user_agent_id", "day", "users"],
+    "payments": ["user_agent_id", "user", "count"],
+    "referrals": ["user", "num_activated_referrals"],
+    "stored_agents": ["user_agent_id", "score", "emission"],
+    "stored_players": ["user_agent_id", "user", "emission"],
+    "stored_creators": ["user_agent_id", "emission"],
+    "stored_stakers": ["staking_id", "emission"],
+    "stored_global_stakers": ["staking_id", "emission"],
+}
+
+
+class EmissionSnapshot:
+
+    def __init__(self, cycle_end_timestamp: int, tables: Dict[str, Dict[str, np.ndarray]], users: np.ndarray, cycle_values: Dict[str, int]):
+        self.cycle_end_timestamp = cycle_end_timestamp
+        self.cycle_start_timestamp = cycle_end_timestamp - settings.tn_emission_interval_days * 86400
+
+        # Columns by table
+        self.tables = tables
+
+        # tg_user_id of each user code
+        self.users = users
+
+        # total_emitted_before and emission of the previous cycle,
+        # emission of this cycle as stored. -1 if missing
+        self.cycle_values = cycle_values
+
+    def save(self, path: str):
+        arrays = {
+            f"{table}.{column}": values for table, columns in self.tables.items() for column, values in columns.items()
+        }
+
+        np.savez_compressed(
+            path,
+            users=self.users,
+            cycle_end_timestamp=np.array(self.cycle_end_timestamp),
+            cycle_values=np.array([self.cycle_values[key] for key in sorted(self.cycle_values)]),
+            cycle_value_keys=np.array(sorted(self.cycle_values)),
+            **arrays
+        )
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as data:
+            tables = {
+                table: {column: data[f"{table}.{column}"] for column in columns} for table, columns in snapshot_tables.items()
+            }
+
+            cycle_values = dict(zip(data["cycle_value_keys"].tolist(), data["cycle_values"].tolist()))
+
+            return EmissionSnapshot(int(data["cycle_end_timestamp"]), tables, data["users"], cycle_values)
+
+
+def take_emission_snapshot(cycle_end_timestamp: int) -> EmissionSnapshot:
+    # Load everything the cycle computation reads in one query per table
+
+    cycle_start_timestamp = cycle_end_timestamp - settings.tn_emission_interval_days * 86400
+
+    creator_division_column = func.coalesce(
+        type_coerce(UserAgent.awe_agent, JSON)[("awe_token_config", "emission_creator_division")].as_integer(),
+        AweTokenConfig().emission_creator_division
+    )
+
+    statements = {
+        "agents": select(
+            UserAgent.id, UserAgent.created_at, UserAgent.deleted_at, UserAgent.staking_amount, creator_division_column
+        ).where(UserAgent.created_at < cycle_end_timestamp).order_by(UserAgent.id.asc()),
+
+        "stakings": select(
+            UserStaking.id, UserStaking.user_agent_id, UserStaking.tg_user_id, UserStaking.amount,
+            UserStaking.created_at, UserStaking.released_at, UserStaking.release_status, UserStaking.status
+        ).where(UserStaking.created_at < cycle_end_timestamp),
+
+        "daily_users": select(
+            UserAgentStatsUserDailyCounts.user_agent_id, UserAgentStatsUserDailyCounts.day, UserAgentStatsUserDailyCounts.users
+        ).where(
+            UserAgentStatsUserDailyCounts.day >= cycle_start_timestamp,
+            UserAgentStatsUserDailyCounts.day < cycle_end_timestamp
+        ),
+
+        "payments": select(
+            TgUserAgentPayment.user_agent_id, TgUserAgentPayment.tg_user_id, func.count(TgUserAgentPayment.id)
+        ).where(
+            TgUserAgentPayment.created_at >= cycle_start_timestamp,
+            TgUserAgentPayment.created_at < cycle_end_timestamp
+        ).group_by(TgUserAgentPayment.user_agent_id, TgUserAgentPayment.tg_user_id),
+
+        "referrals": select(
+            UserReferrals.tg_user_id, UserReferrals.num_activated_referrals
+        ).order_by(UserReferrals.id.asc()),
+
+        "stored_agents": select(
+            UserAgentWeeklyEmissions.user_agent_id, UserAgentWeeklyEmissions.score, UserAgentWeeklyEmissions.emission
+        ).where(UserAgentWeeklyEmissions.day == cycle_start_timestamp),
+
+        "stored_players": select(
+            PlayerWeeklyEmissions.user_agent_id, PlayerWeeklyEmissions.tg_user_id, PlayerWeeklyEmissions.emission
+        ).where(PlayerWeeklyEmissions.day == cycle_start_timestamp),
+
+        "stored_creators": select(
+            CreatorWeeklyEmissions.user_agent_id, CreatorWeeklyEmissions.emission
+        ).where(CreatorWeeklyEmissions.day == cycle_start_timestamp),
+
+        "stored_stakers": select(
+            StakerWeeklyEmissions.staking_id, StakerWeeklyEmissions.emission
+        ).where(StakerWeeklyEmissions.day == cycle_start_timestamp),
+
+        "stored_global_stakers": select(
+            StakerGlobalWeeklyEmissions.staking_id, StakerGlobalWeeklyEmissions.emission
+        ).where(StakerGlobalWeeklyEmissions.day == cycle_start_timestamp),
+    }
+
+    rows = {}
+    with Session(engine) as session:
+        for table, statement in statements.items():
+            rows[table] = session.exec(statement).all()
+            logger.info(f"[Snapshot] {table}: {len(rows[table])} rows")
+
+        cycle_values = {}
+        for key, day in [("previous", cycle_start_timestamp - settings.tn_emission_interval_days * 86400), ("current", cycle_start_timestamp)]:
+            statement = select(TotalCycleEmissions).where(TotalCycleEmissions.day == day)
+            total_cycle_emission = session.exec(statement).first()
+            cycle_values[f"{key}_emission"] = -1 if total_cycle_emission is None else total_cycle_emission.emission
+            cycle_values[f"{key}_total_emitted_before"] = -1 if total_cycle_emission is None else total_cycle_emission.total_emitted_before
+
+    # Encode the tg user ids as integer codes shared by all the tables
+    user_columns = [
+        [row[column_index] for row in rows[table]]
+        for table, column_index in [("stakings", 2), ("payments", 1), ("referrals", 0), ("stored_players", 1)]
+    ]
+    users = np.unique(np.array([user for column in user_columns for user in column], dtype=str))
+
+    tables = {}
+    for table, columns in snapshot_tables.items():
+        tables[table] = {}
+        for column_index, column in enumerate(columns):
+            values = [row[column_index] for row in rows[table]]
+
+            if column == "user":
+                tables[table][column] = np.searchsorted(users, np.array(values, dtype=str)).astype(np.int64)
+            else:
+                tables[table][column] = np.array([-1 if value is None else value for value in values], dtype=np.int64)
+
+    return EmissionSnapshot(cycle_end_timestamp, tables, users, cycle_values)
+
+
+def divide_emissions(total_emissions: np.ndarray | int, scores: np.ndarray, score_sums: np.ndarray | int) -> np.ndarray:
+    # floor(total_emissions * score / score_sum) without int64 overflow
+    # Falls back to Python ints when the products are too large
+
+    totals = np.broadcast_to(np.asarray(total_emissions, dtype=np.int64), scores.shape)
+    sums = np.broadcast_to(np.asarray(score_sums, dtype=np.int64), scores.shape)
+
+    if len(scores) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    if int(totals.max()) * int(scores.max()) < np.iinfo(np.int64).max:
+        return np.where(sums != 0, totals * scores // np.where(sums != 0, sums, 1), 0)
+
+    products = totals.astype(object) * scores.astype(object)
+    return np.array([0 if s == 0 else p // s for p, s in zip(products, sums)], dtype=np.int64)
+
+
+def divide_by_group(total_emissions: Dict[int, int], group_ids: np.ndarray, scores: np.ndarray) -> np.ndarray:
+    # Divide the total emissions of each group among its rows by the scores
+
+    totals = np.array([total_emissions.get(group_id, 0) for group_id in group_ids.tolist()], dtype=np.int64)
+
+    unique_ids, inverse = np.unique(group_ids, return_inverse=True)
+    score_sums = np.zeros(len(unique_ids), dtype=np.int64)
+    np.add.at(score_sums, inverse, scores)
+
+    return divide_emissions(totals, scores, score_sums[inverse])
+
+
+def get_staking_multipliers(created_at: np.ndarray, till_day_timestamp: int) -> np.ndarray:
+    # Same as get_staking_multiplier, for an array of stakings
+    period = till_day_timestamp - created_at
+
+    return np.select(
+        [period >= 12 * 30 * 86400, period >= 6 * 30 * 86400, period >= 3 * 30 * 86400],
+        [3, 2, 1.5],
+        default=1
+    )
+
+
+def simulate_emissions(snapshot: EmissionSnapshot, total_emissions: int | None = None, top_n: int | None = None) -> Dict[str, Any]:
+    # Run all the stages of the cycle against the snapshot
+    # The total emissions and the number of top agents can be overridden for what-if analyses
+    # Records are computed as a clean run of the pipeline, all emissions start from zero
+
+    start = snapshot.cycle_start_timestamp
+    end = snapshot.cycle_end_timestamp
+
+    agents = snapshot.tables["agents"]
+    stakings = snapshot.tables["stakings"]
+    daily_users = snapshot.tables["daily_users"]
+    payments = snapshot.tables["payments"]
+    referrals = snapshot.tables["referrals"]
+
+    # Total cycle emissions
+
+    total_creator_staking = agents["staking_amount"][agents["deleted_at"] == -1].clip(min=0).sum()
+    total_player_staking = stakings["amount"][(stakings["release_status"] == -1) | (stakings["released_at"] >= end)].sum()
+    total_staked = int(total_creator_staking + total_player_staking)
+
+    if total_emissions is None:
+        if snapshot.cycle_values["previous_emission"] != -1:
+            total_emitted_before = snapshot.cycle_values["previous_emission"] + snapshot.cycle_values["previous_total_emitted_before"]
+        elif start == settings.tn_emission_start:
+            total_emitted_before = 20000000 # 2% (20M) initial emission
+        else:
+            raise Exception("Missing previous emission data")
+
+        total_cycle_emission = TotalCycleEmissions(day=start)
+        total_cycle_emission.update_emission(total_emitted_before, total_staked)
+        total_emissions = total_cycle_emission.emission
+
+    # Agent scores
+
+    alive = ((agents["deleted_at"] == -1) | (agents["deleted_at"] >= start)) & (agents["created_at"] < end)
+    alive_agent_ids = agents["id"][alive]
+
+    in_position = (stakings["status"] == UserStakingStatus.SUCCESS) \
+        & (stakings["created_at"] < start) \
+        & ((stakings["released_at"] == -1) | (stakings["released_at"] >= end))
+
+    agent_stakings = in_position & np.isin(stakings["user_agent_id"], alive_agent_ids)
+    agent_players = np.isin(daily_users["user_agent_id"], alive_agent_ids)
+
+    agent_ids, agent_scores = compute_agent_scores(
+        sum_by_id(stakings["user_agent_id"][agent_stakings], stakings["amount"][agent_stakings]),
+        sum_by_id(daily_users["user_agent_id"][agent_players], daily_users["users"][agent_players])
+    )
+
+    # Top agent emissions
+    # The score sum covers all the agents, not only the top N
+
+    if top_n is None:
+        top_n = get_num_top_agents(int(alive.sum()))
+
+    score_sum = int(agent_scores.sum())
+    agent_emissions = np.zeros(len(agent_ids), dtype=np.int64)
+
+    if score_sum != 0:
+        ranks = np.lexsort((agent_ids, -agent_scores))[:top_n]
+        agent_emissions[ranks] = divide_emissions(math.floor(total_emissions * top_agent_emission_share), agent_scores[ranks], score_sum)
+
+        # New agent emissions
+        agent_emissions += divide_emissions(math.floor(total_emissions * new_agent_emission_share), agent_scores, score_sum)
+
+    # In-agent emissions
+
+    has_emission = agent_emissions != 0
+    emission_agent_ids = agent_ids[has_emission]
+    emissions = agent_emissions[has_emission].astype(np.float64)
+
+    division_index = np.searchsorted(agents["id"], emission_agent_ids)
+    creator_divisions = agents["creator_division"][division_index] / 100
+    player_divisions = 1 - creator_divisions
+
+    player_totals = dict(zip(
+        emission_agent_ids[player_divisions != 0].tolist(),
+        np.floor(emissions * 2 * player_divisions / 3)[player_divisions != 0].astype(np.int64).tolist()
+    ))
+    creator_totals = dict(zip(
+        emission_agent_ids[creator_divisions != 0].tolist(),
+        np.floor(emissions * 2 * creator_divisions / 3)[creator_divisions != 0].astype(np.int64).tolist()
+    ))
+    staker_totals = dict(zip(emission_agent_ids.tolist(), np.floor(emissions / 3).astype(np.int64).tolist()))
+
+    # Players, scored by the play sessions and the referral multiplier
+    # The last referral record of a user wins, same as the dict in the pipeline
+    multipliers = np.ones(len(snapshot.users), dtype=np.int64)
+    multipliers[referrals["user"]] = np.vectorize(get_referral_multiplier, otypes=[np.int64])(referrals["num_activated_referrals"])
+
+    player_rows = np.isin(payments["user_agent_id"], list(player_totals.keys()))
+    player_agent_ids = payments["user_agent_id"][player_rows]
+    player_users = payments["user"][player_rows]
+    player_scores = payments["count"][player_rows] * multipliers[player_users]
+
+    # Stakers of the agents
+    staker_rows = in_position & np.isin(stakings["user_agent_id"], emission_agent_ids)
+    staker_scores = np.floor(
+        stakings["amount"][staker_rows] * get_staking_multipliers(stakings["created_at"][staker_rows], end)
+    ).astype(np.int64)
+
+    # Global stakers
+    global_staker_scores = np.floor(
+        stakings["amount"][in_position] * get_staking_multipliers(stakings["created_at"][in_position], end)
+    ).astype(np.int64)
+
+    return {
+        "total_staked": total_staked,
+        "total_emissions": total_emissions,
+        "top_n": top_n,
+        "agents": {
+            "user_agent_id": agent_ids,
+            "score": agent_scores,
+            "emission": agent_emissions
+        },
+        "players": {
+            "user_agent_id": player_agent_ids,
+            "user": player_users,
+            "score": player_scores,
+            "emission": divide_by_group(player_totals, player_agent_ids, player_scores)
+        },
+        "creators": {
+            "user_agent_id": np.array(list(creator_totals.keys()), dtype=np.int64),
+            "emission": np.array(list(creator_totals.values()), dtype=np.int64)
+        },
+        "stakers": {
+            "staking_id": stakings["id"][staker_rows],
+            "score": staker_scores,
+            "emission": divide_by_group(staker_totals, stakings["user_agent_id"][staker_rows], staker_scores)
+        },
+        "global_stakers": {
+            "staking_id": stakings["id"][in_position],
+            "score": global_staker_scores,
+            "emission": divide_emissions(math.floor(total_emissions * global_staking_emission_share), global_staker_scores, int(global_staker_scores.sum()))
+        }
+    }
+
+
+def sum_by_id(ids: np.ndarray, values: np.ndarray) -> Dict[int, int]:
+    # Exact integer sums, bincount would go through float64
+    unique_ids, inverse = np.unique(ids, return_inverse=True)
+    sums = np.zeros(len(unique_ids), dtype=np.int64)
+    np.add.at(sums, inverse, values)
+    return dict(zip(unique_ids.tolist(), sums.tolist()))
+
+
+def compare_emissions(snapshot: EmissionSnapshot, result: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+    # Diff the simulated records against the stored ones of the cycle
+
+    num_users = max(len(snapshot.users), 1)
+
+    def player_keys(records):
+        return records["user_agent_id"] * num_users + records["user"]
+
+    comparisons = [
+        ("agents", "stored_agents", lambda records: records["user_agent_id"]),
+        ("players", "stored_players", player_keys),
+        ("creators", "stored_creators", lambda records: records["user_agent_id"]),
+        ("stakers", "stored_stakers", lambda records: records["staking_id"]),
+        ("global_stakers", "stored_global_stakers", lambda records: records["staking_id"]),
+    ]
+
+    report = {}
+
+    for name, stored_name, get_keys in comparisons:
+        simulated = result[name]
+        stored = snapshot.tables[stored_name]
+
+        simulated_keys = get_keys(simulated)
+        stored_keys = get_keys(stored)
+
+        keys = np.union1d(simulated_keys, stored_keys)
+
+        simulated_emissions = np.zeros(len(keys), dtype=np.int64)
+        simulated_emissions[np.searchsorted(keys, simulated_keys)] = simulated["emission"]
+
+        stored_emissions = np.zeros(len(keys), dtype=np.int64)
+        stored_emissions[np.searchsorted(keys, stored_keys)] = stored["emission"]
+
+        differences = simulated_emissions - stored_emissions
+
+        report[name] = {
+            "simulated_records": len(simulated_keys),
+            "stored_records": len(stored_keys),
+            "simulated_emissions": int(simulated["emission"].sum()),
+            "stored_emissions": int(stored["emission"].sum()),
+            "mismatched_records": int((differences != 0).sum()),
+            "max_difference": int(np.abs(differences).max()) if len(differences) != 0 else 0
+        }
+
+    return report
+
+
+if __name__ == "__main__":
+
+    from .emission_pipeline import get_last_emission_cycle_end_before
+
+    parser = argparse.ArgumentParser(description="Simulate the emissions of the last cycle against a snapshot")
+    parser.add_argument("--last-cycle-before", type=int, default=0, help="Simulate the last cycle ended before this timestamp")
+    parser.add_argument("--snapshot", type=str, help="Load the snapshot from this file instead of the DB")
+    parser.add_argument("--save-snapshot", type=str, help="Save the snapshot loaded from the DB to this file")
+    parser.add_argument("--total-emissions", type=int, help="Override the total emissions of the cycle")
+    parser.add_argument("--top-n", type=int, help="Override the number of top agents")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+
+    if args.snapshot is not None:
+        snapshot = EmissionSnapshot.load(args.snapshot)
+    else:
+        snapshot = take_emission_snapshot(get_last_emission_cycle_end_before(args.last_cycle_before))
+
+        if args.save_snapshot is not None:
+            snapshot.save(args.save_snapshot)
+
+    print(f"Snapshot of cycle {snapshot.cycle_start_timestamp} - {snapshot.cycle_end_timestamp} ready in {int((time.perf_counter() - start) * 1000)} ms")
+
+    start = time.perf_counter()
+    result = simulate_emissions(snapshot, args.total_emissions, args.top_n)
+    duration_ms = int((time.perf_counter() - start) * 1000)
+
+    print(f"Simulated in {duration_ms} ms")
+    print(f"Total staked: {result['total_staked']}, total emissions: {result['total_emissions']} (stored: {snapshot.cycle_values['current_emission']}), top N: {result['top_n']}")
+
+    for name, comparison in compare_emissions(snapshot, result).items():
+        print(f"{name}: {comparison}")
@@ -0,0 +1,169 @@
+from awe.db import engine
+from sqlmodel import Session, delete, select, update, func
+from sqlalchemy import literal, BigInteger, tuple_
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from awe.models.utils import unix_timestamp_in_seconds
+from typing import List, Dict, Any, Optional
+import logging
+
+logger = logging.getLogger("[Emission Writer]")
+
+batch_size = 500
+
+
+def bulk_upsert(session: Session, model, rows: List[Dict[str, Any]], conflict_columns: List[str], update_columns: List[str]):
+    # INSERT ... ON CONFLICT DO UPDATE in the dialect of the engine
+    # Requires a unique constraint on the conflict columns
+
+    dialect = session.get_bind().dialect.name
+
+    if dialect == "mysql":
+        statement = mysql.insert(model.__table__).values(rows)
+        statement = statement.on_duplicate_key_update({
+            column: statement.inserted[column] for column in update_columns
+        })
+    elif dialect in ["postgresql", "sqlite"]:
+        insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+        statement = insert(model.__table__).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=conflict_columns,
+            set_={column: statement.excluded[column] for column in update_columns}
+        )
+    else:
+        raise Exception(f"Bulk upsert not supported for {dialect}")
+
+    session.execute(statement)
+
+
+def write_weekly_emissions(model, day: int, key_columns: List[str], conflict_columns: List[str], rows: List[Dict[str, Any]], scope_filters: Optional[List] = None):
+    # Replace the weekly emission records of the day (within the scope)
+    # with the given rows, which already have the scores and emissions computed
+    # Stale records are deleted with one NOT IN per batch of keys
+
+    if scope_filters is None:
+        scope_filters = []
+
+    if len(key_columns) == 1:
+        key = getattr(model, key_columns[0])
+        get_key = lambda row: row[key_columns[0]]
+    else:
+        # Compared as row values
+        key = tuple_(*[getattr(model, column) for column in key_columns])
+        get_key = lambda row: tuple([row[column] for column in key_columns])
+
+    rows = sorted(rows, key=get_key)
+    batches = [rows[i:i+batch_size] for i in range(0, len(rows), batch_size)]
+
+    now = unix_timestamp_in_seconds()
+    for row in rows:
+        row["day"] = day
+        row["created_at"] = now
+
+    with Session(engine) as session:
+
+        # Delete the stale records first
+        # A key range deleted by mistake under a different collation is written back below
+        if len(batches) == 0:
+            session.execute(delete(model).where(model.day == day, *scope_filters))
+
+        previous_last_key = None
+        for batch in batches:
+            batch_keys = [get_key(row) for row in batch]
+
+            statement = delete(model).where(
+                model.day == day,
+                *scope_filters,
+                key <= batch_keys[-1],
+                key.not_in(batch_keys)
+            )
+
+            if previous_last_key is not None:
+                statement = statement.where(key > previous_last_key)
+
+            session.execute(statement)
+            previous_last_key = batch_keys[-1]
+
+        if previous_last_key is not None:
+            session.execute(delete(model).where(model.day == day, *scope_filters, key > previous_last_key))
+
+        # Upsert the current records
+        for batch in batches:
+            bulk_upsert(session, model, batch, conflict_columns, ["score", "emission"])
+
+        session.commit()
+
+    logger.info(f"{model.__tablename__}: {len(rows)} records written in {len(batches)} batches")
+
+
+def with_emissions(rows: List[Dict[str, Any]], total_emissions: int) -> List[Dict[str, Any]]:
+    # Divide the total emissions by the scores
+    total_score = sum([row["score"] for row in rows])
+
+    for row in rows:
+        row["emission"] = 0 if total_score == 0 else total_emissions * row["score"] // total_score
+
+    return rows
+
+
+def update_emissions_by_score(model, filters: List, total_emissions: int, top_n: int | None = None, accumulate: bool = False, dry_run: bool = False) -> int:
+    # Set emission = floor(total_emissions * score / sum of scores)
+    # for the records matching the filters in one UPDATE
+    # The sum covers all the matching records even if only the top N by score are updated
+    # Return the number of records updated
+
+    columns = [
+        model.id.label("id"),
+        model.score.label("score"),
+        model.emission.label("emission"),
+        func.sum(model.score).over().label("score_sum")
+    ]
+
+    if top_n is not None:
+        columns.append(func.row_number().over(order_by=(model.score.desc(), model.id.asc())).label("score_rank"))
+
+    scores = select(*columns).where(*filters).subquery()
+
+    with Session(engine) as session:
+
+        dialect = session.get_bind().dialect.name
+
+        if dialect == "sqlite":
+            # No UPDATE ... FROM with window functions in older SQLite
+            # Compute in Python and update by primary key
+            statement = select(scores.c.id, scores.c.score, scores.c.emission, scores.c.score_sum)
+            if top_n is not None:
+                statement = statement.where(scores.c.score_rank <= top_n)
+
+            records = []
+            for record_id, score, emission, score_sum in session.execute(statement).all():
+                new_emission = total_emissions * score // score_sum
+                records.append({"id": record_id, "emission": emission + new_emission if accumulate else new_emission})
+
+            if len(records) != 0:
+                session.execute(update(model), records)
+
+            num_updated = len(records)
+        else:
+            share = literal(total_emissions, BigInteger) * scores.c.score
+
+            if dialect == "mysql":
+                # Integer division, "/" returns a rounded decimal
+                new_emission = share.op("DIV")(scores.c.score_sum)
+            else:
+                new_emission = share // scores.c.score_sum
+
+            statement = update(model).where(model.id == scores.c.id).values(
+                emission=model.emission + new_emission if accumulate else new_emission
+            )
+
+            if top_n is not None:
+                statement = statement.where(scores.c.score_rank <= top_n)
+
+            num_updated = session.execute(statement).rowcount
+
+        if dry_run:
+            session.rollback()
+        else:
+            session.commit()
+
+    return num_updated
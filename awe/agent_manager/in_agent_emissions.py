@@ -1,304 +1,511 @@
-from sqlmodel import Session, select, or_
+from sqlmodel import Session, select, or_, update, insert
 from awe.db import engine
 from awe.models import UserAgentWeeklyEmissions, \
     TgUserAgentPayment, UserStaking, UserReferrals, \
     PlayerWeeklyEmissions, StakerWeeklyEmissions, \
     UserAgent, CreatorWeeklyEmissions
-from awe.models.user_staking import UserStakingStatus
+from awe.models.awe_agent import AweTokenConfig
+from awe.models.user_staking import UserStakingStatus, get_staking_multiplier
+from awe.models.user_referrals import get_referral_multiplier
+from awe.models.utils import unix_timestamp_in_seconds
+from awe.models.in_agent_emission_progress import InAgentEmissionProgress, InAgentEmissionStatus
+from awe.celery import app
+from .emission_writer import write_weekly_emissions, with_emissions
 from awe.settings import settings
 import logging
-from sqlalchemy import func
+from sqlalchemy import func, type_coerce, JSON
+from typing import Dict, List, Set, Optional
+import traceback
 import math
+import time
 
 logger = logging.getLogger("[Player Emissions]")
 
+
+class InAgentEmissionClaimLostException(Exception):
+    pass
+
+
 page_size = 500
 
+# Max ids in an IN clause
+in_batch_size = 1000
+
+
+def distribute_all_in_agent_emissions(cycle_end_timestamp: int, rerun: bool = False):
+    # Coordinate the in-agent emissions of all the agents
+    # Agents done before in this cycle are skipped, unless rerun explicitly
+    # The failed ones are retried up to the max attempts
 
-def distribute_all_in_agent_emissions(cycle_end_timestamp: int):
     cycle_start_timestamp = cycle_end_timestamp - settings.tn_emission_interval_days * 86400
 
-    # Get the list of agent with emissions
-    current_page = 0
+    agents = get_agents_with_emissions(cycle_start_timestamp)
+
+    logger.info(f"{len(agents)} agents with emissions")
+
+    init_progress(cycle_start_timestamp, [agent_id for agent_id, _, _ in agents], rerun)
+
+    for _ in range(settings.emission_agent_max_attempts):
+
+        done_agent_ids = get_done_agent_ids(cycle_start_timestamp)
+        remaining_agents = [agent for agent in agents if agent[0] not in done_agent_ids]
+        remaining_agent_ids = [agent_id for agent_id, _, _ in remaining_agents]
+
+        if len(remaining_agents) == 0:
+            break
+
+        # The remaining agents now belong to this attempt
+        # Workers left from an earlier attempt can no longer write them
+        attempt = start_attempt(cycle_start_timestamp, remaining_agent_ids)
+
+        logger.info(f"Attempt {attempt}: {len(remaining_agents)} agents remaining")
+
+        chunks = [remaining_agents[i:i+settings.emission_agent_chunk_size] for i in range(0, len(remaining_agents), settings.emission_agent_chunk_size)]
+
+        if settings.emission_parallel_in_agent:
+            tasks = []
+            for chunk in chunks:
+                tasks.append(app.send_task(
+                    name='awe.agent_manager.tasks.emission_task.in_agent_emissions',
+                    args=(chunk, cycle_end_timestamp, attempt)
+                ))
+
+            if not wait_for_agents(cycle_start_timestamp, remaining_agent_ids):
+                # Stop the workers still running before the next attempt
+                for task in tasks:
+                    task.revoke(terminate=True)
+        else:
+            for chunk in chunks:
+                try:
+                    distribute_in_agent_emissions_for_agents(chunk, cycle_end_timestamp, attempt)
+                except Exception as e:
+                    logger.error(e)
+                    logger.error(traceback.format_exc())
+
+    done_agent_ids = get_done_agent_ids(cycle_start_timestamp)
+    failed_agent_ids = [agent_id for agent_id, _, _ in agents if agent_id not in done_agent_ids]
+
+    if len(failed_agent_ids) != 0:
+        raise Exception(f"In-agent emissions failed for agents: {failed_agent_ids}")
+
+    logger.info(f"In-agent emissions distributed for {len(agents)} agents")
+
+
+def get_agents_with_emissions(cycle_start_timestamp: int) -> List[List[int]]:
+    # Return [agent_id, emission, creator division] of the agents with emissions
+
+    # Read only the division from the agent config, not the whole agent
+    creator_division_column = func.coalesce(
+        type_coerce(UserAgent.awe_agent, JSON)[("awe_token_config", "emission_creator_division")].as_integer(),
+        AweTokenConfig().emission_creator_division
+    )
+
+    agents = []
+    last_emission_id = 0
     while True:
         with Session(engine) as session:
-            statement = select(UserAgentWeeklyEmissions).where(
+            statement = select(
+                UserAgentWeeklyEmissions.id,
+                UserAgentWeeklyEmissions.user_agent_id,
+                UserAgentWeeklyEmissions.emission,
+                creator_division_column
+            ).join(
+                UserAgent, UserAgent.id == UserAgentWeeklyEmissions.user_agent_id
+            ).where(
                 UserAgentWeeklyEmissions.emission != 0,
-                UserAgentWeeklyEmissions.day == cycle_start_timestamp
-            ).order_by(UserAgentWeeklyEmissions.id.asc()).offset(current_page * page_size).limit(page_size)
+                UserAgentWeeklyEmissions.day == cycle_start_timestamp,
+                UserAgentWeeklyEmissions.id > last_emission_id
+            ).order_by(UserAgentWeeklyEmissions.id.asc()).limit(page_size)
 
             agent_emissions = session.exec(statement).all()
-            logger.info(f"{len(agent_emissions)} agents with emissions in page {current_page}")
 
-            for agent_emission in agent_emissions:
+        agents.extend([[agent_id, emission, creator_division] for _, agent_id, emission, creator_division in agent_emissions])
 
-                # Get player/creator emission division from agent data
-                statement = select(UserAgent).where(UserAgent.id == agent_emission.user_agent_id)
-                user_agent = session.exec(statement).first()
-                creator_division = user_agent.awe_agent.awe_token_config.emission_creator_division / 100
-                player_division = 1 - creator_division
+        if len(agent_emissions) < page_size:
+            break
 
-                logger.info(f"[Agent {agent_emission.user_agent_id}] Creator division: {creator_division}, Player division: {player_division}")
+        last_emission_id = agent_emissions[-1][0]
 
-                # Player divistion
-                if player_division != 0:
-                    logger.info(f"Updating player emissions for agent {agent_emission.user_agent_id}")
-                    total_player_emissions = math.floor(agent_emission.emission * 2 * player_division / 3)
-                    update_player_emissions_for_agent(agent_emission.user_agent_id, cycle_end_timestamp, total_player_emissions)
-                else:
-                    logger.info(f"No emission is given to players for agent {agent_emission.user_agent_id}")
+    return agents
 
-                # Creator division
-                if creator_division != 0:
-                    logger.info(f"Updating creator emissions for agent {agent_emission.user_agent_id}")
-                    total_creator_emissions = math.floor(agent_emission.emission * 2 * creator_division / 3)
-                    update_creator_emissions_for_agent(agent_emission.user_agent_id, cycle_end_timestamp, total_creator_emissions)
-                else:
-                    logger.info(f"No emission is given to the creator for agent {agent_emission.user_agent_id}")
 
-                # Staker division
-                logger.info(f"Updating staker emissions for agent {agent_emission.user_agent_id}")
-                total_staker_emissions = math.floor(agent_emission.emission / 3)
-                update_staker_emissions_for_agent(agent_emission.user_agent_id, cycle_end_timestamp, total_staker_emissions)
+def distribute_in_agent_emissions_for_agents(agents: List[List[int]], cycle_end_timestamp: int, attempt: int):
+    # Distribute the in-agent emissions of a chunk of agents
+    # Safe to run again, the records of the agents are replaced
+    # Only the agents still owned by the given attempt are run
 
-            if len(agent_emissions) < page_size:
-                break
+    cycle_start_timestamp = cycle_end_timestamp - settings.tn_emission_interval_days * 86400
 
-            current_page += 1
+    claimed_agent_ids = claim_agents(cycle_start_timestamp, [agent_id for agent_id, _, _ in agents], attempt)
+    agents = [agent for agent in agents if agent[0] in claimed_agent_ids]
 
+    if len(agents) == 0:
+        logger.info(f"Attempt {attempt}: no agents left to run")
+        return
 
-def update_player_emissions_for_agent(agent_id: int, cycle_end_timestamp: int, total_player_emissions: int):
+    agent_ids = [agent_id for agent_id, _, _ in agents]
 
-    cycle_start_timestamp = cycle_end_timestamp - settings.tn_emission_interval_days * 86400
+    try:
+        total_player_emissions = {}
+        total_creator_emissions = {}
+        total_staker_emissions = {}
 
-    logger.info(f"Total player emissions: {total_player_emissions}")
+        for agent_id, emission, creator_division_percentage in agents:
+            creator_division = creator_division_percentage / 100
+            player_division = 1 - creator_division
 
-    # Update player scores
-    current_page = 0
-    while True:
-        with Session(engine) as session:
-            # Get player play sessions (num of payments)
-            statement = select(TgUserAgentPayment.tg_user_id, func.count(TgUserAgentPayment.id)).where(
-                TgUserAgentPayment.created_at >= cycle_start_timestamp,
-                TgUserAgentPayment.created_at < cycle_end_timestamp,
-                TgUserAgentPayment.user_agent_id == agent_id
-            ).group_by(TgUserAgentPayment.tg_user_id).order_by(TgUserAgentPayment.tg_user_id.asc()).offset(current_page * page_size).limit(page_size)
+            logger.info(f"[Agent {agent_id}] Creator division: {creator_division}, Player division: {player_division}")
 
-            user_deposit_count = session.exec(statement).all()
+            # Player divistion
+            if player_division != 0:
+                total_player_emissions[agent_id] = math.floor(emission * 2 * player_division / 3)
+            else:
+                logger.info(f"No emission is given to players for agent {agent_id}")
 
-            logger.info(f"{len(user_deposit_count)} players found for agent {agent_id}")
+            # Creator division
+            if creator_division != 0:
+                total_creator_emissions[agent_id] = math.floor(emission * 2 * creator_division / 3)
+            else:
+                logger.info(f"No emission is given to the creator for agent {agent_id}")
 
-            player_ids = [tg_user_id for tg_user_id, _ in user_deposit_count]
+            # Staker division
+            total_staker_emissions[agent_id] = math.floor(emission / 3)
 
-            # Get player multiplier
-            statement = select(UserReferrals).where(
-                UserReferrals.tg_user_id.in_(player_ids)
-            )
+        check_claim(cycle_start_timestamp, agent_ids, attempt)
+        update_player_emissions_for_agents(total_player_emissions, cycle_end_timestamp)
+
+        check_claim(cycle_start_timestamp, agent_ids, attempt)
+        update_creator_emissions_for_agents(total_creator_emissions, cycle_end_timestamp)
+
+        check_claim(cycle_start_timestamp, agent_ids, attempt)
+        update_staker_emissions_for_agents(total_staker_emissions, cycle_end_timestamp)
+
+    except Exception as e:
+        update_progress(cycle_start_timestamp, agent_ids, InAgentEmissionStatus.FAILED, attempt)
+        raise e
 
-            player_referrals = session.exec(statement).all()
-            player_multipliers = {}
-            for player_referral in player_referrals:
-                player_multipliers[player_referral.tg_user_id] = player_referral.get_multiplier()
+    update_progress(cycle_start_timestamp, agent_ids, InAgentEmissionStatus.DONE, attempt)
 
-            # Get old records
-            statement = select(PlayerWeeklyEmissions).where(
-                PlayerWeeklyEmissions.user_agent_id==agent_id,
-                PlayerWeeklyEmissions.tg_user_id.in_(player_ids),
-                PlayerWeeklyEmissions.day==cycle_start_timestamp,
+
+def init_progress(cycle_start_timestamp: int, agent_ids: List[int], reset: bool = False):
+    # Reset the progress of the cycle so that the agents done before are run again
+    # Used if the upstream agent emissions changed
+    # The attempts are kept, never reused by a new attempt
+
+    with Session(engine) as session:
+        if reset:
+            statement = update(InAgentEmissionProgress).where(
+                InAgentEmissionProgress.day == cycle_start_timestamp
+            ).values(
+                status=InAgentEmissionStatus.PENDING,
+                updated_at=unix_timestamp_in_seconds()
             )
+            session.execute(statement)
 
-            player_emissions = session.exec(statement).all()
+        statement = select(InAgentEmissionProgress.user_agent_id).where(
+            InAgentEmissionProgress.day == cycle_start_timestamp
+        )
+        existing_agent_ids = set(session.exec(statement).all())
 
-            player_scores = {}
-            for tg_user_id, num_payment in user_deposit_count:
-                if tg_user_id in player_multipliers:
-                    player_scores[tg_user_id] = num_payment * player_multipliers[tg_user_id]
-                else:
-                    player_scores[tg_user_id] = num_payment
+        now = unix_timestamp_in_seconds()
 
-            for player_emission in player_emissions:
-                if player_emission.tg_user_id not in player_scores:
-                    session.delete(player_emission)
-                else:
-                    player_emission.score = player_scores[player_emission.tg_user_id]
-                    session.add(player_emission)
-                    del player_scores[player_emission.tg_user_id]
+        new_records = [{
+                "day": cycle_start_timestamp,
+                "user_agent_id": agent_id,
+                "status": InAgentEmissionStatus.PENDING,
+                "attempts": 0,
+                "updated_at": now
+            } for agent_id in agent_ids if agent_id not in existing_agent_ids
+        ]
 
-            for tg_user_id in player_scores:
-                player_weekly_emission = PlayerWeeklyEmissions(
-                    user_agent_id=agent_id,
-                    tg_user_id=tg_user_id,
-                    day=cycle_start_timestamp,
-                    score=player_scores[tg_user_id]
-                )
+        if len(new_records) != 0:
+            session.execute(insert(InAgentEmissionProgress), new_records)
 
-                session.add(player_weekly_emission)
+        session.commit()
 
-            session.commit()
 
-            if len(user_deposit_count) < page_size:
-                break
+def start_attempt(cycle_start_timestamp: int, agent_ids: List[int]) -> int:
+    # Hand the agents over to a new attempt, numbered after all the attempts of the cycle
+    # Return the attempt number the workers check before writing
 
-            current_page += 1
+    with Session(engine) as session:
+        statement = select(func.max(InAgentEmissionProgress.attempts)).where(
+            InAgentEmissionProgress.day == cycle_start_timestamp
+        )
+        attempt = (session.exec(statement).one() or 0) + 1
+
+        statement = update(InAgentEmissionProgress).where(
+            InAgentEmissionProgress.day == cycle_start_timestamp,
+            InAgentEmissionProgress.user_agent_id.in_(agent_ids)
+        ).values(
+            status=InAgentEmissionStatus.PENDING,
+            attempts=attempt,
+            updated_at=unix_timestamp_in_seconds()
+        )
+
+        session.execute(statement)
+        session.commit()
+
+    return attempt
+
+
+def claim_agents(cycle_start_timestamp: int, agent_ids: List[int], attempt: int) -> Set[int]:
+    # Mark the agents pending in the attempt as running
+    # Return the agents claimed
+
+    update_progress(cycle_start_timestamp, agent_ids, InAgentEmissionStatus.RUNNING, attempt, InAgentEmissionStatus.PENDING)
 
-    # Get total player scores
     with Session(engine) as session:
-        statement = select(func.sum(PlayerWeeklyEmissions.score)).where(
-            PlayerWeeklyEmissions.day == cycle_start_timestamp,
-            PlayerWeeklyEmissions.user_agent_id == agent_id
+        statement = select(InAgentEmissionProgress.user_agent_id).where(
+            InAgentEmissionProgress.day == cycle_start_timestamp,
+            InAgentEmissionProgress.user_agent_id.in_(agent_ids),
+            InAgentEmissionProgress.attempts == attempt,
+            InAgentEmissionProgress.status == InAgentEmissionStatus.RUNNING
         )
 
-        total_score = session.exec(statement).one()
-        logger.info(f"total player score for agent {agent_id}: {total_score}")
+        return set(session.exec(statement).all())
 
-    # Update player emissions
-    current_page = 0
-    while True:
-        with Session(engine) as session:
-            statement = select(PlayerWeeklyEmissions).where(
-                PlayerWeeklyEmissions.day == cycle_start_timestamp,
-                PlayerWeeklyEmissions.user_agent_id == agent_id
-            ).order_by(PlayerWeeklyEmissions.id.asc()).offset(current_page * page_size).limit(page_size)
 
-            player_emissions = session.exec(statement).all()
+def check_claim(cycle_start_timestamp: int, agent_ids: List[int], attempt: int):
+    # Stop writing once a later attempt took over the agents
 
-            logger.info(f"{len(player_emissions)} player emissions in page {current_page}")
+    with Session(engine) as session:
+        statement = select(func.count(InAgentEmissionProgress.id)).where(
+            InAgentEmissionProgress.day == cycle_start_timestamp,
+            InAgentEmissionProgress.user_agent_id.in_(agent_ids),
+            InAgentEmissionProgress.attempts == attempt
+        )
 
-            for player_emission in player_emissions:
-                player_emission.emission = math.floor(total_player_emissions * player_emission.score / total_score)
-                session.add(player_emission)
+        num_claimed = session.exec(statement).one()
 
-            session.commit()
+    if num_claimed != len(agent_ids):
+        raise InAgentEmissionClaimLostException(f"Attempt {attempt}: agents taken over by a later attempt")
 
-            if len(player_emissions) < page_size:
-                break
 
-            current_page += 1
+def update_progress(cycle_start_timestamp: int, agent_ids: List[int], status: int, attempt: int, from_status: Optional[int] = None):
+    # Only the agents still owned by the attempt are updated
 
-    logger.info(f"All player emissions updated for agent {agent_id}")
+    with Session(engine) as session:
+        statement = update(InAgentEmissionProgress).where(
+            InAgentEmissionProgress.day == cycle_start_timestamp,
+            InAgentEmissionProgress.user_agent_id.in_(agent_ids),
+            InAgentEmissionProgress.attempts == attempt
+        ).values(
+            status=status,
+            updated_at=unix_timestamp_in_seconds()
+        )
 
+        if from_status is not None:
+            statement = statement.where(InAgentEmissionProgress.status == from_status)
 
-def update_creator_emissions_for_agent(agent_id: int, cycle_end_timestamp: int, total_creator_emissions: int):
+        session.execute(statement)
+        session.commit()
 
-    cycle_start_timestamp = cycle_end_timestamp - settings.tn_emission_interval_days * 86400
-    logger.info(f"Total creator emissions: {total_creator_emissions}")
 
+def get_done_agent_ids(cycle_start_timestamp: int) -> Set[int]:
     with Session(engine) as session:
-        statement = select(CreatorWeeklyEmissions).where(CreatorWeeklyEmissions.user_agent_id == agent_id, CreatorWeeklyEmissions.day == cycle_start_timestamp)
-        creator_weekly_emissions = session.exec(statement).first()
+        statement = select(InAgentEmissionProgress.user_agent_id).where(
+            InAgentEmissionProgress.day == cycle_start_timestamp,
+            InAgentEmissionProgress.status == InAgentEmissionStatus.DONE
+        )
+
+        return set(session.exec(statement).all())
+
+
+def wait_for_agents(cycle_start_timestamp: int, agent_ids: List[int]) -> bool:
+    # Wait until the workers finish or fail all the given agents
+    # Return False if some are still unfinished after the timeout
+
+    agent_ids = set(agent_ids)
+    started_at = time.time()
 
-        if creator_weekly_emissions is None:
-            creator_weekly_emissions = CreatorWeeklyEmissions(
-                user_agent_id=agent_id,
-                day=cycle_start_timestamp
+    while time.time() - started_at < settings.emission_agent_timeout:
+        time.sleep(5)
+
+        with Session(engine) as session:
+            statement = select(InAgentEmissionProgress.user_agent_id).where(
+                InAgentEmissionProgress.day == cycle_start_timestamp,
+                InAgentEmissionProgress.status.in_([InAgentEmissionStatus.DONE, InAgentEmissionStatus.FAILED])
             )
 
-        creator_weekly_emissions.emission = total_creator_emissions
+            finished_agent_ids = set(session.exec(statement).all())
 
-        session.add(creator_weekly_emissions)
-        session.commit()
+        remaining = len(agent_ids - finished_agent_ids)
 
-    logger.info(f"Creator emissions updated for agent {agent_id}")
+        logger.info(f"Waiting for the emission workers: {remaining}/{len(agent_ids)} agents remaining")
 
+        if remaining == 0:
+            return True
 
-def update_staker_emissions_for_agent(agent_id: int, cycle_end_timestamp: int, total_staker_emissions: int):
-    cycle_start_timestamp = cycle_end_timestamp - settings.tn_emission_interval_days * 86400
+    logger.error(f"Timeout waiting for the emission workers")
 
-    logger.info(f"Total staker emissions: {total_staker_emissions}")
+    return False
 
-    # Calculating staking scores
 
-    current_page = 0
-    while True:
-        with Session(engine) as session:
-            statement = select(UserStaking).where(
-                UserStaking.user_agent_id == agent_id,
-                UserStaking.status == UserStakingStatus.SUCCESS,
-                UserStaking.created_at < cycle_start_timestamp,
-                or_(
-                    UserStaking.released_at.is_(None),
-                    UserStaking.released_at >= cycle_end_timestamp
-                )
-            ).order_by(UserStaking.id.asc()).offset(current_page * page_size).limit(page_size)
+def update_player_emissions_for_agents(total_player_emissions: Dict[int, int], cycle_end_timestamp: int):
 
-            user_stakings = session.exec(statement).all()
+    if len(total_player_emissions) == 0:
+        return
 
-            logger.info(f"{len(user_stakings)} user stakings for agent {agent_id} in page {current_page}")
+    cycle_start_timestamp = cycle_end_timestamp - settings.tn_emission_interval_days * 86400
 
-            staking_ids = [staking.id for staking in user_stakings]
+    agent_ids = list(total_player_emissions.keys())
 
-            staking_scores = {}
-            for user_staking in user_stakings:
-                staking_scores[user_staking.id] = [user_staking.tg_user_id, math.floor(user_staking.amount * user_staking.get_multiplier(cycle_end_timestamp))]
+    logger.info(f"Updating player emissions for {len(agent_ids)} agents")
 
-            # Get old records
-            statement = select(StakerWeeklyEmissions).where(
-                StakerWeeklyEmissions.staking_id.in_(staking_ids),
-                StakerWeeklyEmissions.day==cycle_start_timestamp,
+    with Session(engine) as session:
+        # Get player play sessions (num of payments) of all the agents
+        statement = select(
+            TgUserAgentPayment.user_agent_id,
+            TgUserAgentPayment.tg_user_id,
+            func.count(TgUserAgentPayment.id)
+        ).where(
+            TgUserAgentPayment.created_at >= cycle_start_timestamp,
+            TgUserAgentPayment.created_at < cycle_end_timestamp,
+            TgUserAgentPayment.user_agent_id.in_(agent_ids)
+        ).group_by(TgUserAgentPayment.user_agent_id, TgUserAgentPayment.tg_user_id)
+
+        agent_player_payments = session.exec(statement).all()
+
+        logger.info(f"{len(agent_player_payments)} agent players found")
+
+        # Get player multiplier
+        player_ids = list(set([tg_user_id for _, tg_user_id, _ in agent_player_payments]))
+        player_multipliers = {}
+
+        for i in range(0, len(player_ids), in_batch_size):
+            statement = select(UserReferrals.tg_user_id, UserReferrals.num_activated_referrals).where(
+                UserReferrals.tg_user_id.in_(player_ids[i:i+in_batch_size])
             )
 
-            staking_emissions = session.exec(statement).all()
+            for tg_user_id, num_activated_referrals in session.exec(statement).all():
+                player_multipliers[tg_user_id] = get_referral_multiplier(num_activated_referrals)
+
+    agent_player_rows: Dict[int, List] = {agent_id: [] for agent_id in agent_ids}
+
+    for agent_id, tg_user_id, num_payment in agent_player_payments:
+        agent_player_rows[agent_id].append({
+            "user_agent_id": agent_id,
+            "tg_user_id": tg_user_id,
+            "score": num_payment * player_multipliers.get(tg_user_id, 1)
+        })
+
+    # Update player emissions
+    player_rows = []
+    for agent_id in agent_ids:
+        logger.info(f"[Agent {agent_id}] Total player emissions: {total_player_emissions[agent_id]}")
+        player_rows.extend(with_emissions(agent_player_rows[agent_id], total_player_emissions[agent_id]))
 
-            # Update / delete old records
-            for staking_emission in staking_emissions:
-                if staking_emission.staking_id in staking_scores:
-                    staking_emission.score = staking_scores[staking_emission.staking_id][1]
-                    session.add(staking_emission)
-                    del staking_scores[staking_emission.staking_id]
-                else:
-                    session.delete(staking_emission)
+    write_weekly_emissions(
+        PlayerWeeklyEmissions,
+        cycle_start_timestamp,
+        ["user_agent_id", "tg_user_id"],
+        ["day", "user_agent_id", "tg_user_id"],
+        player_rows,
+        [PlayerWeeklyEmissions.user_agent_id.in_(agent_ids)]
+    )
 
-            # Add new records
-            for staking_id in staking_scores:
-                staking_emission = StakerWeeklyEmissions(
-                    user_agent_id=agent_id,
-                    staking_id=staking_id,
-                    tg_user_id=staking_scores[staking_id][0],
-                    score=staking_scores[staking_id][1],
-                    day=cycle_start_timestamp
-                )
+    logger.info(f"All player emissions updated for {len(agent_ids)} agents")
 
-                session.add(staking_emission)
 
-            session.commit()
+def update_creator_emissions_for_agents(total_creator_emissions: Dict[int, int], cycle_end_timestamp: int):
 
-            if len(user_stakings) < page_size:
-                break
+    if len(total_creator_emissions) == 0:
+        return
 
-            current_page += 1
+    cycle_start_timestamp = cycle_end_timestamp - settings.tn_emission_interval_days * 86400
 
-    # Get total staking scores
     with Session(engine) as session:
-        statement = select(func.sum(StakerWeeklyEmissions.score)).where(
-            StakerWeeklyEmissions.day == cycle_start_timestamp,
-            StakerWeeklyEmissions.user_agent_id == agent_id
+        statement = select(CreatorWeeklyEmissions.id, CreatorWeeklyEmissions.user_agent_id).where(
+            CreatorWeeklyEmissions.user_agent_id.in_(total_creator_emissions.keys()),
+            CreatorWeeklyEmissions.day == cycle_start_timestamp
         )
 
-        total_score = session.exec(statement).one()
-        logger.info(f"total staking score for agent {agent_id}: {total_score}")
+        existing_records = session.exec(statement).all()
+        existing_agent_ids = set([agent_id for _, agent_id in existing_records])
 
-    # Update staking emissions
-    current_page = 0
+        updated_records = [{
+                "id": record_id,
+                "emission": total_creator_emissions[agent_id]
+            } for record_id, agent_id in existing_records
+        ]
+
+        now = unix_timestamp_in_seconds()
+
+        new_records = [{
+                "user_agent_id": agent_id,
+                "day": cycle_start_timestamp,
+                "emission": emission,
+                "created_at": now
+            } for agent_id, emission in total_creator_emissions.items() if agent_id not in existing_agent_ids
+        ]
+
+        if len(updated_records) != 0:
+            session.execute(update(CreatorWeeklyEmissions), updated_records)
+
+        if len(new_records) != 0:
+            session.execute(insert(CreatorWeeklyEmissions), new_records)
+
+        session.commit()
+
+    logger.info(f"Creator emissions updated for {len(total_creator_emissions)} agents")
+
+
+def update_staker_emissions_for_agents(total_staker_emissions: Dict[int, int], cycle_end_timestamp: int):
+    cycle_start_timestamp = cycle_end_timestamp - settings.tn_emission_interval_days * 86400
+
+    agent_ids = list(total_staker_emissions.keys())
+
+    logger.info(f"Updating staker emissions for {len(agent_ids)} agents")
+
+    # Calculating staking scores of all the agents
+
+    agent_staking_rows: Dict[int, List] = {agent_id: [] for agent_id in agent_ids}
+
+    last_staking_id = 0
     while True:
         with Session(engine) as session:
-            statement = select(StakerWeeklyEmissions).where(
-                StakerWeeklyEmissions.user_agent_id==agent_id,
-                StakerWeeklyEmissions.day==cycle_start_timestamp,
-            ).order_by(StakerWeeklyEmissions.id).offset(current_page * page_size).limit(page_size)
-
-            staking_emissions = session.exec(statement).all()
+            statement = select(UserStaking.id, UserStaking.user_agent_id, UserStaking.tg_user_id, UserStaking.amount, UserStaking.created_at).where(
+                UserStaking.user_agent_id.in_(agent_ids),
+                UserStaking.status == UserStakingStatus.SUCCESS,
+                UserStaking.created_at < cycle_start_timestamp,
+                or_(
+                    UserStaking.released_at.is_(None),
+                    UserStaking.released_at >= cycle_end_timestamp
+                ),
+                UserStaking.id > last_staking_id
+            ).order_by(UserStaking.id.asc()).limit(page_size)
 
-            logger.info(f"{len(staking_emissions)} staking emissions for agent {agent_id} in page {current_page}")
+            user_stakings = session.exec(statement).all()
 
-            for staking_emission in staking_emissions:
-                staking_emission.emission = math.floor(total_staker_emissions * staking_emission.score / total_score)
-                session.add(staking_emission)
+        logger.info(f"{len(user_stakings)} user stakings after {last_staking_id}")
 
-            session.commit()
+        for staking_id, agent_id, tg_user_id, amount, created_at in user_stakings:
+            agent_staking_rows[agent_id].append({
+                "user_agent_id": agent_id,
+                "staking_id": staking_id,
+                "tg_user_id": tg_user_id,
+                "score": math.floor(amount * get_staking_multiplier(created_at, cycle_end_timestamp))
+            })
 
-            if len(staking_emissions) < page_size:
-                break
+        if len(user_stakings) < page_size:
+            break
 
-            current_page += 1
+        last_staking_id = user_stakings[-1][0]
 
-    logger.info(f"All staker emissions updated for agent {agent_id}")
+    # Update staking emissions
+    staking_rows = []
+    for agent_id in agent_ids:
+        logger.info(f"[Agent {agent_id}] Total staker emissions: {total_staker_emissions[agent_id]}")
+        staking_rows.extend(with_emissions(agent_staking_rows[agent_id], total_staker_emissions[agent_id]))
+
+    write_weekly_emissions(
+        StakerWeeklyEmissions,
+        cycle_start_timestamp,
+        ["staking_id"],
+        ["day", "staking_id"],
+        staking_rows,
+        [StakerWeeklyEmissions.user_agent_id.in_(agent_ids)]
+    )
+
+    logger.info(f"All staker emissions updated for {len(agent_ids)} agents")
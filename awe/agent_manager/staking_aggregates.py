@@ -0,0 +1,131 @@
+from awe.db import engine
+from sqlmodel import Session, select, update, delete, insert
+from awe.models import UserStaking, UserStakingAggregates
+from awe.models.user_staking import UserStakingStatus
+from awe.models.user_staking_aggregates import get_cycle_start
+from typing import Dict, Tuple
+import logging
+import argparse
+
+logger = logging.getLogger("[Staking Aggregates]")
+
+page_size = 1000
+
+
+def compute_staking_aggregates() -> Dict[Tuple[int, int, int], Tuple[int, int]]:
+    # Build the aggregates from the raw staking rows
+    # (agent id, created cycle, released cycle) -> (amount, num of stakings)
+
+    aggregates = {}
+
+    last_staking_id = 0
+    while True:
+        with Session(engine) as session:
+            statement = select(
+                UserStaking.id, UserStaking.user_agent_id, UserStaking.amount, UserStaking.created_at, UserStaking.released_at
+            ).where(
+                UserStaking.status == UserStakingStatus.SUCCESS,
+                UserStaking.id > last_staking_id
+            ).order_by(UserStaking.id.asc()).limit(page_size)
+
+            user_stakings = session.exec(statement).all()
+
+        for _, agent_id, amount, created_at, released_at in user_stakings:
+            key = (agent_id, get_cycle_start(created_at), 0 if released_at is None else get_cycle_start(released_at))
+            total_amount, num_stakings = aggregates.get(key, (0, 0))
+            aggregates[key] = (total_amount + amount, num_stakings + 1)
+
+        if len(user_stakings) < page_size:
+            break
+
+        last_staking_id = user_stakings[-1][0]
+
+    return aggregates
+
+
+def reconcile_staking_aggregates(fix: bool = False) -> Dict[str, int]:
+    # Compare the maintained aggregates with the ones rebuilt from the raw rows
+    # Write the rebuilt ones back if fix is set
+    # Stakings finalized during a fix run might be overwritten, run it again after
+    # Return the drift found
+
+    aggregates = compute_staking_aggregates()
+
+    with Session(engine) as session:
+        statement = select(
+            UserStakingAggregates.id,
+            UserStakingAggregates.user_agent_id,
+            UserStakingAggregates.created_cycle,
+            UserStakingAggregates.released_cycle,
+            UserStakingAggregates.amount,
+            UserStakingAggregates.num_stakings
+        )
+
+        stored_aggregates = session.exec(statement).all()
+
+        updated_records = []
+        deleted_record_ids = []
+        amount_drift = 0
+
+        for record_id, agent_id, created_cycle, released_cycle, amount, num_stakings in stored_aggregates:
+            key = (agent_id, created_cycle, released_cycle)
+            expected_amount, expected_num_stakings = aggregates.pop(key, (0, 0))
+
+            if amount == expected_amount and num_stakings == expected_num_stakings:
+                continue
+
+            logger.warning(f"[Agent {agent_id}] Aggregate ({created_cycle}, {released_cycle}) drifted: amount {amount} -> {expected_amount}, stakings {num_stakings} -> {expected_num_stakings}")
+            amount_drift += abs(amount - expected_amount)
+
+            if expected_num_stakings == 0:
+                deleted_record_ids.append(record_id)
+            else:
+                updated_records.append({"id": record_id, "amount": expected_amount, "num_stakings": expected_num_stakings})
+
+        # The remaining ones are missing
+        new_records = []
+        for (agent_id, created_cycle, released_cycle), (amount, num_stakings) in aggregates.items():
+            logger.warning(f"[Agent {agent_id}] Aggregate ({created_cycle}, {released_cycle}) missing: amount {amount}, stakings {num_stakings}")
+            amount_drift += amount
+            new_records.append({
+                "user_agent_id": agent_id,
+                "created_cycle": created_cycle,
+                "released_cycle": released_cycle,
+                "amount": amount,
+                "num_stakings": num_stakings
+            })
+
+        if fix:
+            if len(updated_records) != 0:
+                session.execute(update(UserStakingAggregates), updated_records)
+
+            if len(deleted_record_ids) != 0:
+                session.execute(delete(UserStakingAggregates).where(UserStakingAggregates.id.in_(deleted_record_ids)))
+
+            if len(new_records) != 0:
+                session.execute(insert(UserStakingAggregates), new_records)
+
+            session.commit()
+
+    drift = {
+        "drifted": len(updated_records),
+        "stale": len(deleted_record_ids),
+        "missing": len(new_records),
+        "amount_drift": amount_drift
+    }
+
+    logger.info(f"Staking aggregates reconciled, fixed: {fix}, drift: {drift}")
+
+    return drift
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Rebuild the staking aggregates from the stakings and report the drift")
+    parser.add_argument("--fix", action="store_true", help="Write the rebuilt aggregates back")
+    args = parser.parse_args()
+
+    drift = reconcile_staking_aggregates(args.fix)
+
+    for name, value in drift.items():
+        print(f"{name}: {value}")
@@ -0,0 +1,20 @@
+from ...celery import app
+from ..emission_pipeline import run_emission_pipeline
+from ..in_agent_emissions import distribute_in_agent_emissions_for_agents
+from ..staking_aggregates import reconcile_staking_aggregates
+from typing import Dict, List
+
+
+@app.task
+def emission_pipeline(cycle_end_timestamp: int, dry_run: bool, rerun_stages: List[str]) -> Dict[str, int]:
+    return run_emission_pipeline(cycle_end_timestamp, dry_run, rerun_stages)
+
+
+@app.task
+def in_agent_emissions(agents: List[List[int]], cycle_end_timestamp: int, attempt: int):
+    distribute_in_agent_emissions_for_agents(agents, cycle_end_timestamp, attempt)
+
+
+@app.task
+def staking_aggregates(fix: bool) -> Dict[str, int]:
+    return reconcile_staking_aggregates(fix)
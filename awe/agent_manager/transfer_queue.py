@@ -0,0 +1,12 @@
+from awe.cache import cache
+import json
+
+# Outgoing transfers waiting to be packed into a batched tx
+outgoing_transfers_key = "AWE_OUTGOING_TRANSFERS"
+
+# Transfers taken by the batcher, removed once their tx is recorded
+processing_transfers_key = "AWE_OUTGOING_TRANSFERS_PROCESSING"
+
+
+def enqueue_transfer(request_id: str, address: str, amount: int):
+    cache.rpush(outgoing_transfers_key, json.dumps([request_id, address, amount]))
@@ -0,0 +1,3 @@
+from awe.settings import settings
+from ..celery import app
+from .tasks.emission_task import emission_pipeline, in_agent_emissions, staking_aggregates
@@ -1,14 +1,31 @@
 from fastapi import FastAPI
+from contextlib import asynccontextmanager
+import asyncio
 from fastapi.middleware.cors import CORSMiddleware
 from .routers.v1 import user_agents, admin, agent_stats, tg_phantom_wallets, user_wallets, agents, awe, emission
-from fastapi.staticfiles import StaticFiles
-from slowapi import Limiter, _rate_limit_exceeded_handler
-from slowapi.util import get_remote_address
+from slowapi import _rate_limit_exceeded_handler
 from slowapi.middleware import SlowAPIMiddleware
 from slowapi.errors import RateLimitExceeded
-from awe.settings import settings
+from .limiter import limiter, AdminRateLimitExemption
+from .pfp import PfpStaticFiles, pfp_dir
+from .dependencies import listen_ownership_invalidations
 
-app = FastAPI(redirect_slashes=False)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    background_tasks = [
+        asyncio.create_task(listen_ownership_invalidations())
+    ]
+
+    yield
+
+    for task in background_tasks:
+        task.cancel()
+
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+
+
+app = FastAPI(redirect_slashes=False, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,10 +36,10 @@ app.add_middleware(
 )
 
 
-limiter = Limiter(key_func=get_remote_address, default_limits=[settings.api_rate_limit])
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 app.add_middleware(SlowAPIMiddleware)
+app.add_middleware(AdminRateLimitExemption)
 
 
 app.include_router(user_agents.router)
@@ -36,4 +53,4 @@ app.include_router(emission.router)
 
 
 # Agent PFPs
-app.mount("/pfps", StaticFiles(directory="persisted_data/pfps"), name="agent_pfps")
+app.mount("/pfps", PfpStaticFiles(directory=pfp_dir), name="agent_pfps")
@@ -1,10 +1,12 @@
-from typing import Annotated
+from typing import Annotated, Any, Optional
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from awe.blockchain import awe_on_chain
 import base64
 import json
 from time import time
+from collections import OrderedDict
+from threading import Lock
 import logging
 import traceback
 from sqlmodel import Session, select
@@ -12,11 +14,103 @@ from awe.db import engine
 from awe.models.user_agent import UserAgent
 from sqlalchemy import func
 from awe.settings import settings
+from awe.cache import cache, get_async_cache, async_block_timeout
+import asyncio
 
 logger = logging.getLogger("[API Depends]")
 
 security = HTTPBearer()
 
+
+class TTLCache:
+    # Bounded LRU cache with an expiry per entry
+    # Shared by the threads of the API process
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key) -> Optional[Any]:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires_at = entry
+            if expires_at <= time():
+                del self.entries[key]
+                return None
+
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at: float):
+        with self.lock:
+            self.entries[key] = (value, expires_at)
+            self.entries.move_to_end(key)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+# Token -> address, expiring with the token
+verified_tokens = TTLCache(settings.api_auth_cache_size)
+
+# (address, agent id) of the agents owned, not deleted
+user_agent_ownerships = TTLCache(settings.api_auth_cache_size)
+
+
+# Ownerships removed in an API process, published to the others
+ownership_invalidation_channel = "AWE_USER_AGENT_OWNERSHIP_INVALIDATION_CHANNEL"
+
+
+def invalidate_user_agent_ownership(user_address: str, agent_id):
+    user_agent_ownerships.delete((user_address, str(agent_id)))
+
+    try:
+        cache.publish(ownership_invalidation_channel, json.dumps([user_address, str(agent_id)]))
+    except Exception as e:
+        # The others expire it after api_ownership_cache_ttl
+        logger.error(e)
+
+
+async def listen_ownership_invalidations():
+    # Remove the ownerships invalidated by the other API processes
+    # Messages are lost while disconnected, so the whole cache is dropped after subscribing
+    while True:
+        try:
+            async_cache = get_async_cache()
+            pubsub = async_cache.pubsub()
+
+            try:
+                await pubsub.subscribe(ownership_invalidation_channel)
+                user_agent_ownerships.clear()
+
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=async_block_timeout)
+
+                    if message is not None:
+                        user_address, agent_id = json.loads(message["data"])
+                        user_agent_ownerships.delete((user_address, agent_id))
+            finally:
+                await pubsub.aclose()
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(e)
+            await asyncio.sleep(1)
+
+
 def get_admin(credentials: Annotated[HTTPAuthorizationCredentials, Depends(security)]) -> str:
     exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -44,6 +138,10 @@ def get_current_user(credentials: Annotated[HTTPAuthorizationCredentials, Depend
 
     logger.debug(f"Auth API access with token: {token}")
 
+    address = verified_tokens.get(token)
+    if address is not None:
+        return address
+
     try:
         b64_decoded = base64.b64decode(token)
 
@@ -106,6 +204,8 @@ def get_current_user(credentials: Annotated[HTTPAuthorizationCredentials, Depend
         exception.detail = "Invalid signature"
         raise exception
 
+    verified_tokens.set(token, address, token_dict["expires"])
+
     return address
 
 
@@ -115,6 +215,11 @@ def validate_user_agent(agent_id, user_address: Annotated[str, Depends(get_curre
         detail="Invalid agent id"
     )
 
+    ownership_key = (user_address, str(agent_id))
+
+    if user_agent_ownerships.get(ownership_key):
+        return True
+
     with Session(engine) as session:
         statement = select(func.count(UserAgent.id)).where(
             UserAgent.id == agent_id,
@@ -125,4 +230,6 @@ def validate_user_agent(agent_id, user_address: Annotated[str, Depends(get_curre
         if count == 0:
             raise exception
 
+    user_agent_ownerships.set(ownership_key, True, time() + settings.api_ownership_cache_ttl)
+
     return True
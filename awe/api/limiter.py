@@ -0,0 +1,34 @@
+from slowapi import Limiter
+from slowapi.util import get_remote_address
+from starlette.requests import Request
+from starlette.types import ASGIApp, Scope, Receive, Send
+from awe.settings import settings
+
+# Moving window in Redis, one Lua call per limit checked
+# Routes with their own limit skip the default one
+limiter = Limiter(
+    key_func=get_remote_address,
+    default_limits=[settings.api_rate_limit],
+    storage_uri=settings.api_rate_limit_storage or settings.redis_cache,
+    storage_options={"socket_timeout": 3, "socket_connect_timeout": 3},
+    strategy="moving-window",
+    key_prefix="AWE_API_RATE_LIMIT",
+    in_memory_fallback_enabled=True
+)
+
+
+class AdminRateLimitExemption:
+    # Requests with the admin token are not rate limited
+    # Marks them as checked before the limiter middleware and route decorators see them
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http":
+            request = Request(scope)
+            if request.headers.get("authorization") == f"Bearer {settings.admin_token}":
+                request.state._rate_limiting_complete = True
+                request.state.view_rate_limit = None
+
+        await self.app(scope, receive, send)
@@ -0,0 +1,107 @@
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.types import Scope
+from PIL import Image, ImageOps
+from awe.settings import settings
+import hashlib
+import os
+import re
+import uuid
+
+pfp_dir = "persisted_data/pfps"
+
+# Square variants generated on upload, the first one is the original size
+pfp_sizes = [256, 128, 64]
+
+# File extension => Pillow format
+pfp_formats = {
+    "webp": "WEBP",
+    "jpg": "JPEG"
+}
+
+pfp_quality = 85
+
+# Named after the content, never changed once written
+hashed_pfp_pattern = re.compile(r"^[0-9a-f]{16}_\d+\.(webp|jpg)$")
+
+immutable_cache_control = "public, max-age=31536000, immutable"
+
+
+def normalize_pfp(img: Image.Image) -> Image.Image:
+    # Center cropped square of the largest size, RGB or RGBA
+    img = ImageOps.exif_transpose(img)
+
+    has_alpha = img.mode in ("RGBA", "LA") or (img.mode == "P" and "transparency" in img.info)
+    img = img.convert("RGBA" if has_alpha else "RGB")
+
+    return ImageOps.fit(img, (pfp_sizes[0], pfp_sizes[0]), Image.Resampling.LANCZOS)
+
+
+def get_pfp_hash(img: Image.Image) -> str:
+    # Hash of the pixels, the same image always gets the same names
+    return hashlib.sha256(img.mode.encode() + img.tobytes()).hexdigest()[:16]
+
+
+def save_pfp_file(img: Image.Image, file_name: str, format: str):
+    # Written to a temp file first, never served half written
+    file_path = os.path.join(pfp_dir, file_name)
+    tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+
+    if format == "JPEG" and img.mode == "RGBA":
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.getchannel("A"))
+        img = background
+
+    img.save(tmp_path, format, quality=pfp_quality)
+    os.replace(tmp_path, file_path)
+
+
+def save_pfp(agent_id: int, img: Image.Image) -> str:
+    img = normalize_pfp(img)
+    pfp_hash = get_pfp_hash(img)
+
+    for size in pfp_sizes:
+        img_resized = img if size == pfp_sizes[0] else img.resize((size, size), Image.Resampling.LANCZOS)
+
+        for ext, format in pfp_formats.items():
+            file_name = f"{pfp_hash}_{size}.{ext}"
+            if not os.path.exists(os.path.join(pfp_dir, file_name)):
+                save_pfp_file(img_resized, file_name, format)
+
+    # Kept for the clients still loading the PFP by the agent id
+    save_pfp_file(img, f"{agent_id}.png", "PNG")
+
+    return pfp_hash
+
+
+class PfpStaticFiles(StaticFiles):
+    # Content hashed PFPs are cached forever, the legacy ones by agent id for pfp_max_age
+    # With pfp_accel_redirect set, nginx sends the file instead of the API process
+
+    def file_response(self, full_path, stat_result, scope: Scope, status_code: int = 200) -> Response:
+        file_name = os.path.basename(full_path)
+
+        if hashed_pfp_pattern.match(file_name):
+            cache_control = immutable_cache_control
+        else:
+            cache_control = f"public, max-age={settings.pfp_max_age}"
+
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        response.headers["Cache-Control"] = cache_control
+
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return Response(status_code=304, headers={
+                "Cache-Control": cache_control,
+                "ETag": response.headers["etag"]
+            })
+
+        if settings.pfp_accel_redirect is not None:
+            return Response(status_code=status_code, media_type=response.media_type, headers={
+                "X-Accel-Redirect": f"{settings.pfp_accel_redirect.rstrip('/')}/{file_name}",
+                "Cache-Control": cache_control,
+                "ETag": response.headers["etag"],
+                "Last-Modified": response.headers["last-modified"]
+            })
+
+        return response
@@ -6,9 +6,10 @@ from awe.api.dependencies import get_admin
 from awe.blockchain import awe_on_chain
 
 import logging
-from awe.db import engine
+from awe.db import engine, get_pool_metrics
 from sqlmodel import Session, select
 from awe.maintenance import start_maintenance, stop_maintenance, is_in_maintenance_sync
+from awe.agent_manager.agent_leaderboard import mark_agent_dirty
 
 logger = logging.getLogger("[Admin API]")
 
@@ -49,6 +50,7 @@ class QuoteParams(BaseModel):
 @router.post("/agents/{agent_id}/awe_quote", response_model=Optional[UserAgentData])
 def add_user_agent_awe_quote(agent_id, quote_params: QuoteParams, _: Annotated[str, Depends(get_admin)]):
     user_agent_data = UserAgentData.add_awe_token_quote(agent_id, quote_params.amount)
+    mark_agent_dirty(agent_id)
     return user_agent_data
 
 
@@ -73,6 +75,12 @@ def add_tg_user_balance_reward(tg_user_id: str, reward_params: AddBalanceRewardP
     return tg_user_account
 
 
+@router.get("/system/db/pool")
+def get_db_pool_metrics(_: Annotated[str, Depends(get_admin)]):
+    # Pool metrics of the API process
+    return get_pool_metrics()
+
+
 @router.post("/system/maintenance")
 def start_maintenance_mode(_: Annotated[str, Depends(get_admin)]) -> bool:
     start_maintenance()
@@ -1,10 +1,16 @@
-from fastapi import APIRouter, Depends
-from typing import Optional, Annotated, List
+from fastapi import APIRouter, Depends, Query
+from typing import Optional, Annotated, List, Dict
 from awe.api.dependencies import validate_user_agent
-from sqlmodel import SQLModel, Session, select
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import literal, union_all
 from awe.models.utils import get_day_as_timestamp
 from awe.models import UserAgentStatsStakingDailyCounts, UserAgentStatsInvocationDailyCounts, UserAgentStatsUserDailyCounts, UserAgentStatsTokenTransferDailyCounts, UserAgentStatsPaymentDailyCounts
-from awe.db import engine
+from awe.agent_manager.agent_stats import get_cached_stats_dashboard, cache_stats_dashboard
+from awe.settings import settings
+from awe.db import get_async_session
+import asyncio
+import math
 
 router = APIRouter(
     prefix="/v1/agent-stats"
@@ -20,23 +26,22 @@ class StatsInvocationsResponse(SQLModel):
     token_transfer: List[int] = []
 
 @router.get("/{agent_id}/invocations", response_model=Optional[StatsInvocationsResponse])
-def get_invocations_by_agent_id(agent_id, _: Annotated[bool, Depends(validate_user_agent)]):
+async def get_invocations_by_agent_id(agent_id, _: Annotated[bool, Depends(validate_user_agent)], session: Annotated[AsyncSession, Depends(get_async_session)]):
     start_day = get_day_as_timestamp() - days_to_fetch * 86400
 
-    with Session(engine) as session:
-        invocation_statement = select(UserAgentStatsInvocationDailyCounts).where(
-            UserAgentStatsInvocationDailyCounts.user_agent_id == agent_id,
-            UserAgentStatsInvocationDailyCounts.day >= start_day
-        )
+    invocation_statement = select(UserAgentStatsInvocationDailyCounts).where(
+        UserAgentStatsInvocationDailyCounts.user_agent_id == agent_id,
+        UserAgentStatsInvocationDailyCounts.day >= start_day
+    )
 
-        invocation_stats = session.exec(invocation_statement).all()
+    invocation_stats = (await session.exec(invocation_statement)).all()
 
-        user_statement = select(UserAgentStatsUserDailyCounts).where(
-            UserAgentStatsUserDailyCounts.user_agent_id == agent_id,
-            UserAgentStatsUserDailyCounts.day >= start_day
-        )
+    user_statement = select(UserAgentStatsUserDailyCounts).where(
+        UserAgentStatsUserDailyCounts.user_agent_id == agent_id,
+        UserAgentStatsUserDailyCounts.day >= start_day
+    )
 
-        user_stats = session.exec(user_statement).all()
+    user_stats = (await session.exec(user_statement)).all()
 
     response = StatsInvocationsResponse()
 
@@ -71,16 +76,15 @@ class StatsTokenTransfersResponse(SQLModel):
     amounts: List[int] = []
 
 @router.get("/{agent_id}/token-transfers", response_model=Optional[StatsTokenTransfersResponse])
-def get_token_transfers_by_agent_id(agent_id, _: Annotated[bool, Depends(validate_user_agent)]):
+async def get_token_transfers_by_agent_id(agent_id, _: Annotated[bool, Depends(validate_user_agent)], session: Annotated[AsyncSession, Depends(get_async_session)]):
     start_day = get_day_as_timestamp() - days_to_fetch * 86400
 
-    with Session(engine) as session:
-        token_statement = select(UserAgentStatsTokenTransferDailyCounts).where(
-            UserAgentStatsTokenTransferDailyCounts.user_agent_id == agent_id,
-            UserAgentStatsTokenTransferDailyCounts.day >= start_day
-        )
+    token_statement = select(UserAgentStatsTokenTransferDailyCounts).where(
+        UserAgentStatsTokenTransferDailyCounts.user_agent_id == agent_id,
+        UserAgentStatsTokenTransferDailyCounts.day >= start_day
+    )
 
-        token_stats = session.exec(token_statement).all()
+    token_stats = (await session.exec(token_statement)).all()
 
     response = StatsTokenTransfersResponse()
 
@@ -111,16 +115,15 @@ class StatsUserPaymentResponse(SQLModel):
     creator_amounts: List[int] = []
 
 @router.get("/{agent_id}/user-payments", response_model=Optional[StatsUserPaymentResponse])
-def get_user_payments_by_agent_id(agent_id, _: Annotated[bool, Depends(validate_user_agent)]):
+async def get_user_payments_by_agent_id(agent_id, _: Annotated[bool, Depends(validate_user_agent)], session: Annotated[AsyncSession, Depends(get_async_session)]):
     start_day = get_day_as_timestamp() - days_to_fetch * 86400
 
-    with Session(engine) as session:
-        token_statement = select(UserAgentStatsPaymentDailyCounts).where(
-            UserAgentStatsPaymentDailyCounts.user_agent_id == agent_id,
-            UserAgentStatsPaymentDailyCounts.day >= start_day
-        )
+    token_statement = select(UserAgentStatsPaymentDailyCounts).where(
+        UserAgentStatsPaymentDailyCounts.user_agent_id == agent_id,
+        UserAgentStatsPaymentDailyCounts.day >= start_day
+    )
 
-        token_stats = session.exec(token_statement).all()
+    token_stats = (await session.exec(token_statement)).all()
 
     response = StatsUserPaymentResponse()
 
@@ -154,16 +157,15 @@ class StatsUserStakingResponse(SQLModel):
 
 
 @router.get("/{agent_id}/user-staking", response_model=Optional[StatsUserStakingResponse])
-def get_user_staking_by_agent_id(agent_id, _: Annotated[bool, Depends(validate_user_agent)]):
+async def get_user_staking_by_agent_id(agent_id, _: Annotated[bool, Depends(validate_user_agent)], session: Annotated[AsyncSession, Depends(get_async_session)]):
     start_day = get_day_as_timestamp() - days_to_fetch * 86400
 
-    with Session(engine) as session:
-        token_statement = select(UserAgentStatsStakingDailyCounts).where(
-            UserAgentStatsStakingDailyCounts.user_agent_id == agent_id,
-            UserAgentStatsStakingDailyCounts.day >= start_day
-        )
+    token_statement = select(UserAgentStatsStakingDailyCounts).where(
+        UserAgentStatsStakingDailyCounts.user_agent_id == agent_id,
+        UserAgentStatsStakingDailyCounts.day >= start_day
+    )
 
-        token_stats = session.exec(token_statement).all()
+    token_stats = (await session.exec(token_statement)).all()
 
     response = StatsUserStakingResponse()
 
@@ -185,3 +187,141 @@ def get_user_staking_by_agent_id(agent_id, _: Annotated[bool, Depends(validate_u
         response.out_amounts.append(stats_dict[day]['out_amounts'])
 
     return response
+
+
+class StatsDashboardResponse(SQLModel):
+    bucket_days: int = 1
+    invocations: StatsInvocationsResponse
+    token_transfers: StatsTokenTransfersResponse
+    user_payments: StatsUserPaymentResponse
+    user_staking: StatsUserStakingResponse
+
+
+def dashboard_statement(agent_id, start_day: int):
+    # All the daily series in one query
+    # series, day, tool, value columns
+
+    def series_statement(series: str, model, tool, *values):
+        values = list(values) + [literal(0)] * (3 - len(values))
+        return select(
+            literal(series).label("series"),
+            model.day,
+            tool.label("tool"),
+            values[0].label("value_0"),
+            values[1].label("value_1"),
+            values[2].label("value_2")
+        ).where(
+            model.user_agent_id == agent_id,
+            model.day >= start_day
+        )
+
+    return union_all(
+        series_statement(
+            "invocations",
+            UserAgentStatsInvocationDailyCounts,
+            UserAgentStatsInvocationDailyCounts.tool,
+            UserAgentStatsInvocationDailyCounts.invocations
+        ),
+        series_statement(
+            "users",
+            UserAgentStatsUserDailyCounts,
+            literal(""),
+            UserAgentStatsUserDailyCounts.users
+        ),
+        series_statement(
+            "token_transfers",
+            UserAgentStatsTokenTransferDailyCounts,
+            literal(""),
+            UserAgentStatsTokenTransferDailyCounts.transactions,
+            UserAgentStatsTokenTransferDailyCounts.amount
+        ),
+        series_statement(
+            "user_payments",
+            UserAgentStatsPaymentDailyCounts,
+            literal(""),
+            UserAgentStatsPaymentDailyCounts.transactions,
+            UserAgentStatsPaymentDailyCounts.pool_amount,
+            UserAgentStatsPaymentDailyCounts.creator_amount
+        ),
+        series_statement(
+            "user_staking",
+            UserAgentStatsStakingDailyCounts,
+            literal(""),
+            UserAgentStatsStakingDailyCounts.in_amount,
+            UserAgentStatsStakingDailyCounts.out_amount
+        )
+    )
+
+
+def downsample(values: List[int], bucket_days: int) -> List[int]:
+    # Sum the daily values of each bucket
+    return [sum(values[i:i + bucket_days]) for i in range(0, len(values), bucket_days)]
+
+
+@router.get("/{agent_id}/dashboard", response_model=Optional[StatsDashboardResponse])
+async def get_dashboard_by_agent_id(
+    agent_id,
+    _: Annotated[bool, Depends(validate_user_agent)],
+    session: Annotated[AsyncSession, Depends(get_async_session)],
+    days: Annotated[int, Query(ge=1, le=settings.agent_stats_max_days)] = days_to_fetch
+):
+    cached_dashboard = await asyncio.to_thread(get_cached_stats_dashboard, agent_id, days)
+    if cached_dashboard is not None:
+        return StatsDashboardResponse.model_validate_json(cached_dashboard)
+
+    start_day = get_day_as_timestamp() - days * 86400
+
+    stats = (await session.exec(dashboard_statement(agent_id, start_day))).all()
+
+    all_days = list(range(start_day, start_day + (days + 1) * 86400, 86400))
+    day_indexes = {day: index for index, day in enumerate(all_days)}
+
+    fields = {
+        "invocations": ["llm", "sd", "token_transfer", "users"],
+        "token_transfers": ["transactions", "amounts"],
+        "user_payments": ["transactions", "pool_amounts", "creator_amounts"],
+        "user_staking": ["in_amounts", "out_amounts"]
+    }
+
+    series: Dict[str, Dict[str, List[int]]] = {
+        name: {field: [0] * len(all_days) for field in series_fields} for name, series_fields in fields.items()
+    }
+
+    for series_name, day, tool, value_0, value_1, value_2 in stats:
+        index = day_indexes.get(day)
+        if index is None:
+            continue
+
+        if series_name == "invocations":
+            field = tool.lower()
+            if field in series["invocations"]:
+                series["invocations"][field][index] = value_0
+        elif series_name == "users":
+            series["invocations"]["users"][index] = value_0
+        else:
+            for field, value in zip(fields[series_name], [value_0, value_1, value_2]):
+                series[series_name][field][index] = value
+
+    # Sum the days into buckets for the long ranges
+    # Users are summed as user-days
+    bucket_days = math.ceil(len(all_days) / settings.agent_stats_max_points)
+
+    response = StatsDashboardResponse(
+        bucket_days=bucket_days,
+        invocations=StatsInvocationsResponse(),
+        token_transfers=StatsTokenTransfersResponse(),
+        user_payments=StatsUserPaymentResponse(),
+        user_staking=StatsUserStakingResponse()
+    )
+
+    bucket_start_days = all_days[::bucket_days]
+
+    for name, series_fields in series.items():
+        series_response = getattr(response, name)
+        series_response.days = bucket_start_days
+        for field, values in series_fields.items():
+            setattr(series_response, field, downsample(values, bucket_days))
+
+    await asyncio.to_thread(cache_stats_dashboard, agent_id, days, response.model_dump_json())
+
+    return response
@@ -1,24 +1,31 @@
-from fastapi import APIRouter, Query
-from typing import List, Annotated, Literal
-from awe.db import engine
-from sqlmodel import Session, select
+from fastapi import APIRouter, Query, Request, Response
+from typing import List, Annotated, Literal, Optional
+from awe.db import async_session_maker
+from sqlmodel import select
 from awe.models import UserAgent
 from sqlalchemy import func
 from sqlalchemy.orm import load_only, joinedload
 from pydantic import BaseModel
+from awe.settings import settings
+from awe.api.limiter import limiter
+from awe.agent_manager.agent_leaderboard import get_leaderboard_page, get_discover_page, page_size
+import logging
+import traceback
+import asyncio
+
+logger = logging.getLogger("[Agents API]")
 
 
 router = APIRouter(
     prefix="/v1/agents"
 )
 
-page_size = 20
-
 class AgentListItem(BaseModel):
     id: int
     name: str
     tg_username: str
     description: str
+    pfp_hash: Optional[str] = None
 
     pool: int
     staking: int
@@ -28,14 +35,44 @@ class AgentListItem(BaseModel):
 
 
 @router.get("", response_model=List[AgentListItem])
-def get_agent_list(
+@limiter.limit(settings.api_public_rate_limit)
+async def get_agent_list(
+    request: Request,
+    response: Response,
     list: Literal["leaderboard", "discover"] = "leaderboard",
     page: Annotated[int, Query(ge=0)] = 0
 ):
     if page < 0:
         page = 0
 
-    with Session(engine) as session:
+    cache_control = f"public, max-age={settings.agent_list_max_age}"
+
+    try:
+        if list == "leaderboard":
+            items, version = await asyncio.to_thread(get_leaderboard_page, page)
+
+            etag = f'W/"leaderboard-{version}-{page}"'
+            if request.headers.get("if-none-match") == etag:
+                return Response(status_code=304, headers={"ETag": etag, "Cache-Control": cache_control})
+
+            response.headers["ETag"] = etag
+        else:
+            items = await asyncio.to_thread(get_discover_page)
+
+        response.headers["Cache-Control"] = cache_control
+
+        return [AgentListItem(**item) for item in items]
+
+    except Exception as e:
+        # Redis not available, fall back to the DB
+        logger.error(e)
+        logger.error(traceback.format_exc())
+
+    return await get_agent_list_from_db(list, page)
+
+
+async def get_agent_list_from_db(list: str, page: int) -> List[AgentListItem]:
+    async with async_session_maker() as session:
         statement = select(UserAgent)
         if list == "leaderboard":
             statement = statement.order_by(UserAgent.score.desc()).offset(page * page_size)
@@ -48,13 +85,14 @@ def get_agent_list(
                 UserAgent.id,
                 UserAgent.name,
                 UserAgent.score,
-                UserAgent.tg_bot
+                UserAgent.tg_bot,
+                UserAgent.pfp_hash
             )
         ).where(
             UserAgent.enabled == True
         ).limit(page_size)
 
-        user_agents = session.exec(statement).all()
+        user_agents = (await session.exec(statement)).all()
 
         agent_list_items = [
             AgentListItem(
@@ -63,6 +101,7 @@ def get_agent_list(
                 score=user_agent.score,
                 tg_username=user_agent.tg_bot.username,
                 description=user_agent.tg_bot.start_message,
+                pfp_hash=user_agent.pfp_hash,
                 invocations=user_agent.agent_data.total_invocations,
                 pool=user_agent.agent_data.awe_token_quote,
                 staking=user_agent.agent_data.awe_token_staking
@@ -1,14 +1,18 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Request
 from awe.blockchain import awe_on_chain
+from awe.settings import settings
+from awe.api.limiter import limiter
 
 router = APIRouter(
     prefix="/v1/awe"
 )
 
 @router.get("/total-supply")
-def awe_total_supply():
+@limiter.limit(settings.api_public_rate_limit)
+def awe_total_supply(request: Request):
     return 1000000000.0
 
 @router.get("/circulating-supply")
-def awe_circulating_supply():
+@limiter.limit(settings.api_public_rate_limit)
+def awe_circulating_supply(request: Request):
     return awe_on_chain.get_awe_circulating_supply()
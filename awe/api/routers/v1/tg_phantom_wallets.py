@@ -2,12 +2,13 @@ from typing import Annotated
 from fastapi import APIRouter, Query, BackgroundTasks
 from fastapi.responses import HTMLResponse
 
-from awe.blockchain.phantom import decrypt_phantom_data, verify_comm_signature, verify_solana_signature
+from awe.blockchain.phantom import decrypt_phantom_data, verify_comm_signature, verify_solana_signature, comm_signature_max_age
 from sqlmodel import Session, select
 from sqlalchemy.orm import load_only
 from awe.db import engine
-from awe.models.tg_phantom_used_nonce import TGPhantomUsedNonce
 from awe.models.tg_bot_user_wallet import TGBotUserWallet
+from awe.models.tg_phantom_used_nonce import TGPhantomUsedNonce
+from sqlalchemy.exc import IntegrityError
 
 from awe.blockchain.phantom import get_wallet_verification_url
 from awe.models.user_agent import UserAgent
@@ -27,6 +28,9 @@ router = APIRouter(
     prefix="/v1/tg-phantom-wallets"
 )
 
+# Used nonces of the signed Phantom callbacks, expiring once the signature is too old to replay
+phantom_nonce_key_prefix = "AWE_PHANTOM_USED_NONCE_"
+
 notify_html_template = """
 <!DOCTYPE html>
 <html>
@@ -115,7 +119,7 @@ def handle_phantom_connect_callback(
     if err_msg is not None:
         return {"errorMessage": err_msg}
 
-    if not check_nonce(nonce):
+    if not check_nonce(nonce, comm_signature_max_age):
         return {"errorMessage": "Nonce is already used"}
 
     # Decrypt the data
@@ -183,7 +187,7 @@ def handle_phantom_verify_callback(
     if err_msg is not None:
         return {"errorMessage": err_msg}
 
-    if not check_nonce(nonce):
+    if not check_nonce(nonce, comm_signature_max_age):
         return {"errorMessage": "Nonce is already used"}
 
     payload = decrypt_payload(agent_id, tg_user_id, nonce, data)
@@ -242,7 +246,8 @@ def handle_phantom_approve_callback(
     if error_code is not None:
         return {"errorCode": error_code, "errorMessage": error_message}
 
-    if not check_nonce(nonce):
+    # Not time-bounded by a signature, the nonce is kept forever
+    if not check_approve_nonce(nonce):
         return {"errorMessage": "Nonce is already used"}
 
     payload = decrypt_payload(agent_id, tg_user_id, nonce, data)
@@ -269,22 +274,27 @@ def handle_phantom_approve_callback(
     return HTMLResponse(html)
 
 
-def check_nonce(nonce: str | None) -> bool:
-    # Check if nonce is already used
-    # Race condition here
-    # Not a big problem since there is only one person having the private key so concurrent requests are rare.
+def check_nonce(nonce: str | None, ttl: int) -> bool:
+    # Mark the nonce as used, return False if it is already used
+    # Kept until the callback can not be replayed anymore
+    if nonce is None or nonce == "":
+        return False
+
+    return bool(cache.set(f"{phantom_nonce_key_prefix}{nonce}", 1, nx=True, ex=ttl))
+
+def check_approve_nonce(nonce: str | None) -> bool:
+    # Mark the nonce as used in DB, return False if it is already used
+    # The unique constraint rejects the concurrent requests with the same nonce
     if nonce is None or nonce == "":
         return False
 
     with Session(engine) as session:
-        statement = select(TGPhantomUsedNonce).where(TGPhantomUsedNonce.nonce == nonce)
-        used_nonce = session.exec(statement).first()
-        if used_nonce is not None:
-            return False
+        session.add(TGPhantomUsedNonce(nonce=nonce))
 
-        used_nonce = TGPhantomUsedNonce(nonce=nonce)
-        session.add(used_nonce)
-        session.commit()
+        try:
+            session.commit()
+        except IntegrityError:
+            return False
 
         return True
 
@@ -1,12 +1,13 @@
 from typing import Annotated, Optional
-from fastapi import APIRouter, Depends, HTTPException, UploadFile, BackgroundTasks, Query
+from fastapi import APIRouter, Depends, HTTPException, UploadFile, BackgroundTasks, Query, Request
 from awe.models.user_agent import UserAgent
 from awe.models.user_agent_data import UserAgentData
 from awe.models.tg_bot import TGBot
 from awe.models.awe_agent import AweAgent, LLMConfig
-from awe.db import engine
+from awe.db import engine, get_async_session
 from sqlmodel import Session, select, func, col, SQLModel
-from ...dependencies import get_current_user, validate_user_agent
+from sqlmodel.ext.asyncio.session import AsyncSession
+from ...dependencies import get_current_user, validate_user_agent, invalidate_user_agent_ownership
 from awe.blockchain import awe_on_chain
 from sqlalchemy.orm import load_only, joinedload
 from sd_task.task_args.inference_task.task_args import InferenceTaskArgs
@@ -17,6 +18,9 @@ import logging
 import re
 from awe.maintenance import is_in_maintenance_sync
 from awe.agent_manager.agent_fund import collect_game_pool_charge, refund_agent_staking, withdraw_to_creator, collect_agent_creation_staking
+from awe.agent_manager.agent_leaderboard import mark_agent_dirty
+from awe.api.limiter import limiter
+from awe.api.pfp import save_pfp
 import traceback
 
 
@@ -33,32 +37,33 @@ class AgentListResponse(SQLModel):
     id: int
     name: str
     enabled: bool
+    pfp_hash: Optional[str]
     tg_bot: Optional[AgentListTGBot]
     agent_data: Optional[UserAgentData]
 
 
-def get_local_user_agents(user_address: str) -> list[AgentListResponse]:
-    with Session(engine) as session:
-        statement = select(
-            UserAgent
-        ).options(
-            joinedload(UserAgent.agent_data),
-            load_only(
-                UserAgent.id,
-                UserAgent.name,
-                UserAgent.enabled,
-                UserAgent.tg_bot
-            )
-        ).where(
-            UserAgent.user_address == user_address,
-            UserAgent.deleted_at.is_(None)
-        ).order_by(
-            UserAgent.created_at.desc()
+async def get_local_user_agents(user_address: str, session: AsyncSession) -> list[AgentListResponse]:
+    statement = select(
+        UserAgent
+    ).options(
+        joinedload(UserAgent.agent_data),
+        load_only(
+            UserAgent.id,
+            UserAgent.name,
+            UserAgent.enabled,
+            UserAgent.pfp_hash,
+            UserAgent.tg_bot
         )
+    ).where(
+        UserAgent.user_address == user_address,
+        UserAgent.deleted_at.is_(None)
+    ).order_by(
+        UserAgent.created_at.desc()
+    )
 
-        user_agents = session.exec(statement).all()
+    user_agents = (await session.exec(statement)).all()
 
-        return user_agents
+    return user_agents
 
 
 @router.put("/{agent_id}", response_model=Optional[UserAgent])
@@ -162,28 +167,30 @@ def update_user_agent(agent_id, user_agent: UserAgent, user_address: Annotated[s
         session.commit()
         session.refresh(user_agent_in_db)
 
+    mark_agent_dirty(user_agent_in_db.id)
+
     return user_agent_in_db
 
 
 @router.get("/{agent_id}", response_model=Optional[UserAgent])
-def get_user_agent_by_id(agent_id, user_address: Annotated[str, Depends(get_current_user)]):
-    with Session(engine) as session:
-        statement = select(UserAgent).where(
-            UserAgent.id == agent_id,
-            UserAgent.user_address == user_address,
-            UserAgent.deleted_at.is_(None)
-        )
-        user_agent = session.exec(statement).first()
-        return user_agent
+async def get_user_agent_by_id(agent_id, user_address: Annotated[str, Depends(get_current_user)], session: Annotated[AsyncSession, Depends(get_async_session)]):
+    statement = select(UserAgent).where(
+        UserAgent.id == agent_id,
+        UserAgent.user_address == user_address,
+        UserAgent.deleted_at.is_(None)
+    )
+    user_agent = (await session.exec(statement)).first()
+    return user_agent
 
 
 @router.get("", response_model=list[AgentListResponse])
-def get_user_agents(user_address: Annotated[str, Depends(get_current_user)]):
-    return get_local_user_agents(user_address)
+async def get_user_agents(user_address: Annotated[str, Depends(get_current_user)], session: Annotated[AsyncSession, Depends(get_async_session)]):
+    return await get_local_user_agents(user_address, session)
 
 
 @router.post("")
-def create_user_agent(tx: str, background_tasks: BackgroundTasks, user_address: Annotated[str, Depends(get_current_user)]):
+@limiter.limit(settings.api_write_rate_limit)
+def create_user_agent(request: Request, tx: str, background_tasks: BackgroundTasks, user_address: Annotated[str, Depends(get_current_user)]):
     if is_in_maintenance_sync():
         raise HTTPException(500, "System in maintenance. Please try again later.")
 
@@ -199,27 +206,26 @@ def wrap_collect_agent_creation_staking(creator_address: str, approve_tx: str):
 
 
 @router.get("/{agent_id}/data", response_model=Optional[UserAgentData])
-def get_user_agent_data(agent_id, user_address: Annotated[str, Depends(get_current_user)]):
+async def get_user_agent_data(agent_id, user_address: Annotated[str, Depends(get_current_user)], session: Annotated[AsyncSession, Depends(get_async_session)]):
 
     agent_id = int(agent_id)
 
-    with Session(engine) as session:
-        statement = select(func.count(col(UserAgent.id))).where(
-            UserAgent.id == agent_id,
-            UserAgent.user_address == user_address,
-            UserAgent.deleted_at.is_(None)
-        )
-        num_agents_in_db = session.exec(statement).one()
-        if num_agents_in_db == 0:
-            return None
+    statement = select(func.count(col(UserAgent.id))).where(
+        UserAgent.id == agent_id,
+        UserAgent.user_address == user_address,
+        UserAgent.deleted_at.is_(None)
+    )
+    num_agents_in_db = (await session.exec(statement)).one()
+    if num_agents_in_db == 0:
+        return None
 
-        statement = select(UserAgentData).where(UserAgentData.user_agent_id == agent_id)
-        agent_data = session.exec(statement).first()
+    statement = select(UserAgentData).where(UserAgentData.user_agent_id == agent_id)
+    agent_data = (await session.exec(statement)).first()
 
-        if agent_data is None:
-            agent_data = UserAgentData(user_agent_id=agent_id)
+    if agent_data is None:
+        agent_data = UserAgentData(user_agent_id=agent_id)
 
-        return agent_data
+    return agent_data
 
 
 @router.delete("/{agent_id}")
@@ -250,6 +256,9 @@ def delete_user_agent(agent_id, background_tasks: BackgroundTasks, user_address:
         session.commit()
         session.refresh(user_agent)
 
+        mark_agent_dirty(user_agent.id)
+        invalidate_user_agent_ownership(user_address, agent_id)
+
         #TODO: Rlease all the player stakings on the Memegent
 
         background_tasks.add_task(wrap_refund_agent_staking, user_agent.id, user_agent.user_address, user_agent.staking_amount)
@@ -264,7 +273,8 @@ def wrap_refund_agent_staking(agent_id, creator_address, amount):
 
 
 @router.post("/{agent_id}/round", response_model=UserAgentData)
-def start_new_round(agent_id, user_address: Annotated[str, Depends(get_current_user)]):
+@limiter.limit(settings.api_write_rate_limit)
+def start_new_round(request: Request, agent_id, user_address: Annotated[str, Depends(get_current_user)]):
     with Session(engine) as session:
         statement = select(func.count(col(UserAgent.id))).where(
             UserAgent.id == agent_id,
@@ -290,29 +300,31 @@ def start_new_round(agent_id, user_address: Annotated[str, Depends(get_current_u
 
 
 @router.post("/{agent_id}/pfp")
-def upload_pfp(agent_id, file: UploadFile, _: Annotated[bool, Depends(validate_user_agent)]):
+@limiter.limit(settings.api_write_rate_limit)
+def upload_pfp(request: Request, agent_id: int, file: UploadFile, _: Annotated[bool, Depends(validate_user_agent)]):
 
     try:
         img = Image.open(file.file)
+        img.load()
     except:
         raise HTTPException(status_code=401, detail="Invalid image uploaded!")
 
-    keep_size = 256
-    width, height = img.size
-    new_edge_length = min(width, height)
+    pfp_hash = save_pfp(agent_id, img)
+
+    with Session(engine) as session:
+        user_agent = session.get(UserAgent, agent_id)
+        user_agent.pfp_hash = pfp_hash
+        session.add(user_agent)
+        session.commit()
 
-    left = (width - new_edge_length) / 2
-    top = (height - new_edge_length) / 2
-    right = (width + new_edge_length) / 2
-    bottom = (height + new_edge_length) / 2
+    mark_agent_dirty(agent_id)
 
-    img_cropped = img.crop((left, top, right, bottom))
-    img_resized = img_cropped.resize((keep_size, keep_size), Image.Resampling.LANCZOS)
-    img_resized.save(f"persisted_data/pfps/{agent_id}.png", "PNG")
+    return {"pfp_hash": pfp_hash}
 
 
 @router.post("/{agent_id}/game-pool")
-def charge_game_pool(agent_id: int, amount: Annotated[int, Query(ge=settings.min_game_pool_charge_amount)], tx: str, background_tasks: BackgroundTasks, user_address: Annotated[str, Depends(get_current_user)]):
+@limiter.limit(settings.api_write_rate_limit)
+def charge_game_pool(request: Request, agent_id: int, amount: Annotated[int, Query(ge=settings.min_game_pool_charge_amount)], tx: str, background_tasks: BackgroundTasks, user_address: Annotated[str, Depends(get_current_user)]):
     if is_in_maintenance_sync():
         raise HTTPException(500, "System in maintenance. Please try again later")
 
@@ -338,7 +350,8 @@ def wrap_collect_game_pool_charge(agent_id, user_address, amount, tx):
 
 
 @router.post("/{agent_id}/account")
-def withdraw_agent_account(agent_id: int, amount: Annotated[int, Query(ge=settings.min_creator_withdraw_amount)], background_tasks: BackgroundTasks, user_address: Annotated[str, Depends(get_current_user)]):
+@limiter.limit(settings.api_write_rate_limit)
+def withdraw_agent_account(request: Request, agent_id: int, amount: Annotated[int, Query(ge=settings.min_creator_withdraw_amount)], background_tasks: BackgroundTasks, user_address: Annotated[str, Depends(get_current_user)]):
     if is_in_maintenance_sync():
         raise HTTPException(500, "System in maintenance. Please try again later")
 
@@ -1,5 +1,5 @@
 import logging
-from fastapi import APIRouter, HTTPException, status, BackgroundTasks
+from fastapi import APIRouter, HTTPException, status, BackgroundTasks, Request
 from awe.blockchain.phantom import verify_comm_signature, verify_solana_signature
 from solders.pubkey import Pubkey
 from sqlmodel import Session, select
@@ -7,6 +7,8 @@ from awe.db import engine
 from awe.models import TGBotUserWallet
 from awe.agent_manager.agent_fund import collect_user_fund
 from awe.cache import cache
+from awe.settings import settings
+from awe.api.limiter import limiter
 import json
 
 logger = logging.getLogger("[Wallet API]")
@@ -16,7 +18,8 @@ router = APIRouter(
 )
 
 @router.post("/bind/{agent_id}/{tg_user_id}")
-def handle_bind_wallet(agent_id: int, tg_user_id: str, wallet_address: str, timestamp: int, wallet_signature: str, comm_signature: str):
+@limiter.limit(settings.api_write_rate_limit)
+def handle_bind_wallet(request: Request, agent_id: int, tg_user_id: str, wallet_address: str, timestamp: int, wallet_signature: str, comm_signature: str):
 
     # Verify comm signature to make sure the request is indeed from the tg_user_id in TG
     err_msg = verify_comm_signature(f"{agent_id}{tg_user_id}{timestamp}", timestamp, comm_signature)
@@ -66,7 +69,8 @@ def handle_bind_wallet(agent_id: int, tg_user_id: str, wallet_address: str, time
 
 
 @router.post("/approve/{agent_id}/{tg_user_id}")
-def handle_approve(agent_id: int, tg_user_id: str, action: str, amount: int, signature: str, background_tasks: BackgroundTasks):
+@limiter.limit(settings.api_write_rate_limit)
+def handle_approve(request: Request, agent_id: int, tg_user_id: str, action: str, amount: int, signature: str, background_tasks: BackgroundTasks):
 
     # Process the payment in the background
     background_tasks.add_task(collect_user_fund, action, amount, agent_id, tg_user_id, signature)
@@ -12,7 +12,8 @@ from threading import Lock
 from awe.db import engine
 from sqlmodel import Session, select
 from sqlalchemy.orm import joinedload
-from awe.agent_manager.agent_stats import record_user_reward
+from awe.agent_manager.agent_stats import record_user_reward, invalidate_stats_dashboard
+from awe.agent_manager.agent_leaderboard import mark_agent_dirty
 
 
 logger = logging.getLogger("[Awe Transfer Tool]")
@@ -108,6 +109,9 @@ class AweTransferTool(AweTokenTool):
 
                 logger.info(f"[Agent {self.user_agent_id}] DB Tx commited!")
 
+                mark_agent_dirty(self.user_agent_id)
+                invalidate_stats_dashboard(self.user_agent_id)
+
                 return f"$AWE {amount}.00 has been successfully transferred to your Awe! account."
 
 
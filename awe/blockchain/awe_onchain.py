@@ -9,7 +9,10 @@ class AweOnChain(ABC):
 # The general interfaces Awe needs to interact with a Blockchain
 
     @abstractmethod
-    def collect_agent_creation_staking(self, creation_id: int, address: str, amount: int) -> Tuple[str, int]:
+    def collect_agent_creation_staking(self, creation_id: int, address: str, amount: int, write_back: bool = False) -> Optional[Tuple[str, int]]:
+        # Transfer the creation staking from the creator wallet to the system wallet
+        # Return the transaction hash and the last valid block height
+        # If write_back is set, the tx is recorded by the task and None is returned without waiting
         pass
 
     @abstractmethod
@@ -19,15 +22,18 @@ class AweOnChain(ABC):
         pass
 
     @abstractmethod
-    def transfer_to_user(self, request_id: str, dest_owner_address: str, amount: int) -> Tuple[str, int]:
+    def transfer_to_user(self, request_id: str, dest_owner_address: str, amount: int, write_back: bool = False) -> Optional[Tuple[str, int]]:
         # Transfer AWE from the system account to the given wallet address
-        # Return the tx address
+        # Return the tx address and the last valid block height
+        # If write_back is set, the tx is recorded by the task and None is returned without waiting
         pass
 
     @abstractmethod
-    def batch_transfer_to_users(self, owner_addresses: List[str], amounts: List[int]) -> str:
+    def batch_transfer_to_users(self, request_ids: List[str], owner_addresses: List[str], amounts: List[int]) -> List[Tuple[Optional[str], int, List[str]]]:
         # Transfer AWE from the system account to the list of given wallet address
-        # Return the tx address
+        # The transfers are packed into as few txs as possible
+        # Return the tx address, last valid block height and request ids of each tx
+        # The tx address is None if the tx failed to be sent
         pass
 
     @abstractmethod
@@ -52,21 +58,24 @@ class AweOnChain(ABC):
         pass
 
     @abstractmethod
-    def collect_user_deposit(self, user_deposit_id: int, user_wallet: str, amount: int) -> Tuple[str, int]:
+    def collect_user_deposit(self, user_deposit_id: int, user_wallet: str, amount: int, write_back: bool = False) -> Optional[Tuple[str, int]]:
         # Transfer tokens from the user wallet to the system wallet
         # Return the transaction hash and the last valid block height
+        # If write_back is set, the tx is recorded by the task and None is returned without waiting
         pass
 
     @abstractmethod
-    def collect_game_pool_charge(self, charge_id: int, agent_creator_wallet: str, amount: int) -> Tuple[str, int]:
+    def collect_game_pool_charge(self, charge_id: int, agent_creator_wallet: str, amount: int, write_back: bool = False) -> Optional[Tuple[str, int]]:
         # Transfer tokens from the agent creator wallet to the system wallet
         # Return the transaction hash and the last valid block height
+        # If write_back is set, the tx is recorded by the task and None is returned without waiting
         pass
 
     @abstractmethod
-    def collect_user_staking(self, user_staking_id:int, user_wallet: str, amount: int) -> Tuple[str, int]:
+    def collect_user_staking(self, user_staking_id:int, user_wallet: str, amount: int, write_back: bool = False) -> Optional[Tuple[str, int]]:
         # Transfer tokens from the user wallet to the system wallet for user staking
         # Return the transaction hash and the last valid block height
+        # If write_back is set, the tx is recorded by the task and None is returned without waiting
         pass
 
     @abstractmethod
@@ -83,11 +92,43 @@ class AweOnChain(ABC):
     def get_block_height(self) -> int:
         pass
 
+    @abstractmethod
+    def get_txs_commitment(self, tx_hashes: List[str]) -> List[Optional[str]]:
+        # Get the commitment level reached by the given txs in one go
+        # "processed", "confirmed" or "finalized"
+        # "failed" if the tx is finalized with error
+        # None if the tx is not found
+        pass
+
+    def get_txs_status(self, tx_hashes: List[str], commitment: Literal["confirmed", "finalized"] = "finalized") -> List[Optional[bool]]:
+        # Check the status of the given txs in one go
+        # True if the tx reached the given commitment successfully
+        # False if the tx failed
+        # None if the tx didn't reach the given commitment yet
+        reached = ["confirmed", "finalized"] if commitment == "confirmed" else ["finalized"]
+
+        results = []
+        for tx_commitment in self.get_txs_commitment(tx_hashes):
+            if tx_commitment == "failed":
+                results.append(False)
+            elif tx_commitment in reached:
+                results.append(True)
+            else:
+                results.append(None)
+
+        return results
+
     @abstractmethod
     def get_awe_circulating_supply(self) -> float:
         # Get circulating supply of $AWE
         pass
 
+    @abstractmethod
+    def add_known_token_account(self, owner_address: str):
+        # Remember that the token account of the given wallet exists
+        # So that later transfers to it can skip creating the account
+        pass
+
     def token_ui_amount(self, amount: int) -> str:
         # Get the UI display for the given token amount
         int_part = int(int(amount) / int(1e9))
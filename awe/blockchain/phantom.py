@@ -101,9 +101,12 @@ def sign_comm_message(data_to_sign: str) -> str:
     return base58.b58encode(signed.signature).decode()
 
 
+# Signed callbacks are accepted for this long after the timestamp (seconds)
+comm_signature_max_age = 180
+
 def verify_comm_signature(data_to_sign: str, timestamp: int, signature: str) -> Optional[str]:
     current_timestamp = unix_timestamp_in_seconds()
-    if current_timestamp - timestamp >= 180:
+    if current_timestamp - timestamp >= comm_signature_max_age:
         return "Timestamp too old"
     sig_bytes = base58.b58decode(signature)
 
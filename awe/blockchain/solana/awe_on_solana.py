@@ -4,6 +4,7 @@ from solders.pubkey import Pubkey
 from solders.rpc.responses import GetTokenAccountBalanceResp
 from solders.message import Message
 from solders.transaction import Transaction
+from solders.transaction_status import TransactionConfirmationStatus
 from solana.rpc.api import Client
 from solana.rpc.commitment import Confirmed, Finalized
 from spl.token.constants import TOKEN_2022_PROGRAM_ID
@@ -12,7 +13,8 @@ import spl.token.instructions as spl_token
 import time
 from awe.settings import settings
 from awe.celery import app
-from typing import List, Tuple
+from .known_token_accounts import add_known_token_account_owner
+from typing import List, Tuple, Optional
 
 class AweOnSolana(AweOnChain):
 
@@ -31,14 +33,18 @@ class AweOnSolana(AweOnChain):
         self.http_client = Client(settings.solana_network_endpoint)
 
 
-    def collect_agent_creation_staking(self, creation_id: int, address: str, amount: int) -> Tuple[str, int]:
+    def collect_agent_creation_staking(self, creation_id: int, address: str, amount: int, write_back: bool = False) -> Optional[Tuple[str, int]]:
         # Transfer tokens from the user wallet to the system account
         # Return the transaction hash and the last valid block height
         task = app.send_task(
             name='awe.blockchain.solana.tasks.collect_user_fund.collect_agent_creation_staking',
-            args=(creation_id, address, amount)
+            args=(creation_id, address, amount, write_back)
         )
         self.logger.info("Sent collect agent creation staking task to the queue")
+
+        if write_back:
+            return None
+
         return task.get()
 
 
@@ -54,23 +60,27 @@ class AweOnSolana(AweOnChain):
         return None
 
 
-    def transfer_to_user(self, request_id: str, dest_owner_address: str, amount: int) -> Tuple[str, int]:
+    def transfer_to_user(self, request_id: str, dest_owner_address: str, amount: int, write_back: bool = False) -> Optional[Tuple[str, int]]:
         # Transfer AWE from the system account to the given wallet address
         # Return the tx address
         task = app.send_task(
             name='awe.blockchain.solana.tasks.transfer_to_user.transfer_to_user',
-            args=(request_id, dest_owner_address, amount)
+            args=(request_id, dest_owner_address, amount, write_back)
         )
         self.logger.info("Sent transfer to user task to the queue")
+
+        if write_back:
+            return None
+
         return task.get()
 
 
-    def batch_transfer_to_users(self, owner_addresses: List[str], amounts: List[int]) -> str:
+    def batch_transfer_to_users(self, request_ids: List[str], owner_addresses: List[str], amounts: List[int]) -> List[Tuple[Optional[str], int, List[str]]]:
         # Transfer AWE from the system account to the list of given wallet address
-        # Return the tx address
+        # Return the tx address, last valid block height and request ids of each tx sent
         task = app.send_task(
             name='awe.blockchain.solana.tasks.transfer_to_user.batch_transfer_to_users',
-            args=(owner_addresses, amounts)
+            args=(request_ids, owner_addresses, amounts)
         )
         self.logger.info("Sent batch transfer to users task to the queue")
         return task.get()
@@ -139,35 +149,47 @@ class AweOnSolana(AweOnChain):
         return bytes(tx)
 
 
-    def collect_user_deposit(self, user_deposit_id: int, user_wallet: str, amount: int) -> Tuple[str, int]:
+    def collect_user_deposit(self, user_deposit_id: int, user_wallet: str, amount: int, write_back: bool = False) -> Optional[Tuple[str, int]]:
         # Transfer tokens from the user wallet to the pool, agent creators and developers
         # Return the transaction hash and the last valid block height
         task = app.send_task(
             name='awe.blockchain.solana.tasks.collect_user_fund.collect_user_fund',
-            args=(user_deposit_id, user_wallet, amount)
+            args=(user_deposit_id, user_wallet, amount, write_back)
         )
         self.logger.info("Sent collect user payment task to the queue")
+
+        if write_back:
+            return None
+
         return task.get()
 
 
-    def collect_game_pool_charge(self,  charge_id: int, agent_creator_wallet: str, amount: int) -> Tuple[str, int]:
+    def collect_game_pool_charge(self,  charge_id: int, agent_creator_wallet: str, amount: int, write_back: bool = False) -> Optional[Tuple[str, int]]:
         task = app.send_task(
             name='awe.blockchain.solana.tasks.collect_user_fund.collect_game_pool_charge',
-            args=(charge_id, agent_creator_wallet, amount)
+            args=(charge_id, agent_creator_wallet, amount, write_back)
         )
 
         self.logger.info("Sent collect game pool charge task to the queue")
+
+        if write_back:
+            return None
+
         return task.get()
 
 
-    def collect_user_staking(self, user_staking_id:int, user_wallet: str, amount: int) -> Tuple[str, int]:
+    def collect_user_staking(self, user_staking_id:int, user_wallet: str, amount: int, write_back: bool = False) -> Optional[Tuple[str, int]]:
         # Transfer tokens from the user wallet to the system wallet
         # Return the transaction hash and the last valid block height
         task = app.send_task(
             name='awe.blockchain.solana.tasks.collect_user_fund.collect_user_staking',
-            args=(user_staking_id, user_wallet, amount)
+            args=(user_staking_id, user_wallet, amount, write_back)
         )
         self.logger.info("Sent collect user staking task to the queue")
+
+        if write_back:
+            return None
+
         return task.get()
 
 
@@ -205,6 +227,33 @@ class AweOnSolana(AweOnChain):
         block_height = self.http_client.get_block_height(commitment=Finalized)
         return block_height.value
 
+    def get_txs_commitment(self, tx_hashes: List[str]) -> List[Optional[str]]:
+        results = []
+
+        # At most 256 signatures per request
+        for i in range(0, len(tx_hashes), 256):
+            sigs = [Signature.from_string(tx_hash) for tx_hash in tx_hashes[i:i+256]]
+            resp = self.http_client.get_signature_statuses(sigs, search_transaction_history=True)
+
+            for status in resp.value:
+                if status is None or status.confirmation_status is None:
+                    results.append(None)
+                elif status.err is not None:
+                    # A failed tx never succeeds later, whatever the commitment
+                    results.append("failed")
+                elif status.confirmation_status == TransactionConfirmationStatus.Finalized:
+                    results.append("finalized")
+                elif status.confirmation_status == TransactionConfirmationStatus.Confirmed:
+                    results.append("confirmed")
+                else:
+                    results.append("processed")
+
+        return results
+
     def get_awe_circulating_supply(self) -> float:
         cir_supply_resp = self.http_client.get_token_supply(self.awe_mint_public_key)
         return cir_supply_resp.value.ui_amount
+
+
+    def add_known_token_account(self, owner_address: str):
+        add_known_token_account_owner(owner_address)
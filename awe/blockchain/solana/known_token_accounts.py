@@ -0,0 +1,33 @@
+from awe.cache import cache
+from typing import List
+import logging
+
+logger = logging.getLogger("[Known Token Accounts]")
+
+# Wallets whose $AWE associated token account is known to exist on chain
+known_token_account_owners_key = "AWE_SOLANA_KNOWN_TOKEN_ACCOUNT_OWNERS"
+
+
+def is_known_token_account_owner(owner_address: str) -> bool:
+    try:
+        return bool(cache.sismember(known_token_account_owners_key, owner_address))
+    except Exception as e:
+        # Fall back to creating the account idempotently
+        logger.error(e)
+        return False
+
+
+def add_known_token_account_owner(owner_address: str):
+    try:
+        cache.sadd(known_token_account_owners_key, owner_address)
+    except Exception as e:
+        logger.error(e)
+
+
+def remove_known_token_account_owners(owner_addresses: List[str]):
+    # The token account might have been closed since
+    # Created idempotently again in the next tx
+    try:
+        cache.srem(known_token_account_owners_key, *owner_addresses)
+    except Exception as e:
+        logger.error(e)
@@ -2,17 +2,17 @@ from ....celery import app
 import logging
 from solders.pubkey import Pubkey
 from solders.transaction import Transaction
-from solana.rpc.types import TxOpts
 from spl.token.constants import TOKEN_2022_PROGRAM_ID
 import spl.token.instructions as spl_token
 from .utils import system_payer, awe_mint_public_key, http_client
+from .tx_requests import send_tx_once
 import traceback
 from typing import Tuple
 
 logger = logging.getLogger("[Collect User Fund Task]")
 
 @app.task
-def collect_user_fund(user_deposit_id: int, user_wallet: str, amount: int) -> Tuple[str, int]:
+def collect_user_fund(user_deposit_id: int, user_wallet: str, amount: int, write_back: bool = False) -> Tuple[str, int]:
 
     logger.info(f"[User Deposit {user_deposit_id}] Collecting user deposit: {user_wallet}: {amount}")
 
@@ -57,21 +57,20 @@ def collect_user_fund(user_deposit_id: int, user_wallet: str, amount: int) -> Tu
     logger.info(f"[User Deposit {user_deposit_id}] Sending tx: {tx.signatures[0]}")
 
     try:
-        send_tx_resp = http_client.send_transaction(tx, TxOpts(skip_confirmation=True))
+        tx_hash, last_valid_block_height = send_tx_once(f"user_deposit_{user_deposit_id}", tx, last_valid_block_height, write_back)
     except Exception as e:
         logger.error(f"[User Deposit {user_deposit_id}] Failed sending the transaction")
         logger.error(e)
         logger.error(traceback.format_exc())
         raise(e)
 
-    tx_hash = str(send_tx_resp.value)
     logger.info(f"[User Deposit {user_deposit_id}] Tx sent! {tx_hash}")
 
     return tx_hash, last_valid_block_height
 
 
 @app.task
-def collect_user_staking(user_staking_id: int, user_wallet: str, amount: int) -> Tuple[str, int]:
+def collect_user_staking(user_staking_id: int, user_wallet: str, amount: int, write_back: bool = False) -> Tuple[str, int]:
     logger.info(f"[Collect User Staking] [{user_staking_id}] Collecting user staking: {user_wallet}: {amount}")
 
     system_payer_associated_token_account = spl_token.get_associated_token_address(
@@ -111,15 +110,15 @@ def collect_user_staking(user_staking_id: int, user_wallet: str, amount: int) ->
 
     logger.info(f"[Collect User Staking] [{user_staking_id}] Ready to send tx {tx.signatures[0]}")
 
-    send_tx_resp = http_client.send_transaction(tx, TxOpts(skip_confirmation=True))
+    tx_hash, last_valid_block_height = send_tx_once(f"user_staking_{user_staking_id}", tx, last_valid_block_height, write_back)
 
     logger.info(f"[Collect User Staking] [{user_staking_id}] Tx sent!")
 
-    return str(send_tx_resp.value), last_valid_block_height
+    return tx_hash, last_valid_block_height
 
 
 @app.task
-def collect_agent_creation_staking(creation_id: int, address: str, amount: int) -> Tuple[str, int]:
+def collect_agent_creation_staking(creation_id: int, address: str, amount: int, write_back: bool = False) -> Tuple[str, int]:
 
     logger.info(f"[Agent Creation Staking] [{creation_id}] Collecting agent creation staking: {address}: {amount}")
 
@@ -160,16 +159,16 @@ def collect_agent_creation_staking(creation_id: int, address: str, amount: int)
 
     logger.info(f"[Agent Creation Staking] [{creation_id}] Sending tx: {tx.signatures[0]}")
 
-    send_tx_resp = http_client.send_transaction(tx, TxOpts(skip_confirmation=True))
+    tx_hash, last_valid_block_height = send_tx_once(f"agent_creation_{creation_id}", tx, last_valid_block_height, write_back)
 
     logger.info(f"[Agent Creation Staking] [{creation_id}] Tx sent!")
 
-    return str(send_tx_resp.value), last_valid_block_height
+    return tx_hash, last_valid_block_height
 
 
 
 @app.task
-def collect_game_pool_charge(charge_id: int, agent_creator_wallet: str, amount: int) -> Tuple[str, int]:
+def collect_game_pool_charge(charge_id: int, agent_creator_wallet: str, amount: int, write_back: bool = False) -> Tuple[str, int]:
     logger.info(f"[Game Pool Charge] [{charge_id}] Collecting game pool charge: {agent_creator_wallet}: {amount}")
 
     system_payer_associated_token_account = spl_token.get_associated_token_address(
@@ -209,8 +208,8 @@ def collect_game_pool_charge(charge_id: int, agent_creator_wallet: str, amount:
 
     logger.info(f"[Game Pool Charge] [{charge_id}] Sending tx: {tx.signatures[0]}")
 
-    send_tx_resp = http_client.send_transaction(tx, TxOpts(skip_confirmation=True))
+    tx_hash, last_valid_block_height = send_tx_once(f"game_pool_charge_{charge_id}", tx, last_valid_block_height, write_back)
 
     logger.info(f"[Game Pool Charge] [{charge_id}] Tx sent!")
 
-    return str(send_tx_resp.value), last_valid_block_height
+    return tx_hash, last_valid_block_height
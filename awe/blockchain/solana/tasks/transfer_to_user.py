@@ -1,23 +1,29 @@
 from ....celery import app
 from solders.pubkey import Pubkey
-from solders.rpc.responses import GetTokenAccountBalanceResp
 from solders.message import Message
+from solders.hash import Hash
 from solders.transaction import Transaction
-from solana.rpc.commitment import Confirmed
 from solana.rpc.types import TxOpts
+from solana.rpc.core import RPCException
 from spl.token.constants import TOKEN_2022_PROGRAM_ID
 import logging
+import traceback
 import spl.token.instructions as spl_token
 from awe.celery import app
-from .utils import token_client, awe_mint_public_key, system_payer, http_client
-from typing import List, Tuple
+from .utils import awe_mint_public_key, system_payer, http_client, create_idempotent_associated_token_account
+from ..known_token_accounts import is_known_token_account_owner, remove_known_token_account_owners
+from .tx_requests import send_tx_once, get_sent_tx, claim_tx_request, finish_tx_request, cancel_tx_request, TxRequestInProgressException
+from typing import List, Tuple, Optional
 
 
 logger = logging.getLogger("[Transfer to User Task]")
 
+# Max size of a serialized tx
+max_tx_size = 1232
+
 
 @app.task
-def transfer_to_user(request_id: str, user_wallet: str, amount: int) -> Tuple[str, int]:
+def transfer_to_user(request_id: str, user_wallet: str, amount: int, write_back: bool = False) -> Tuple[str, int]:
     # Transfer AWE from the system account to the given wallet address
     # Return the tx address and last valid block height
 
@@ -31,40 +37,34 @@ def transfer_to_user(request_id: str, user_wallet: str, amount: int) -> Tuple[st
         TOKEN_2022_PROGRAM_ID
     )
 
-    resp = token_client.get_balance(
-        dest_associated_token_account_pubkey,
-        Confirmed
-    )
-
-    if not isinstance(resp, GetTokenAccountBalanceResp):
-        # Token account not exist
-        # We have to create it for the user
-        # Some SOL will be spent
-
-        logger.info(f"[Request {request_id}] Create token account for the user")
-
-        ix = spl_token.create_associated_token_account(
-            payer=system_payer.pubkey(),
-            owner=dest_owner_pubkey,
-            mint=awe_mint_public_key,
-            token_program_id=TOKEN_2022_PROGRAM_ID
-        )
-
-        recent_blockhash = http_client.get_latest_blockhash().value.blockhash
-        msg = Message.new_with_blockhash([ix], system_payer.pubkey(), recent_blockhash)
-
-        txn = Transaction([system_payer], msg, recent_blockhash)
-        tx_opts = TxOpts(skip_confirmation=False)
-        http_client.send_transaction(txn, opts=tx_opts)
-
-        logger.info(f"[Request {request_id}] User token account created!")
-
     source_associated_token_account_pubkey = spl_token.get_associated_token_address(
         system_payer.pubkey(),
         awe_mint_public_key,
         TOKEN_2022_PROGRAM_ID
     )
 
+    ixs = []
+
+    known_account = is_known_token_account_owner(user_wallet)
+
+    if not known_account:
+        # The token account might not exist
+        # Create it in the same tx, it is a no-op if it already exists
+        logger.info(f"[Request {request_id}] Create token account for the user if not exist")
+        ixs.append(create_idempotent_associated_token_account(dest_owner_pubkey))
+
+    ixs.append(spl_token.transfer_checked(
+        spl_token.TransferCheckedParams(
+            source=source_associated_token_account_pubkey,
+            dest=dest_associated_token_account_pubkey,
+            owner=system_payer.pubkey(),
+            amount=int(amount * 1e9),
+            decimals=9,
+            mint=awe_mint_public_key,
+            program_id=TOKEN_2022_PROGRAM_ID
+        )
+    ))
+
     logger.info(f"[Request {request_id}] Ready to send tx")
 
     latest_blockhash = http_client.get_latest_blockhash().value
@@ -72,25 +72,33 @@ def transfer_to_user(request_id: str, user_wallet: str, amount: int) -> Tuple[st
     recent_blockhash = latest_blockhash.blockhash
     last_valid_block_height = latest_blockhash.last_valid_block_height
 
-    send_tx_resp = token_client.transfer_checked(
-        source=source_associated_token_account_pubkey,
-        dest=dest_associated_token_account_pubkey,
-        owner=system_payer,
-        amount=int(amount * 1e9),
-        decimals=9,
-        recent_blockhash=recent_blockhash
+    tx = Transaction.new_signed_with_payer(
+        ixs,
+        system_payer.pubkey(),
+        [system_payer],
+        recent_blockhash
     )
 
-    logger.info(f"[Request {request_id}] Tx sent {send_tx_resp.value}")
+    try:
+        tx_hash, last_valid_block_height = send_tx_once(request_id, tx, last_valid_block_height, write_back)
+    except RPCException as e:
+        if known_account:
+            remove_known_token_account_owners([user_wallet])
+        raise e
+
+    logger.info(f"[Request {request_id}] Tx sent {tx_hash}")
 
-    return str(send_tx_resp.value), last_valid_block_height
+    return tx_hash, last_valid_block_height
 
 
 @app.task
-def batch_transfer_to_users(user_wallets: List[str], amounts: List[int]):
+def batch_transfer_to_users(request_ids: List[str], user_wallets: List[str], amounts: List[int]) -> List[Tuple[Optional[str], int, List[str]]]:
+    # Pack the transfers into as few txs as possible
+    # Return the tx hash, last valid block height and the request ids of each tx
+    # The tx hash is None if the tx failed to be sent
 
-    if len(user_wallets) != len(amounts):
-        raise Exception("Mismatched addresses and amounts")
+    if len(request_ids) != len(user_wallets) or len(user_wallets) != len(amounts):
+        raise Exception("Mismatched request ids, addresses and amounts")
 
     if len(user_wallets) == 0:
         raise Exception("Empty user addresses given")
@@ -101,12 +109,50 @@ def batch_transfer_to_users(user_wallets: List[str], amounts: List[int]):
         TOKEN_2022_PROGRAM_ID
     )
 
-    ixs = []
+    results = []
+
+    request_addresses = dict(zip(request_ids, user_wallets))
+
+    # Skip the requests already sent
+    sent_txs = {}
+    unsent = []
+
+    for idx, request_id in enumerate(request_ids):
+        try:
+            sent_tx = get_sent_tx(request_id)
+        except TxRequestInProgressException as e:
+            logger.error(e)
+            results.append((None, 0, [request_id]))
+            continue
+
+        if sent_tx is not None:
+            tx_hash, last_valid_block_height = sent_tx
+            sent_txs.setdefault((tx_hash, last_valid_block_height), []).append(request_id)
+            continue
+
+        if not claim_tx_request(request_id):
+            logger.error(f"[{request_id}] The tx of the request is being sent")
+            results.append((None, 0, [request_id]))
+            continue
 
-    for idx, address in enumerate(user_wallets):
+        unsent.append(idx)
+
+    for (tx_hash, last_valid_block_height), sent_request_ids in sent_txs.items():
+        logger.info(f"[Batch Transfer] Tx already sent {tx_hash} for {sent_request_ids}")
+        results.append((tx_hash, last_valid_block_height, sent_request_ids))
+
+    if len(unsent) == 0:
+        return results
+
+    batches = []
+    batch_ixs = []
+    batch_request_ids = []
+    batch_created_accounts = set()
+
+    for idx in unsent:
+        address = user_wallets[idx]
         dest_owner_pubkey = Pubkey.from_string(address)
 
-        # The dest account should have existed since it has paid AWE before
         dest_associated_token_account_pubkey = spl_token.get_associated_token_address(
             dest_owner_pubkey,
             awe_mint_public_key,
@@ -117,21 +163,86 @@ def batch_transfer_to_users(user_wallets: List[str], amounts: List[int]):
             spl_token.TransferCheckedParams(
                 source=source_associated_token_account_pubkey,
                 dest=dest_associated_token_account_pubkey,
-                amount=amounts[idx] * 1e9,
+                amount=int(amounts[idx] * 1e9),
                 mint=awe_mint_public_key,
                 program_id=TOKEN_2022_PROGRAM_ID,
                 decimals=9,
-                owner=system_payer
+                owner=system_payer.pubkey()
             )
         )
 
-        ixs.append(transfer_ix)
+        known_account = is_known_token_account_owner(address)
+
+        if known_account or address in batch_created_accounts:
+            ixs = [transfer_ix]
+        else:
+            ixs = [create_idempotent_associated_token_account(dest_owner_pubkey), transfer_ix]
+
+        # Start a new tx if this transfer doesn't fit in the current one
+        if len(batch_ixs) != 0 and get_tx_size(batch_ixs + ixs) > max_tx_size:
+            batches.append((batch_ixs, batch_request_ids))
+            batch_ixs = []
+            batch_request_ids = []
+            batch_created_accounts = set()
+
+            if not known_account:
+                ixs = [create_idempotent_associated_token_account(dest_owner_pubkey), transfer_ix]
+
+        batch_ixs.extend(ixs)
+        batch_request_ids.append(request_ids[idx])
+        batch_created_accounts.add(address)
+
+    batches.append((batch_ixs, batch_request_ids))
+
+    try:
+        latest_blockhash = http_client.get_latest_blockhash().value
+    except Exception as e:
+        # Nothing is sent yet
+        for idx in unsent:
+            cancel_tx_request(request_ids[idx])
+        raise e
+
+    recent_blockhash = latest_blockhash.blockhash
+    last_valid_block_height = latest_blockhash.last_valid_block_height
+
+    for ixs, batch_request_ids in batches:
+
+        tx = Transaction.new_signed_with_payer(
+            ixs,
+            system_payer.pubkey(),
+            [system_payer],
+            recent_blockhash
+        )
+
+        logger.info(f"[Batch Transfer] Sending tx {tx.signatures[0]} for {len(batch_request_ids)} transfers")
+
+        try:
+            send_tx_resp = http_client.send_transaction(tx, TxOpts(skip_confirmation=True))
+        except Exception as e:
+            logger.error(f"[Batch Transfer] Failed sending the transaction for {batch_request_ids}")
+            logger.error(e)
+            logger.error(traceback.format_exc())
+
+            if isinstance(e, RPCException):
+                # Rejected by the node, safe to send again
+                for request_id in batch_request_ids:
+                    cancel_tx_request(request_id)
+
+                remove_known_token_account_owners([request_addresses[request_id] for request_id in batch_request_ids])
+
+            results.append((None, last_valid_block_height, batch_request_ids))
+            continue
+
+        tx_hash = str(send_tx_resp.value)
+        for request_id in batch_request_ids:
+            finish_tx_request(request_id, tx_hash, last_valid_block_height)
+
+        logger.info(f"[Batch Transfer] Tx sent {tx_hash}")
+        results.append((tx_hash, last_valid_block_height, batch_request_ids))
 
-    recent_blockhash = http_client.get_latest_blockhash().value.blockhash
-    msg = Message.new_with_blockhash(ixs, system_payer.pubkey(), recent_blockhash)
+    return results
 
-    txn = Transaction([system_payer], msg, recent_blockhash)
-    tx_opts = TxOpts(skip_confirmation=False)
 
-    send_tx_resp = http_client.send_transaction(txn, opts=tx_opts)
-    return str(send_tx_resp.value)
+def get_tx_size(ixs: list) -> int:
+    msg = Message.new_with_blockhash(ixs, system_payer.pubkey(), Hash.default())
+    return len(bytes(Transaction.new_unsigned(msg)))
@@ -0,0 +1,85 @@
+from awe.cache import cache
+from solders.transaction import Transaction
+from solana.rpc.core import RPCException
+from solana.rpc.types import TxOpts
+from .utils import http_client
+from typing import Optional, Tuple
+import logging
+import json
+
+logger = logging.getLogger("[Tx Requests]")
+
+# The tx sent for each request id
+# So that a retried request never sends a second tx
+tx_request_key_prefix = "AWE_SOLANA_TX_REQUEST_"
+tx_request_ttl = 7 * 86400
+tx_request_sending = "sending"
+
+
+class TxRequestInProgressException(Exception):
+    pass
+
+
+def get_sent_tx(request_id: str) -> Optional[Tuple[str, int]]:
+    # Return the tx hash and last valid block height already sent for the request
+    value = cache.get(f"{tx_request_key_prefix}{request_id}")
+    if value is None:
+        return None
+
+    if isinstance(value, bytes):
+        value = value.decode()
+
+    if value == tx_request_sending:
+        # Either being sent by another task
+        # or the task died while sending, needs manual check
+        raise TxRequestInProgressException(f"[{request_id}] The tx of the request is being sent")
+
+    tx_hash, last_valid_block_height = json.loads(value)
+    return tx_hash, last_valid_block_height
+
+
+def claim_tx_request(request_id: str) -> bool:
+    return bool(cache.set(f"{tx_request_key_prefix}{request_id}", tx_request_sending, nx=True, ex=tx_request_ttl))
+
+
+def finish_tx_request(request_id: str, tx_hash: str, last_valid_block_height: int):
+    cache.set(f"{tx_request_key_prefix}{request_id}", json.dumps([tx_hash, last_valid_block_height]), ex=tx_request_ttl)
+
+
+def cancel_tx_request(request_id: str):
+    cache.delete(f"{tx_request_key_prefix}{request_id}")
+
+
+def write_back_tx(request_id: str, tx_hash: str, last_valid_block_height: int):
+    # Record the tx in the originating row
+    # Imported here to avoid circular imports
+    from awe.agent_manager.agent_fund import record_transfer_tx
+    record_transfer_tx(request_id, tx_hash, last_valid_block_height, notify_user=True)
+
+
+def send_tx_once(request_id: str, tx: Transaction, last_valid_block_height: int, write_back: bool = False) -> Tuple[str, int]:
+    # Send the tx unless a tx was already sent for the request
+    # Return the tx hash and the last valid block height
+
+    sent_tx = get_sent_tx(request_id)
+
+    if sent_tx is None:
+        if not claim_tx_request(request_id):
+            raise TxRequestInProgressException(f"[{request_id}] The tx of the request is being sent")
+
+        try:
+            send_tx_resp = http_client.send_transaction(tx, TxOpts(skip_confirmation=True))
+        except RPCException as e:
+            # Rejected by the node, safe to send again
+            cancel_tx_request(request_id)
+            raise e
+
+        sent_tx = (str(send_tx_resp.value), last_valid_block_height)
+        finish_tx_request(request_id, sent_tx[0], sent_tx[1])
+    else:
+        logger.info(f"[{request_id}] Tx already sent: {sent_tx[0]}")
+
+    if write_back:
+        write_back_tx(request_id, sent_tx[0], sent_tx[1])
+
+    return sent_tx
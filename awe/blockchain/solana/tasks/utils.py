@@ -1,9 +1,12 @@
 from awe.settings import settings
 from solders.pubkey import Pubkey
 from solders.keypair import Keypair
+from solders.instruction import Instruction, AccountMeta
+from solders.system_program import ID as SYS_PROGRAM_ID
 from solana.rpc.api import Client
 from spl.token.client import Token
-from spl.token.constants import TOKEN_2022_PROGRAM_ID
+from spl.token.constants import TOKEN_2022_PROGRAM_ID, ASSOCIATED_TOKEN_PROGRAM_ID
+import spl.token.instructions as spl_token
 
 awe_mint_public_key = Pubkey.from_string(settings.solana_awe_mint_address)
 system_payer = Keypair.from_base58_string(settings.solana_system_payer_private_key)
@@ -15,3 +18,26 @@ token_client = Token(
     TOKEN_2022_PROGRAM_ID,
     system_payer
 )
+
+
+def create_idempotent_associated_token_account(owner: Pubkey) -> Instruction:
+    # CreateIdempotent of the associated token account program
+    # spl.token only builds it for the legacy token program, so we build it here for token 2022
+    associated_token_address = spl_token.get_associated_token_address(
+        owner,
+        awe_mint_public_key,
+        TOKEN_2022_PROGRAM_ID
+    )
+
+    return Instruction(
+        accounts=[
+            AccountMeta(pubkey=system_payer.pubkey(), is_signer=True, is_writable=True),
+            AccountMeta(pubkey=associated_token_address, is_signer=False, is_writable=True),
+            AccountMeta(pubkey=owner, is_signer=False, is_writable=False),
+            AccountMeta(pubkey=awe_mint_public_key, is_signer=False, is_writable=False),
+            AccountMeta(pubkey=SYS_PROGRAM_ID, is_signer=False, is_writable=False),
+            AccountMeta(pubkey=TOKEN_2022_PROGRAM_ID, is_signer=False, is_writable=False),
+        ],
+        program_id=ASSOCIATED_TOKEN_PROGRAM_ID,
+        data=bytes([1]),
+    )
@@ -1,8 +1,89 @@
 from awe.settings import settings
+from typing import List, Tuple, Optional
 import redis
+import redis.asyncio as async_redis
+import uuid
+
+# Blocking reads of the async client wait up to this long (seconds)
+async_block_timeout = 10
+
+# Sets loaded from the DB are built aside and merged once complete
+# A loader that died leaves its part expiring after this long (seconds)
+loading_set_ttl = 3600
+
+cache_pool = redis.ConnectionPool.from_url(
+    settings.redis_cache,
+    socket_timeout=3,
+    socket_connect_timeout=3,
+    health_check_interval=settings.redis_health_check_interval,
+    max_connections=settings.redis_max_connections
+)
+
+cache = redis.Redis(connection_pool=cache_pool)
+
+# Created in the event loop using it
+async_cache: Optional[async_redis.Redis] = None
 
-cache = redis.from_url(settings.redis_cache, socket_timeout=3, socket_connect_timeout=3)
 
 def init_cache():
-    global cache
-    cache = redis.from_url(settings.redis_cache, socket_timeout=3, socket_connect_timeout=3)
+    # Called after fork
+    # The connections of the parent process are left to it
+    global async_cache
+    cache_pool.reset()
+    async_cache = None
+
+
+def get_async_cache() -> async_redis.Redis:
+    global async_cache
+
+    if async_cache is None:
+        async_cache = async_redis.Redis(connection_pool=async_redis.ConnectionPool.from_url(
+            settings.redis_cache,
+            socket_timeout=async_block_timeout + 3,
+            socket_connect_timeout=3,
+            health_check_interval=settings.redis_health_check_interval,
+            max_connections=settings.redis_max_connections
+        ))
+
+    return async_cache
+
+
+def pipelined_scard(keys: List[str]) -> List[int]:
+    # Sizes of the sets in one round-trip
+    pipeline = cache.pipeline()
+
+    for key in keys:
+        pipeline.scard(key)
+
+    return pipeline.execute()
+
+
+def pipelined_sadd(members: List[Tuple[str, str]]) -> List[bool]:
+    # Add the (key, member) pairs in one round-trip
+    # Return whether each member was added
+    pipeline = cache.pipeline()
+
+    for key, member in members:
+        pipeline.sadd(key, member)
+
+    return [added == 1 for added in pipeline.execute()]
+
+
+def get_loading_set_key(key: str) -> str:
+    # Unique to each loader, concurrent loads never mix
+    return f"{key}_LOADING_{uuid.uuid4().hex}"
+
+
+def add_to_loading_set(load_key: str, members: list):
+    pipeline = cache.pipeline()
+    pipeline.sadd(load_key, *members)
+    pipeline.expire(load_key, loading_set_ttl)
+    pipeline.execute()
+
+
+def merge_loaded_set(key: str, load_key: str):
+    # The set only becomes visible once fully loaded
+    pipeline = cache.pipeline()
+    pipeline.sunionstore(key, [key, load_key])
+    pipeline.delete(load_key)
+    pipeline.execute()
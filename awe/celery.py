@@ -1,6 +1,7 @@
 from awe.settings import settings
 from celery import Celery
-from celery.signals import setup_logging
+from celery.signals import setup_logging, worker_process_init
+from awe.db import init_engine, DBRole
 import logging
 
 app = Celery(
@@ -16,6 +17,9 @@ app = Celery(
         'awe.blockchain.solana.tasks.collect_user_fund.collect_agent_creation_staking': {"queue": "tx_token_in"},
         'awe.blockchain.solana.tasks.transfer_to_user.transfer_to_user': {"queue": "tx_token_out"},
         'awe.blockchain.solana.tasks.transfer_to_user.batch_transfer_to_users': {"queue": "tx_token_out"},
+        'awe.agent_manager.tasks.emission_task.emission_pipeline': {"queue": "emissions"},
+        'awe.agent_manager.tasks.emission_task.in_agent_emissions': {"queue": "emission_agents"},
+        'awe.agent_manager.tasks.emission_task.staking_aggregates': {"queue": "emissions"},
     })
 
 
@@ -28,3 +32,9 @@ def setup_logging(*args, **kwargs):
 
     if settings.log_level != "DEBUG":
         logger.setLevel("WARN")
+
+
+@worker_process_init.connect
+def init_worker_process(*args, **kwargs):
+    # Pool of the worker role in each forked worker process
+    init_engine(DBRole.WORKER)
@@ -1,16 +1,223 @@
 from awe.settings import settings
 from sqlmodel import create_engine
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import Pool, QueuePool, NullPool
+from sqlalchemy import event
+from typing import AsyncGenerator, Dict, Any, Optional
+from threading import Lock
 import logging
+import enum
+import time
 
 if settings.db_log_level == "DEBUG":
     logger = logging.getLogger("sqlalchemy.engine")
     logger.setLevel(settings.db_log_level)
 
+pool_logger = logging.getLogger("[DB Pool]")
+
+
+class DBRole(str, enum.Enum):
+    API = "api"
+    AGENT = "agent"
+    PROCESSOR = "processor"
+    WORKER = "worker"
+
+
+def get_pool_size(role: DBRole) -> int:
+    return getattr(settings, f"db_pool_size_{role.value}")
+
+
+def get_max_overflow(role: DBRole) -> int:
+    return getattr(settings, f"db_max_overflow_{role.value}")
+
+
+def get_pool_args(role: DBRole) -> Dict[str, Any]:
+    if settings.db_null_pool:
+        return {"poolclass": NullPool}
+
+    return {
+        "pool_size": get_pool_size(role),
+        "max_overflow": get_max_overflow(role),
+        "pool_timeout": settings.db_pool_timeout
+    }
+
+
+# Sized for the workers and the tools until init_engine is called with the role of the process
+db_role = DBRole.WORKER
+
 engine = create_engine(
     settings.db_connection_string,
     pool_pre_ping=True,
-    pool_recycle=280
+    pool_recycle=280,
+    **get_pool_args(db_role)
 )
 
-def init_engine():
+# Async drivers of the sync ones
+async_drivers = {
+    "mysql": "mysql+aiomysql",
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg"
+}
+
+def get_async_connection_string() -> str:
+    if settings.async_db_connection_string is not None:
+        return settings.async_db_connection_string
+
+    url = make_url(settings.db_connection_string)
+    return url.set(drivername=async_drivers.get(url.get_backend_name(), url.drivername)).render_as_string(hide_password=False)
+
+# Only used by the API, no connections are opened in the other processes
+async_engine = create_async_engine(
+    get_async_connection_string(),
+    pool_pre_ping=True,
+    pool_recycle=280,
+    **get_pool_args(DBRole.API)
+)
+
+async_session_maker = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
+async def get_async_session() -> AsyncGenerator[AsyncSession, None]:
+    async with async_session_maker() as session:
+        yield session
+
+
+def create_pool(role: DBRole) -> Pool:
+    # Pool.recreate() with the config of the role
+    # The dialect and the pool events are kept
+    pool = engine.pool
+
+    pool_args = {
+        "recycle": pool._recycle,
+        "echo": pool.echo,
+        "logging_name": pool._orig_logging_name,
+        "reset_on_return": pool._reset_on_return,
+        "pre_ping": pool._pre_ping,
+        "_dispatch": pool.dispatch,
+        "dialect": pool._dialect
+    }
+
+    if settings.db_null_pool:
+        return NullPool(pool._creator, **pool_args)
+
+    return QueuePool(
+        pool._creator,
+        pool_size=get_pool_size(role),
+        max_overflow=get_max_overflow(role),
+        timeout=settings.db_pool_timeout,
+        **pool_args
+    )
+
+
+def init_engine(role: DBRole = DBRole.WORKER):
+    # Called after fork
+    # The connections of the parent process are left to it
+    global db_role
+
     engine.dispose(close=False)
+
+    # SQLite in memory keeps its single connection pool
+    if isinstance(engine.pool, (QueuePool, NullPool)):
+        engine.pool = create_pool(role)
+
+    db_role = role
+    reset_pool_metrics()
+
+
+# Pool metrics of this process, all the engines included
+
+pool_metrics_lock = Lock()
+pool_metrics = {}
+
+def reset_pool_metrics():
+    with pool_metrics_lock:
+        pool_metrics.update({
+            "connects": 0,
+            "checkouts": 0,
+            "checked_out": 0,
+            "peak_checked_out": 0,
+            "total_hold_time": 0.0,
+            "max_hold_time": 0.0
+        })
+
+reset_pool_metrics()
+
+
+@event.listens_for(Pool, "connect")
+def on_pool_connect(dbapi_connection, connection_record):
+    with pool_metrics_lock:
+        pool_metrics["connects"] += 1
+
+
+@event.listens_for(Pool, "checkout")
+def on_pool_checkout(dbapi_connection, connection_record, connection_proxy):
+    connection_record.info["checked_out_at"] = time.perf_counter()
+
+    with pool_metrics_lock:
+        pool_metrics["checkouts"] += 1
+        pool_metrics["checked_out"] += 1
+        pool_metrics["peak_checked_out"] = max(pool_metrics["peak_checked_out"], pool_metrics["checked_out"])
+
+
+@event.listens_for(Pool, "checkin")
+def on_pool_checkin(dbapi_connection, connection_record):
+    checked_out_at = connection_record.info.pop("checked_out_at", None)
+    if checked_out_at is None:
+        return
+
+    hold_time = time.perf_counter() - checked_out_at
+
+    with pool_metrics_lock:
+        pool_metrics["checked_out"] -= 1
+        pool_metrics["total_hold_time"] += hold_time
+        pool_metrics["max_hold_time"] = max(pool_metrics["max_hold_time"], hold_time)
+
+
+def get_pool_metrics() -> Dict[str, Any]:
+    with pool_metrics_lock:
+        metrics = dict(pool_metrics)
+
+    checkouts = metrics.pop("checkouts")
+    total_hold_time = metrics.pop("total_hold_time")
+
+    metrics["checkouts"] = checkouts
+    metrics["avg_hold_ms"] = round(total_hold_time / checkouts * 1000, 2) if checkouts != 0 else 0
+    metrics["max_hold_ms"] = round(metrics.pop("max_hold_time") * 1000, 2)
+    metrics["role"] = db_role.value
+    metrics["pool"] = engine.pool.status()
+
+    if db_role == DBRole.API:
+        metrics["async_pool"] = async_engine.pool.status()
+
+    return metrics
+
+
+def get_max_connections(role: DBRole) -> Optional[int]:
+    # None if not bounded by the pool
+    if settings.db_null_pool:
+        return None
+
+    return get_pool_size(role) + get_max_overflow(role)
+
+
+def report_connection_footprint(num_agents: int):
+    # Max connections configured for the processes started by run.py
+    if settings.db_null_pool:
+        pool_logger.info("NullPool mode, the connections are bounded by the DB proxy")
+        return
+
+    num_processors = 2 if settings.solana_batch_transfer_enabled else 1
+
+    # The sync and the async engine of the API
+    api_connections = 2 * get_max_connections(DBRole.API)
+    processor_connections = num_processors * get_max_connections(DBRole.PROCESSOR)
+
+    # The agent processes and the agent manager
+    agent_connections = (num_agents + 1) * get_max_connections(DBRole.AGENT)
+
+    pool_logger.info(f"API: {api_connections} connections")
+    pool_logger.info(f"Processors: {num_processors} x {get_max_connections(DBRole.PROCESSOR)} = {processor_connections} connections")
+    pool_logger.info(f"Agents: {num_agents + 1} x {get_max_connections(DBRole.AGENT)} = {agent_connections} connections")
+    pool_logger.info(f"Total: {api_connections + processor_connections + agent_connections} connections")
+    pool_logger.info(f"Celery workers: {get_max_connections(DBRole.WORKER)} connections per worker process")
@@ -1,11 +1,27 @@
-
-from awe.cache import cache
+from awe.cache import cache, get_async_cache
 import asyncio
 import logging
+import time
 
 logger = logging.getLogger("[Maintenance]")
 
 maintenance_key = "AWE_SYSTEM_MAINTENANCE"
+maintenance_channel = "AWE_SYSTEM_MAINTENANCE_CHANNEL"
+
+# The listener re-reads the key if nothing is published for this long (seconds)
+maintenance_poll_interval = 5
+
+# Read from Redis on the hot path if the listener hasn't refreshed the flag for this long
+maintenance_flag_max_age = 15
+
+# Process-local flag refreshed by the listener
+maintenance_flag = False
+maintenance_flag_refreshed_at = 0.0
+
+def set_maintenance_flag(in_maintenance: bool):
+    global maintenance_flag, maintenance_flag_refreshed_at
+    maintenance_flag = in_maintenance
+    maintenance_flag_refreshed_at = time.monotonic()
 
 def is_in_maintenance_sync() -> bool:
     in_maintenance = cache.get(maintenance_key)
@@ -13,12 +29,46 @@ def is_in_maintenance_sync() -> bool:
     return in_maintenance is not None
 
 async def is_in_maintenance() -> bool:
-    return await asyncio.to_thread(is_in_maintenance_sync)
+    # A memory read while the listener is running
+    if time.monotonic() - maintenance_flag_refreshed_at > maintenance_flag_max_age:
+        set_maintenance_flag(await asyncio.to_thread(is_in_maintenance_sync))
+
+    return maintenance_flag
+
+async def listen_maintenance():
+    # Keep the flag updated from the published changes
+    # Messages are lost while disconnected, so the key is re-read after subscribing and on every poll interval
+    while True:
+        try:
+            async_cache = get_async_cache()
+            pubsub = async_cache.pubsub()
+
+            try:
+                await pubsub.subscribe(maintenance_channel)
+                set_maintenance_flag(await async_cache.get(maintenance_key) is not None)
+
+                while True:
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=maintenance_poll_interval)
+
+                    if message is None:
+                        set_maintenance_flag(await async_cache.get(maintenance_key) is not None)
+                    else:
+                        set_maintenance_flag(message["data"] == b"1")
+            finally:
+                await pubsub.aclose()
+
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(e)
+            await asyncio.sleep(1)
 
 def start_maintenance():
     logger.warning("Entering maintenance mode")
     cache.set(maintenance_key, 1)
+    cache.publish(maintenance_channel, 1)
 
 def stop_maintenance():
     logger.warning("Exiting maintenance mode")
     cache.delete(maintenance_key)
+    cache.publish(maintenance_channel, 0)
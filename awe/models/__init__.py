@@ -28,3 +28,8 @@ from .user_agent_staking import UserAgentStaking
 from .total_cycle_emissions import TotalCycleEmissions
 from .staker_global_weekly_emissions import StakerGlobalWeeklyEmissions
 from .creator_weekly_emissions import CreatorWeeklyEmissions
+from .emission_pipeline_checkpoint import EmissionPipelineCheckpoint
+from .in_agent_emission_progress import InAgentEmissionProgress
+from .user_staking_aggregates import UserStakingAggregates
+from .emission_balance_progress import EmissionBalanceProgress
+from .user_referral_closure import UserReferralClosure
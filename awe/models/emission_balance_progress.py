@@ -0,0 +1,18 @@
+from sqlmodel import SQLModel, Field, UniqueConstraint
+from typing import Annotated, Optional
+from .utils import unix_timestamp_in_seconds
+
+
+# Progress of crediting the emissions of a cycle to the account balances
+# last_key is the last account key credited, the next batch starts after it
+
+class EmissionBalanceProgress(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("day", "source", name="uq_emissionbalanceprogress_day_source"),)
+
+    id: Annotated[int, Field(primary_key=True, default=None)]
+    day: Annotated[int, Field(index=True, nullable=False)]
+    source: Annotated[str, Field(nullable=False)]
+    last_key: Annotated[Optional[str], Field(nullable=True)] = None
+    credited: Annotated[int, Field(nullable=False, default=0)] = 0
+    done: Annotated[bool, Field(nullable=False, default=False)] = False
+    updated_at: Annotated[int, Field(nullable=False, default_factory=unix_timestamp_in_seconds)]
@@ -0,0 +1,30 @@
+from sqlmodel import SQLModel, Field, Session, select
+from typing import Annotated, Optional
+from typing_extensions import Self
+from .utils import unix_timestamp_in_seconds
+from awe.db import engine
+
+
+class EmissionPipelineStageStatus:
+    RUNNING = 1
+    DONE = 2
+    FAILED = 3
+
+
+class EmissionPipelineCheckpoint(SQLModel, table=True):
+    id: Annotated[int, Field(primary_key=True, default=None)]
+    day: Annotated[int, Field(index=True, nullable=False)]
+    stage: Annotated[str, Field(index=True, nullable=False)]
+    status: Annotated[int, Field(nullable=False, default=EmissionPipelineStageStatus.RUNNING)] = EmissionPipelineStageStatus.RUNNING
+    started_at: Annotated[int, Field(nullable=False, default_factory=unix_timestamp_in_seconds)]
+    finished_at: Annotated[Optional[int], Field(nullable=True)] = None
+    duration_ms: Annotated[Optional[int], Field(nullable=True)] = None
+
+    @classmethod
+    def get_checkpoint(cls, day: int, stage: str) -> Optional[Self]:
+        with Session(engine) as session:
+            statement = select(EmissionPipelineCheckpoint).where(
+                EmissionPipelineCheckpoint.day == day,
+                EmissionPipelineCheckpoint.stage == stage
+            )
+            return session.exec(statement).first()
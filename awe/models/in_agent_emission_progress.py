@@ -0,0 +1,23 @@
+from sqlmodel import SQLModel, Field, UniqueConstraint
+from typing import Annotated
+from .utils import unix_timestamp_in_seconds
+
+
+class InAgentEmissionStatus:
+    PENDING = 1
+    RUNNING = 2
+    DONE = 3
+    FAILED = 4
+
+
+# Progress of the in-agent emissions of each agent in a cycle
+
+class InAgentEmissionProgress(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("day", "user_agent_id", name="uq_inagentemissionprogress_day_agent"),)
+
+    id: Annotated[int, Field(primary_key=True, default=None)]
+    day: Annotated[int, Field(index=True, nullable=False)]
+    user_agent_id: Annotated[int, Field(index=True, nullable=False)]
+    status: Annotated[int, Field(index=True, nullable=False, default=InAgentEmissionStatus.PENDING)] = InAgentEmissionStatus.PENDING
+    attempts: Annotated[int, Field(nullable=False, default=0)] = 0
+    updated_at: Annotated[int, Field(nullable=False, default_factory=unix_timestamp_in_seconds)]
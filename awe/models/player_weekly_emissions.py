@@ -1,8 +1,10 @@
-from sqlmodel import SQLModel, Field
+from sqlmodel import SQLModel, Field, UniqueConstraint
 from typing import Annotated
 from .utils import unix_timestamp_in_seconds
 
 class PlayerWeeklyEmissions(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("day", "user_agent_id", "tg_user_id", name="uq_playerweeklyemissions_day_agent_user"),)
+
     id: Annotated[int, Field(primary_key=True, default=None)]
     user_agent_id: Annotated[int, Field(index=True, nullable=False)]
     tg_user_id: Annotated[str, Field(index=True, nullable=False)]
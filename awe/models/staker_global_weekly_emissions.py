@@ -1,10 +1,12 @@
-from sqlmodel import SQLModel, Field
+from sqlmodel import SQLModel, Field, UniqueConstraint
 from typing import Annotated
 from .utils import unix_timestamp_in_seconds
 
 # The 8% of emissions given to all the stakers (stakings)
 
 class StakerGlobalWeeklyEmissions(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("day", "staking_id", name="uq_stakerglobalweeklyemissions_day_staking"),)
+
     id: Annotated[int, Field(primary_key=True, default=None)]
     tg_user_id: Annotated[str, Field(index=True, nullable=False)]
     staking_id: Annotated[int, Field(index=True, nullable=False)]
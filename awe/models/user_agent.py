@@ -15,6 +15,7 @@ class UserAgent(SQLModel, table=True):
     awe_agent: Optional[AweAgent] = Field(sa_column=Column(AweAgentSAType))
     enabled: bool = Field(default=False)
     score: Annotated[int, Field(nullable=False, default=0)] = 0
+    pfp_hash: Optional[str] = Field(nullable=True, default=None)
 
     created_at: int = Field(index=True, nullable=False, default_factory=unix_timestamp_in_seconds)
     updated_at: int = Field(nullable=False, default_factory=unix_timestamp_in_seconds)
@@ -4,7 +4,7 @@ from awe.db import engine
 from .user_agent_stats_invocation_daily_counts import UserAgentStatsInvocationDailyCounts
 from .user_agent_stats_user_daily_counts import UserAgentStatsUserDailyCounts
 from awe.models.user_agent_data import UserAgentData
-from awe.cache import cache
+from awe.cache import pipelined_scard, pipelined_sadd, get_loading_set_key, add_to_loading_set, merge_loaded_set
 from typing import Tuple
 from .utils import get_day_as_timestamp, unix_timestamp_in_seconds
 import logging
@@ -23,6 +23,9 @@ class UsersIdSet:
         page_size = 1000
         current_page = 0
 
+        # Loaded aside, never seen half loaded by a concurrent add_user
+        load_key = get_loading_set_key(redis_key)
+
         while(True):
             logger.debug(f"Querying DB to load existing user ids...page {current_page}")
             with Session(engine) as session:
@@ -31,14 +34,17 @@ class UsersIdSet:
 
                 logger.debug(f"Loaded {len(user_ids)} user_ids")
 
-                if len(user_ids) > 0:
-                    ids = [user_id[0] for user_id in user_ids]
-                    logger.debug(f"Adding user_ids to redis: {ids}")
-                    try:
-                        cache.sadd(redis_key, *ids)
-                    except Exception as e:
-                        logger.error(e)
-                        raise Exception("Error writing to Redis cache")
+                try:
+                    if len(user_ids) > 0:
+                        ids = [user_id[0] for user_id in user_ids]
+                        logger.debug(f"Adding user_ids to redis: {ids}")
+                        add_to_loading_set(load_key, ids)
+
+                    if len(user_ids) < page_size:
+                        merge_loaded_set(redis_key, load_key)
+                except Exception as e:
+                    logger.error(e)
+                    raise Exception("Error writing to Redis cache")
 
                 if len(user_ids) < page_size:
                     return
@@ -68,31 +74,32 @@ class UsersIdSet:
         today_users_keys = "AGENT_STATS_USERS_" + str(day) + "_" + str(user_agent_id)
         total_users_keys = "AGENT_STATS_USERS_TOTAL_" + str(user_agent_id)
 
-        # Check if the data exists in redis
         try:
-            today_members = cache.scard(today_users_keys)
+            today_members, total_members = pipelined_scard([today_users_keys, total_users_keys])
         except Exception as e:
             logger.error(e)
-            raise Exception("Error reading from Redis cache")
+            raise Exception("Error writing to Redis cache")
 
+        # The set is not in redis, load it from the DB before adding
         if today_members == 0:
             logger.debug("today members zero from redis, load it from DB")
             self.load_user_ids_from_db_for_today(day, user_agent_id, today_users_keys)
 
-        try:
-            total_members = cache.scard(total_users_keys)
-        except Exception as e:
-            logger.error(e)
-            raise Exception("Error reading from Redis cache")
-
         if total_members == 0:
             logger.debug("total members zero from redis, load it from DB")
             self.load_user_ids_from_db_total(user_agent_id, total_users_keys)
 
-        today_incremented = cache.sadd(today_users_keys, user_id)
-        total_incremented = cache.sadd(total_users_keys, user_id)
+        # Add to both sets in one round-trip
+        try:
+            today_incremented, total_incremented = pipelined_sadd([
+                (today_users_keys, user_id),
+                (total_users_keys, user_id)
+            ])
+        except Exception as e:
+            logger.error(e)
+            raise Exception("Error writing to Redis cache")
 
-        return today_incremented==1, total_incremented==1
+        return today_incremented, total_incremented
 
 
 usersIdSet = UsersIdSet()
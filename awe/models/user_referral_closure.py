@@ -0,0 +1,15 @@
+from sqlmodel import SQLModel, Field, UniqueConstraint
+from typing import Annotated
+
+
+# All the (ancestor, descendant) pairs of the referral chains
+# The ids are the ids of UserReferrals, a user is not its own ancestor
+# Same as walking up the referred_by chain until a user is seen again
+
+class UserReferralClosure(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("ancestor_id", "descendant_id", name="uq_userreferralclosure_ancestor_descendant"),)
+
+    id: Annotated[int, Field(primary_key=True, default=None)]
+    ancestor_id: Annotated[int, Field(index=True, nullable=False)]
+    descendant_id: Annotated[int, Field(index=True, nullable=False)]
+    depth: Annotated[int, Field(nullable=False)]
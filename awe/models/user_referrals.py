@@ -1,7 +1,8 @@
-from sqlmodel import SQLModel, Field, select, Session
-from typing import Annotated, Optional
+from sqlmodel import SQLModel, Field, select, Session, update, insert
+from typing import Annotated, Optional, List, Tuple
 from typing_extensions import Self
 from awe.db import engine
+from .user_referral_closure import UserReferralClosure
 import random
 import string
 import math
@@ -19,6 +20,46 @@ class CodeNotFound(Exception):
 def generate_random_code() -> str:
     return ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
 
+def get_referral_multiplier(num_activated_referrals: int) -> int:
+    multiplier = 28.5 * math.log10(num_activated_referrals + 1) + 1
+    if multiplier > 100:
+        multiplier = 100
+
+    return int(multiplier)
+
+
+def add_referral_closure(target_ancestors: List[Tuple[int, int]], source_id: int, session: Session):
+    # The source is referred by the target
+    # Link the target and its ancestors to the source and its descendants
+
+    statement = select(UserReferralClosure.descendant_id, UserReferralClosure.depth).where(
+        UserReferralClosure.ancestor_id == source_id
+    )
+    source_descendants = [(source_id, 0)] + session.exec(statement).all()
+
+    ancestor_ids = [ancestor_id for ancestor_id, _ in target_ancestors]
+    descendant_ids = [descendant_id for descendant_id, _ in source_descendants]
+
+    # Already linked if the source was up the chain of the target
+    statement = select(UserReferralClosure.ancestor_id, UserReferralClosure.descendant_id).where(
+        UserReferralClosure.ancestor_id.in_(ancestor_ids),
+        UserReferralClosure.descendant_id.in_(descendant_ids)
+    )
+    existing_pairs = set([(ancestor_id, descendant_id) for ancestor_id, descendant_id in session.exec(statement).all()])
+
+    new_records = [{
+            "ancestor_id": ancestor_id,
+            "descendant_id": descendant_id,
+            "depth": ancestor_depth + descendant_depth + 1
+        } for ancestor_id, ancestor_depth in target_ancestors
+        for descendant_id, descendant_depth in source_descendants
+        if ancestor_id != descendant_id and (ancestor_id, descendant_id) not in existing_pairs
+    ]
+
+    if len(new_records) != 0:
+        session.execute(insert(UserReferralClosure), new_records)
+
+
 class UserReferrals(SQLModel, table=True):
     id: Annotated[Optional[int], Field(primary_key=True)]
     tg_user_id: Annotated[str, Field(index=True, nullable=False)]
@@ -51,11 +92,7 @@ class UserReferrals(SQLModel, table=True):
 
 
     def get_multiplier(self) -> int:
-        multiplier = 28.5 * math.log10(self.num_activated_referrals + 1) + 1
-        if multiplier > 100:
-            multiplier = 100
-
-        return int(multiplier)
+        return get_referral_multiplier(self.num_activated_referrals)
 
     @classmethod
     def activate(cls, tg_user_id: str, session: Session):
@@ -72,22 +109,16 @@ class UserReferrals(SQLModel, table=True):
         target_user_referrals.activated = True
         session.add(target_user_referrals)
 
-        # Prevent loop in the referral chain
-        referral_ids = {
-            target_user_referrals.id: 1
-        }
-
-        # Trace the referral chain up
-        while target_user_referrals.referred_by is not None and target_user_referrals.referred_by not in referral_ids:
-            referral_ids[target_user_referrals.referred_by] = 1
-
-            next_target_statement = select(UserReferrals).where(
-                UserReferrals.id == target_user_referrals.referred_by
+        # All the ancestors in one go
+        statement = update(UserReferrals).where(
+            UserReferrals.id.in_(
+                select(UserReferralClosure.ancestor_id).where(UserReferralClosure.descendant_id == target_user_referrals.id)
             )
+        ).values(
+            num_activated_referrals=UserReferrals.num_activated_referrals + 1
+        ).execution_options(synchronize_session=False)
 
-            target_user_referrals = session.exec(next_target_statement).first()
-            target_user_referrals.num_activated_referrals = UserReferrals.num_activated_referrals + 1
-            session.add(target_user_referrals)
+        session.execute(statement)
 
 
     @classmethod
@@ -120,33 +151,28 @@ class UserReferrals(SQLModel, table=True):
 
             source_user_referrals.referred_by = target_user_referrals.id
             session.add(source_user_referrals)
+            session.flush()
 
-            logger.debug(f"Updating target user referral: {target_user_referrals.id}")
-            target_user_referrals.num_referrals = UserReferrals.num_referrals + 1
-            session.add(target_user_referrals)
+            # The target and its ancestors get the new referral
+            # Stop at the source if it's already up the chain
+            statement = select(UserReferralClosure.ancestor_id, UserReferralClosure.depth).where(
+                UserReferralClosure.descendant_id == target_user_referrals.id
+            )
+            target_ancestors = [(target_user_referrals.id, 0)] + session.exec(statement).all()
 
-            # Prevent loop in the referral chain
-            referral_ids = {
-                target_user_referrals.id: 1,
-                source_user_referrals.id: 1
-            }
+            referral_ids = [ancestor_id for ancestor_id, _ in target_ancestors if ancestor_id != source_user_referrals.id]
 
             logger.debug(referral_ids)
 
-            # Trace the referral chain up
-            while target_user_referrals.referred_by is not None \
-                  and target_user_referrals.referred_by not in referral_ids:
-                referral_ids[target_user_referrals.referred_by] = 1
-
-                next_target_statement = select(UserReferrals).where(
-                    UserReferrals.id == target_user_referrals.referred_by
-                )
+            statement = update(UserReferrals).where(
+                UserReferrals.id.in_(referral_ids)
+            ).values(
+                num_referrals=UserReferrals.num_referrals + 1
+            ).execution_options(synchronize_session=False)
 
-                target_user_referrals = session.exec(next_target_statement).first()
+            session.execute(statement)
 
-                logger.debug(f"Updating target user referral: {target_user_referrals.id}")
-                target_user_referrals.num_referrals = UserReferrals.num_referrals + 1
-                session.add(target_user_referrals)
+            add_referral_closure(target_ancestors, source_user_referrals.id, session)
 
             session.commit()
             session.refresh(source_user_referrals)
@@ -14,6 +14,22 @@ class UserStakingStatus:
     SUCCESS = 6
 
 
+def get_staking_multiplier(created_at: int, till_day_timestamp: int) -> float:
+
+    period = till_day_timestamp - created_at
+
+    if period >= 12 * 30 * 86400:
+        return 3
+
+    if period >= 6 * 30 * 86400:
+        return 2
+
+    if period >= 3 * 30 * 86400:
+        return 1.5
+
+    return 1
+
+
 class UserStaking(SQLModel, table=True):
     id: int | None = Field(primary_key=True)
     tg_user_id: str = Field(index=True, nullable=False)
@@ -67,16 +83,4 @@ class UserStaking(SQLModel, table=True):
 
 
     def get_multiplier(self, till_day_timestamp: int) -> float:
-
-        period = till_day_timestamp - self.created_at
-
-        if period >= 12 * 30 * 86400:
-            return 3
-
-        if period >= 6 * 30 * 86400:
-            return 2
-
-        if period >= 3 * 30 * 86400:
-            return 1.5
-
-        return 1
+        return get_staking_multiplier(self.created_at, till_day_timestamp)
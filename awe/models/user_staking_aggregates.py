@@ -0,0 +1,73 @@
+from sqlmodel import SQLModel, Field, UniqueConstraint, Session
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from typing import Annotated
+from awe.settings import settings
+
+
+def get_cycle_start(timestamp: int) -> int:
+    # Start of the emission cycle the timestamp falls in
+    interval = settings.tn_emission_interval_days * 86400
+    return settings.tn_emission_start + (timestamp - settings.tn_emission_start) // interval * interval
+
+
+# Amounts of the successful user stakings of each agent,
+# grouped by the cycles they were created and released in.
+# released_cycle is 0 if not released yet.
+# Exact for the cycle filters of the emissions:
+# created_at < cycle start <=> created_cycle < cycle start
+# released_at >= cycle end <=> released_cycle >= cycle end
+
+class UserStakingAggregates(SQLModel, table=True):
+    __table_args__ = (UniqueConstraint("user_agent_id", "created_cycle", "released_cycle", name="uq_userstakingaggregates_agent_cycles"),)
+
+    id: Annotated[int, Field(primary_key=True, default=None)]
+    user_agent_id: Annotated[int, Field(index=True, nullable=False)]
+    created_cycle: Annotated[int, Field(nullable=False)]
+    released_cycle: Annotated[int, Field(nullable=False, default=0)] = 0
+    amount: Annotated[int, Field(nullable=False, default=0)] = 0
+    num_stakings: Annotated[int, Field(nullable=False, default=0)] = 0
+
+    @classmethod
+    def add_staking(cls, user_agent_id: int, created_at: int, amount: int, session: Session):
+        cls.add_amount(user_agent_id, get_cycle_start(created_at), 0, amount, 1, session)
+
+    @classmethod
+    def release_staking(cls, user_agent_id: int, created_at: int, released_at: int, amount: int, session: Session):
+        created_cycle = get_cycle_start(created_at)
+        cls.add_amount(user_agent_id, created_cycle, 0, -amount, -1, session)
+        cls.add_amount(user_agent_id, created_cycle, get_cycle_start(released_at), amount, 1, session)
+
+    @classmethod
+    def add_amount(cls, user_agent_id: int, created_cycle: int, released_cycle: int, amount: int, num_stakings: int, session: Session):
+        # Atomic upsert, the finalizations of the same agent and cycles may run concurrently
+        table = cls.__table__
+        row = {
+            "user_agent_id": user_agent_id,
+            "created_cycle": created_cycle,
+            "released_cycle": released_cycle,
+            "amount": amount,
+            "num_stakings": num_stakings
+        }
+
+        dialect = session.get_bind().dialect.name
+
+        if dialect == "mysql":
+            statement = mysql.insert(table).values(row)
+            statement = statement.on_duplicate_key_update({
+                "amount": table.c.amount + statement.inserted.amount,
+                "num_stakings": table.c.num_stakings + statement.inserted.num_stakings
+            })
+        elif dialect in ["postgresql", "sqlite"]:
+            insert = postgresql.insert if dialect == "postgresql" else sqlite.insert
+            statement = insert(table).values(row)
+            statement = statement.on_conflict_do_update(
+                index_elements=["user_agent_id", "created_cycle", "released_cycle"],
+                set_={
+                    "amount": table.c.amount + statement.excluded.amount,
+                    "num_stakings": table.c.num_stakings + statement.excluded.num_stakings
+                }
+            )
+        else:
+            raise Exception(f"Upsert not supported for {dialect}")
+
+        session.execute(statement)
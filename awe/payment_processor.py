@@ -17,14 +17,31 @@ from awe.agent_manager.agent_fund import finalize_user_deposit, \
                                         finalize_game_pool_charge, \
                                         finalize_refund_agent_staking, \
                                         finalize_withdraw_to_creator, \
-                                        finalize_agent_creation_staking
+                                        finalize_agent_creation_staking, \
+                                        confirm_user_deposit, \
+                                        revert_user_deposit, \
+                                        confirm_user_staking, \
+                                        collect_approved_user_deposit, \
+                                        fail_user_deposit_approval, \
+                                        collect_approved_user_staking, \
+                                        fail_user_staking_approval, \
+                                        collect_approved_game_pool_charge, \
+                                        fail_game_pool_charge_approval, \
+                                        collect_approved_agent_creation_staking, \
+                                        fail_agent_creation_staking_approval
 from awe.blockchain import awe_on_chain
+from awe.settings import settings
+from awe.models.utils import unix_timestamp_in_seconds
+from typing import Callable
 import traceback
 import time
 
 batch_size = 10
 fetch_interval = 1
 
+# Approve txs are checked in one request
+approval_batch_size = 100
+
 class PaymentProcessor:
     # Check the tx status
     # Execute the finalizing process if tx is confirmed
@@ -48,6 +65,11 @@ class PaymentProcessor:
             self.logger.debug("checking pending TXs...")
             processed = 0
 
+            processed = processed + self.process_user_deposit_approval()
+            processed = processed + self.process_user_staking_approval()
+            processed = processed + self.process_game_pool_charge_approval()
+            processed = processed + self.process_agent_creation_staking_approval()
+
             processed = processed + self.process_user_deposit()
             processed = processed + self.process_user_staking()
             processed = processed + self.process_game_pool_charge()
@@ -63,19 +85,113 @@ class PaymentProcessor:
         self.logger.info("Payment processor stopped!")
 
 
+    def process_user_deposit_approval(self) -> int:
+        return self.process_approvals(
+            "User Deposit",
+            TgUserDeposit,
+            TgUserDepositStatus.APPROVING,
+            collect_approved_user_deposit,
+            fail_user_deposit_approval
+        )
+
+
+    def process_user_staking_approval(self) -> int:
+        return self.process_approvals(
+            "User Staking",
+            UserStaking,
+            UserStakingStatus.APPROVING,
+            collect_approved_user_staking,
+            fail_user_staking_approval
+        )
+
+
+    def process_game_pool_charge_approval(self) -> int:
+        return self.process_approvals(
+            "Game Pool Charge",
+            GamePoolCharge,
+            GamePoolChargeStatus.APPROVING,
+            collect_approved_game_pool_charge,
+            fail_game_pool_charge_approval
+        )
+
+
+    def process_agent_creation_staking_approval(self) -> int:
+        return self.process_approvals(
+            "Agent Creation",
+            UserAgentStaking,
+            UserAgentStakingStatus.APPROVING,
+            collect_approved_agent_creation_staking,
+            fail_agent_creation_staking_approval
+        )
+
+
+    def process_approvals(self, name: str, model, approving_status: int, on_approved: Callable[[int], None], on_failed: Callable[[int], None]) -> int:
+        # Check the approve txs of the pending requests in one go
+        # Collect the fund if approved
+
+        with Session(engine) as session:
+            statement = select(model.id, model.approve_tx_hash, model.created_at).where(
+                model.status == approving_status
+            ).order_by(model.id.asc()).limit(approval_batch_size)
+            requests = session.exec(statement).all()
+
+        if len(requests) == 0:
+            return 0
+
+        try:
+            commitment = "confirmed" if "approve" in settings.solana_provisional_tx_kinds else "finalized"
+            statuses = awe_on_chain.get_txs_status([approve_tx_hash for _, approve_tx_hash, _ in requests], commitment)
+        except Exception as e:
+            self.logger.error(e)
+            self.logger.error(traceback.format_exc())
+            return 0
+
+        now = unix_timestamp_in_seconds()
+        processed = 0
+
+        for (request_id, approve_tx_hash, created_at), status in zip(requests, statuses):
+            try:
+                if status is True:
+                    self.logger.info(f"[{name} {request_id}] Approve tx confirmed {approve_tx_hash}")
+                    on_approved(request_id)
+                elif status is False or now - created_at > settings.solana_tx_wait_timeout:
+                    self.logger.info(f"[{name} {request_id}] Approve tx failed {approve_tx_hash}")
+                    on_failed(request_id)
+                else:
+                    continue
+            except Exception as e:
+                self.logger.error(e)
+                self.logger.error(traceback.format_exc())
+
+            processed += 1
+
+        return processed
+
+
     def process_user_deposit(self) -> int:
+        provisional = "user_deposit" in settings.solana_provisional_tx_kinds
+
         with Session(engine) as session:
-            statement = select(TgUserDeposit).where(TgUserDeposit.status == TgUserDepositStatus.TX_SENT).order_by(TgUserDeposit.id.asc()).limit(batch_size)
+            statement = select(TgUserDeposit).where(
+                TgUserDeposit.status.in_([TgUserDepositStatus.TX_SENT, TgUserDepositStatus.TX_CONFIRMED])
+            ).order_by(TgUserDeposit.id.asc()).limit(batch_size)
             tg_user_deposits = session.exec(statement).all()
             for tg_user_deposit in tg_user_deposits:
                 try:
                     self.logger.info(f"[User Deposit {tg_user_deposit.id}] Check tx status...")
-                    tx_status = self.get_tx_status(tg_user_deposit.tx_hash, tg_user_deposit.tx_last_valid_block_height)
+                    tx_status = self.get_tx_status(tg_user_deposit.tx_hash, tg_user_deposit.tx_last_valid_block_height, provisional)
                     self.logger.info(f"[User Deposit {tg_user_deposit.id}] Tx status {tx_status}")
                     if tx_status == "success":
                         finalize_user_deposit(tg_user_deposit.id)
+                    elif tx_status == "confirmed":
+                        if tg_user_deposit.status == TgUserDepositStatus.TX_SENT:
+                            confirm_user_deposit(tg_user_deposit.id)
                     elif tx_status == "failed":
-                        TgUserDeposit.update_status(tg_user_deposit.id, TgUserDepositStatus.FAILED)
+                        if tg_user_deposit.status == TgUserDepositStatus.TX_CONFIRMED:
+                            # Take back the provisional credit
+                            revert_user_deposit(tg_user_deposit.id)
+                        else:
+                            TgUserDeposit.update_status(tg_user_deposit.id, TgUserDepositStatus.FAILED)
                 except Exception as e:
                     self.logger.error(e)
                     self.logger.error(traceback.format_exc())
@@ -86,16 +202,23 @@ class PaymentProcessor:
 
 
     def process_user_staking(self) -> int:
+        provisional = "user_staking" in settings.solana_provisional_tx_kinds
+
         with Session(engine) as session:
-            statement = select(UserStaking).where(UserStaking.status == UserStakingStatus.TX_SENT).order_by(UserStaking.id.asc()).limit(batch_size)
+            statement = select(UserStaking).where(
+                UserStaking.status.in_([UserStakingStatus.TX_SENT, UserStakingStatus.TX_CONFIRMED])
+            ).order_by(UserStaking.id.asc()).limit(batch_size)
             user_stakings = session.exec(statement).all()
             for user_staking in user_stakings:
                 try:
                     self.logger.info(f"[User Staking {user_staking.id}] Check tx status...")
-                    tx_status = self.get_tx_status(user_staking.tx_hash, user_staking.tx_last_valid_block_height)
+                    tx_status = self.get_tx_status(user_staking.tx_hash, user_staking.tx_last_valid_block_height, provisional)
                     self.logger.info(f"[User Staking {user_staking.id}] Tx status {tx_status}")
                     if tx_status == "success":
                         finalize_user_staking(user_staking.id)
+                    elif tx_status == "confirmed":
+                        if user_staking.status == UserStakingStatus.TX_SENT:
+                            confirm_user_staking(user_staking.id)
                     elif tx_status == "failed":
                         UserStaking.update_staking_status(user_staking.id, UserStakingStatus.FAILED)
                 except Exception as e:
@@ -238,12 +361,24 @@ class PaymentProcessor:
         return len(agent_stakings)
 
 
-    def get_tx_status(self, tx_hash: str, last_valid_block_height: int) -> str:
-        is_confirmed = awe_on_chain.is_tx_confirmed(tx_hash)
-        if is_confirmed:
+    def get_tx_status(self, tx_hash: str, last_valid_block_height: int, provisional: bool = False) -> str:
+        # "success" once finalized
+        # "confirmed" if only confirmed and provisional results are accepted
+        commitment = awe_on_chain.get_txs_commitment([tx_hash])[0]
+        if commitment == "finalized":
             return "success"
 
-        # Not confirmed
+        if commitment == "failed":
+            return "failed"
+
+        if commitment == "confirmed" and provisional:
+            return "confirmed"
+
+        if commitment is not None:
+            # Landed, wait for finalization
+            return "pending"
+
+        # Not found
         # Check if the tx is expired
         current_block_height = awe_on_chain.get_block_height()
 
@@ -3,7 +3,7 @@ from pydantic_settings import BaseSettings
 from pydantic import model_validator, Field
 import logging
 import enum
-from typing import Optional, Annotated, Tuple
+from typing import Optional, Annotated, Tuple, List
 from typing_extensions import Self
 from solders.keypair import Keypair
 import os
@@ -37,7 +37,27 @@ class AweSettings(BaseSettings):
     server_host: str = "https://api.aweai.fun"
     webui_host: str = "https://aweai.fun"
 
+    # API rate limits per client address, shared by the API replicas through Redis
+    # Default, public read and fund writing routes
     api_rate_limit: str = "20/minute"
+    api_public_rate_limit: str = "120/minute"
+    api_write_rate_limit: str = "10/minute"
+
+    # Redis used for the rate limits, redis_cache if not set
+    api_rate_limit_storage: Annotated[Optional[str], Field(default=None)] = None
+
+    # Cache max age of the legacy PFPs named by agent id (seconds)
+    # The content hashed ones are immutable
+    pfp_max_age: int = 300
+
+    # nginx internal location of persisted_data/pfps, e.g. /internal-pfps
+    # The API only returns the headers and X-Accel-Redirect if set
+    pfp_accel_redirect: Annotated[Optional[str], Field(default=None)] = None
+
+    # Verified tokens and agent ownerships cached in each API process
+    # Max entries of each cache and the ownership TTL (seconds)
+    api_auth_cache_size: int = 10000
+    api_ownership_cache_ttl: int = 60
 
     log_level: str = 'INFO'
     log_dir: str = ""
@@ -45,14 +65,54 @@ class AweSettings(BaseSettings):
 
     db_connection_string: str
     db_log_level: str = 'WARN'
+
+    # Async driver connection for the API reads
+    # Derived from db_connection_string if not set
+    async_db_connection_string: Annotated[Optional[str], Field(default=None)] = None
+
+    # DB connection pool of each process role
+    # api: the API server, both the sync and the async engine
+    # agent: each agent process and the agent manager
+    # processor: the payment processor and the transfer batcher
+    # worker: each Celery worker process and the command line tools
+    db_pool_size_api: int = 10
+    db_max_overflow_api: int = 10
+    db_pool_size_agent: int = 1
+    db_max_overflow_agent: int = 2
+    db_pool_size_processor: int = 3
+    db_max_overflow_processor: int = 2
+    db_pool_size_worker: int = 2
+    db_max_overflow_worker: int = 2
+    db_pool_timeout: int = 30
+
+    # Open a connection per checkout instead of pooling
+    # For a PgBouncer / ProxySQL in front of the DB
+    db_null_pool: bool = False
     celery_broker_url: str
     celery_backend_url: str
     redis_cache: str
 
+    # Redis connection pool of each process
+    # Max connections and the health check interval of idle connections (seconds)
+    redis_max_connections: int = 50
+    redis_health_check_interval: int = 30
+
     solana_network: SolanaNetwork = SolanaNetwork.Devnet
     solana_network_endpoint: str = ""
     solana_tx_wait_timeout: int = 60
 
+    # Queue outgoing transfers and send them in batched txs
+    solana_batch_transfer_enabled: bool = False
+    solana_batch_transfer_window: int = 3
+
+    # Don't wait for the signing workers
+    # The tasks record the sent txs themselves
+    solana_tx_async_dispatch: bool = False
+
+    # Tx kinds acted on provisionally at Confirmed commitment
+    # The irreversible steps still wait for Finalized
+    solana_provisional_tx_kinds: List[str] = ["approve", "user_deposit", "user_staking"]
+
     solana_awe_metadata_address: str
     solana_awe_mint_address: str
     solana_awe_program_id: str
@@ -94,6 +154,25 @@ class AweSettings(BaseSettings):
     tn_emission_start: int
     tn_emission_interval_days: int = 7
 
+    # Distribute the in-agent emissions with the emission agent workers
+    # The DB concurrency is bounded by the worker concurrency
+    emission_parallel_in_agent: bool = False
+    emission_agent_chunk_size: int = 50
+    emission_agent_max_attempts: int = 3
+    emission_agent_timeout: int = 1800
+
+    # Agent list served from Redis
+    # Full rebuild interval, discover list reshuffle interval and the HTTP max-age (seconds)
+    agent_leaderboard_ttl: int = 300
+    agent_discover_rotation: int = 600
+    agent_list_max_age: int = 10
+
+    # Agent stats dashboard cached in Redis
+    # Cache TTL (seconds), max days of a request and max points of a series
+    agent_stats_cache_ttl: int = 60
+    agent_stats_max_days: int = 365
+    agent_stats_max_points: int = 60
+
     # System prompt
     prepend_prompt: Annotated[Optional[str], Field(default=None)] = None
     append_prompt: Annotated[Optional[str], Field(default=None)] = None
@@ -121,6 +121,10 @@ class AccountHandler(BaseHandler):
             await context.bot.send_message(update.effective_chat.id, "Something is wrong. Please try again later.")
             return
 
+        if tx is None:
+            await context.bot.send_message(update.effective_chat.id, f"Your withdraw of $AWE {amount}.00 to your wallet {user_wallet.address} is queued. You will receive the transaction shortly.")
+            return
+
         await context.bot.send_message(update.effective_chat.id, f"$AWE {amount}.00 has been transferred to your wallet {user_wallet.address}. The transaction should be confirmed in a short while:\n\n{tx}")
 
 
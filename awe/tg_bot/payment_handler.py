@@ -11,7 +11,8 @@ from sqlmodel import Session, select
 from awe.db import engine
 from sqlalchemy.orm import joinedload
 from awe.settings import settings
-from awe.agent_manager.agent_stats import record_user_payment
+from awe.agent_manager.agent_stats import record_user_payment, invalidate_stats_dashboard
+from awe.agent_manager.agent_leaderboard import mark_agent_dirty
 
 logger = logging.getLogger("[PaymentHandler]")
 
@@ -195,6 +196,11 @@ class PaymentHandler(BaseHandler):
 
                 session.commit()
 
+            invalidate_stats_dashboard(self.user_agent_id)
+
+            if pool_share != 0:
+                mark_agent_dirty(self.user_agent_id)
+
         logger.info(f"Payment done from user {user_id} to agent {self.user_agent_id}")
 
         return "The payment is received. Have fun!"
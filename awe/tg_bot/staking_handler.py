@@ -136,7 +136,10 @@ class StakingHandler(AccountHandler):
         try:
             tx = await asyncio.to_thread(release_user_staking, self.user_agent_id, user_id, staking_id, user_wallet.address)
 
-            msg = f"Your staking has been returned!\n\n{tx}"
+            if tx is None:
+                msg = "Your staking release is queued. You will receive the transaction shortly."
+            else:
+                msg = f"Your staking has been returned!\n\n{tx}"
             await context.bot.send_message(update.effective_chat.id, msg)
 
         except ReleaseStakingNotAllowedException as e:
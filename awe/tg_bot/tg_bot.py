@@ -19,11 +19,10 @@ from datetime import datetime
 from awe.db import engine
 from sqlmodel import Session, select
 from typing import Optional
-from threading import Thread
-from awe.cache import cache
+from awe.cache import get_async_cache, async_block_timeout
 import json
 from .bot_maintenance import check_maintenance
-import time
+from awe.maintenance import listen_maintenance
 import traceback
 
 
@@ -47,7 +46,11 @@ class TGBot:
 
         # TG Application
         self.logger.info("Initializing TG Bot...")
-        self.application = ApplicationBuilder().token(tg_bot_config.token).build()
+        self.application = ApplicationBuilder().token(tg_bot_config.token).post_init(
+            self.start_background_tasks
+        ).post_stop(
+            self.stop_background_tasks
+        ).build()
 
         # Start handler
         start_handler = CommandHandler('start', self.start_command)
@@ -355,40 +358,61 @@ class TGBot:
                 f.write(f"[{current_time}] [Bot] {output}\n")
 
 
-    def send_user_notifications(self, loop):
+    async def send_user_notifications(self):
 
-        self.logger.info(f"Notification thread for agent {self.user_agent_id} started!")
+        self.logger.info(f"Notification task for agent {self.user_agent_id} started!")
+
+        bot_key = f"TG_BOT_USER_NOTIFICATIONS_{self.user_agent_id}"
 
         while not self.stopped:
-            bot_key = f"TG_BOT_USER_NOTIFICATIONS_{self.user_agent_id}"
-            message = cache.lpop(bot_key)
+            # Wait on the list instead of polling it
+            try:
+                item = await get_async_cache().blpop(bot_key, timeout=async_block_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error(e)
+                await asyncio.sleep(1)
+                continue
 
-            if message is None:
-                time.sleep(1)
-            else:
-                message_dict = json.loads(message)
-                if len(message_dict) != 2:
-                    continue
+            if item is None:
+                continue
+
+            message_dict = json.loads(item[1])
+            if len(message_dict) != 2:
+                continue
+
+            tg_user_id = message_dict[0]
+            msg = message_dict[1]
+
+            try:
+                await self.send_direct_message(tg_user_id, msg)
+            except Exception as e:
+                self.logger.error(e)
+                self.logger.error(traceback.format_exc())
 
-                tg_user_id = message_dict[0]
-                msg = message_dict[1]
+        self.logger.info(f"Notification task for agent {self.user_agent_id} stopped!")
 
-                try:
-                    future = asyncio.run_coroutine_threadsafe(self.send_direct_message(tg_user_id, msg), loop)
-                    future.result()
-                except Exception as e:
-                    self.logger.error(e)
-                    self.logger.error(traceback.format_exc())
 
-        self.logger.info(f"Notification thread for agent {self.user_agent_id} stopped!")
+    async def start_background_tasks(self, application):
+        self.background_tasks = [
+            asyncio.create_task(self.send_user_notifications()),
+            asyncio.create_task(listen_maintenance())
+        ]
+
+
+    async def stop_background_tasks(self, application):
+        self.stopped = True
+
+        for task in self.background_tasks:
+            task.cancel()
+
+        await asyncio.gather(*self.background_tasks, return_exceptions=True)
 
 
     def start(self) -> None:
         self.logger.info("Starting TG Bot...")
 
-        send_user_notification_thread = Thread(target=self.send_user_notifications, args=(asyncio.get_event_loop(), ))
-        send_user_notification_thread.start()
-
         try:
             self.application.run_polling()
         except Exception as e:
@@ -396,6 +420,5 @@ class TGBot:
             self.logger.error(traceback.format_exc())
         finally:
             self.stopped = True
-            send_user_notification_thread.join()
 
         self.logger.info("TG Bot stopped!")
@@ -0,0 +1,131 @@
+import logging
+import signal
+import time
+import json
+import traceback
+from awe.settings import settings
+from awe.cache import cache
+from awe.blockchain import awe_on_chain
+from awe.agent_manager.transfer_queue import outgoing_transfers_key, processing_transfers_key
+from awe.agent_manager.agent_fund import record_transfer_tx
+
+# Max transfers to take from the queue at a time
+# They will be packed into as many txs as needed
+batch_size = 200
+
+class TransferBatcher:
+    # Collect the queued outgoing transfers
+    # Send them in batched txs
+    # Record the tx in the originating rows for the payment processor
+
+
+    def __init__(self) -> None:
+        self.kill_now = False
+        signal.signal(signal.SIGINT, self.exit_gracefully)
+        signal.signal(signal.SIGTERM, self.exit_gracefully)
+        self.logger = logging.getLogger("[Transfer Batcher]")
+
+
+    def exit_gracefully(self, signum, frame):
+        self.logger.info("Gracefully shutdown the transfer batcher...")
+        self.kill_now = True
+
+
+    def start(self):
+        self.requeue_processing_transfers()
+
+        while not self.kill_now:
+            # Accumulate the transfers for a short window
+            time.sleep(settings.solana_batch_transfer_window)
+
+            try:
+                while self.send_batch() == batch_size:
+                    pass
+            except Exception as e:
+                self.logger.error(e)
+                self.logger.error(traceback.format_exc())
+
+        self.logger.info("Transfer batcher stopped!")
+
+
+    def requeue_processing_transfers(self):
+        # Transfers left by a batcher stopped in the middle of a batch
+        # Safe to send again, the txs already sent are only recorded
+        num_requeued = 0
+        while cache.lmove(processing_transfers_key, outgoing_transfers_key, "LEFT", "RIGHT") is not None:
+            num_requeued += 1
+
+        if num_requeued != 0:
+            self.logger.warning(f"{num_requeued} unfinished transfers requeued")
+
+
+    def send_batch(self) -> int:
+        # Move the transfers to the processing list, so that they are not lost if the batcher dies
+        pipeline = cache.pipeline()
+        for _ in range(batch_size):
+            pipeline.lmove(outgoing_transfers_key, processing_transfers_key, "LEFT", "RIGHT")
+
+        items = [item for item in pipeline.execute() if item is not None]
+        if len(items) == 0:
+            return 0
+
+        request_items = {}
+        request_ids = []
+        addresses = []
+        amounts = []
+
+        for item in items:
+            request_id, address, amount = json.loads(item)
+            request_items[request_id] = item
+            request_ids.append(request_id)
+            addresses.append(address)
+            amounts.append(amount)
+
+        self.logger.info(f"Sending {len(request_ids)} transfers")
+
+        try:
+            results = awe_on_chain.batch_transfer_to_users(request_ids, addresses, amounts)
+        except Exception as e:
+            # The txs sent before the error are only recorded next time
+            self.logger.error(f"Failed sending the transfers, requeued: {request_ids}")
+            self.logger.error(e)
+            self.logger.error(traceback.format_exc())
+            self.finish_transfers([], items)
+            return len(items)
+
+        done_items = []
+        failed_items = []
+
+        for tx, last_valid_block_height, tx_request_ids in results:
+            if tx is None:
+                self.logger.error(f"Failed sending the transfers, requeued: {tx_request_ids}")
+                failed_items.extend([request_items[request_id] for request_id in tx_request_ids])
+                continue
+
+            for request_id in tx_request_ids:
+                try:
+                    record_transfer_tx(request_id, tx, last_valid_block_height, notify_user=True)
+                    done_items.append(request_items[request_id])
+                except Exception as e:
+                    self.logger.error(f"[{request_id}] Failed recording the tx {tx}, requeued")
+                    self.logger.error(e)
+                    self.logger.error(traceback.format_exc())
+                    failed_items.append(request_items[request_id])
+
+        self.finish_transfers(done_items, failed_items)
+
+        return len(items)
+
+
+    def finish_transfers(self, done_items: list, failed_items: list):
+        # Remove the transfers from the processing list
+        # The failed ones go back to the queue for the next batch
+        pipeline = cache.pipeline()
+
+        for item in done_items + failed_items:
+            pipeline.lrem(processing_transfers_key, 1, item)
+
+        if len(failed_items) != 0:
+            pipeline.rpush(outgoing_transfers_key, *failed_items)
+
+        pipeline.execute()
@@ -0,0 +1,151 @@
+# Compare the throughput of the sync and async DB reads of the API
+# Runs in-process on a local SQLite file, no server or docker needed:
+#
+#   python -m benchmarks.api_load_test --agents 1000 --concurrency 200 --duration 10
+#
+# The sync route is the previous agent list handler, served from the thread pool.
+# The async route is the current one, served on the event loop through aiosqlite.
+# The rest of the config is read from persisted_data/.env as usual.
+
+import argparse
+import asyncio
+import os
+import time
+
+parser = argparse.ArgumentParser(description="Load test the sync and async agent list DB reads")
+parser.add_argument("--db", default="sqlite:///./benchmark.db", help="Sync connection string, the async one is derived from it")
+parser.add_argument("--agents", type=int, default=1000, help="Number of agents to seed")
+parser.add_argument("--concurrency", type=int, default=200, help="Number of concurrent clients")
+parser.add_argument("--duration", type=float, default=10, help="Seconds to run each route")
+args = parser.parse_args()
+
+os.environ["DB_CONNECTION_STRING"] = args.db
+os.environ.pop("ASYNC_DB_CONNECTION_STRING", None)
+
+import httpx
+from fastapi import FastAPI
+from sqlmodel import SQLModel, Session, select, delete
+from sqlalchemy.orm import load_only, joinedload
+from awe.db import engine, async_engine
+from awe.models import UserAgent, UserAgentData
+from awe.models.tg_bot import TGBot
+from awe.api.routers.v1.agents import AgentListItem, get_agent_list_from_db, page_size
+
+
+def seed(num_agents: int):
+    SQLModel.metadata.create_all(engine, tables=[UserAgent.__table__, UserAgentData.__table__])
+
+    with Session(engine) as session:
+        session.exec(delete(UserAgentData))
+        session.exec(delete(UserAgent))
+
+        for i in range(num_agents):
+            user_agent = UserAgent(
+                name=f"Agent {i}",
+                user_address=f"address_{i}",
+                tg_bot=TGBot(username=f"agent_{i}_bot", token="", start_message="Hello"),
+                enabled=True,
+                score=i
+            )
+            user_agent.agent_data = UserAgentData(total_invocations=i, awe_token_quote=i * 100, awe_token_staking=i * 1000)
+            session.add(user_agent)
+
+        session.commit()
+
+
+def get_agent_list_sync(page: int):
+    with Session(engine) as session:
+        statement = select(UserAgent).order_by(UserAgent.score.desc()).offset(page * page_size).options(
+            joinedload(UserAgent.agent_data),
+            load_only(
+                UserAgent.id,
+                UserAgent.name,
+                UserAgent.score,
+                UserAgent.tg_bot
+            )
+        ).where(
+            UserAgent.enabled == True
+        ).limit(page_size)
+
+        user_agents = session.exec(statement).all()
+
+        return [
+            AgentListItem(
+                id=user_agent.id,
+                name=user_agent.name,
+                score=user_agent.score,
+                tg_username=user_agent.tg_bot.username,
+                description=user_agent.tg_bot.start_message,
+                invocations=user_agent.agent_data.total_invocations,
+                pool=user_agent.agent_data.awe_token_quote,
+                staking=user_agent.agent_data.awe_token_staking
+            )
+            for user_agent in user_agents
+        ]
+
+
+app = FastAPI()
+
+
+@app.get("/sync")
+def sync_route(page: int = 0):
+    return get_agent_list_sync(page)
+
+
+@app.get("/async")
+async def async_route(page: int = 0):
+    return await get_agent_list_from_db("leaderboard", page)
+
+
+async def run_route(path: str, concurrency: int, duration: float, num_pages: int):
+    latencies = []
+    errors = 0
+    deadline = time.perf_counter() + duration
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://benchmark") as client:
+
+        async def worker(worker_id: int):
+            nonlocal errors
+            page = worker_id % num_pages
+            while time.perf_counter() < deadline:
+                start = time.perf_counter()
+                response = await client.get(path, params={"page": page})
+                if response.status_code == 200:
+                    latencies.append(time.perf_counter() - start)
+                else:
+                    errors += 1
+                page = (page + 1) % num_pages
+
+        await asyncio.gather(*[worker(i) for i in range(concurrency)])
+
+    latencies.sort()
+    num_requests = len(latencies)
+
+    print(f"{path}: {num_requests / duration:.1f} req/s, {errors} errors", end="")
+    if num_requests != 0:
+        print(f", p50 {latencies[num_requests // 2] * 1000:.1f} ms, p99 {latencies[int(num_requests * 0.99)] * 1000:.1f} ms")
+    else:
+        print()
+
+
+async def main():
+    seed(args.agents)
+
+    num_pages = max(1, args.agents // page_size)
+
+    print(f"{args.agents} agents, {args.concurrency} clients, {args.duration}s per route")
+
+    # Warm up the pools
+    await run_route("/sync", 1, 1, num_pages)
+    await run_route("/async", 1, 1, num_pages)
+
+    print("---")
+
+    await run_route("/sync", args.concurrency, args.duration, num_pages)
+    await run_route("/async", args.concurrency, args.duration, num_pages)
+
+    await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -21,6 +21,10 @@ if config.config_file_name is not None:
 section = config.config_ini_section
 config.set_section_option(section, "DB_CONNECTION_STRING", settings.db_connection_string)
 
+# Emission cycles of the deployment, read by the data migrations through op.get_context().config
+config.set_main_option("tn_emission_start", str(settings.tn_emission_start))
+config.set_main_option("tn_emission_interval_days", str(settings.tn_emission_interval_days))
+
 # add your model's MetaData object here
 # for 'autogenerate' support
 # from myapp import mymodel
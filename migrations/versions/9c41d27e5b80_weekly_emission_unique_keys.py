@@ -0,0 +1,47 @@
+"""weekly emission unique keys
+
+Revision ID: 9c41d27e5b80
+Revises: 041b228a8ea1
+Create Date: 2026-10-19 11:03:27.614820
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+import awe
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9c41d27e5b80'
+down_revision: Union[str, None] = '041b228a8ea1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+unique_keys = [
+    ('playerweeklyemissions', 'uq_playerweeklyemissions_day_agent_user', ['day', 'user_agent_id', 'tg_user_id']),
+    ('stakerweeklyemissions', 'uq_stakerweeklyemissions_day_staking', ['day', 'staking_id']),
+    ('stakerglobalweeklyemissions', 'uq_stakerglobalweeklyemissions_day_staking', ['day', 'staking_id']),
+]
+
+
+def upgrade() -> None:
+    for table, name, columns in unique_keys:
+        # Keep the latest record of the duplicates
+        # The derived table is required by MySQL
+        key = ', '.join(columns)
+        op.execute(
+            f"DELETE FROM {table} WHERE id NOT IN "
+            f"(SELECT id FROM (SELECT MAX(id) AS id FROM {table} GROUP BY {key}) AS latest)"
+        )
+
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.create_unique_constraint(name, columns)
+
+
+def downgrade() -> None:
+    for table, name, _ in reversed(unique_keys):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_constraint(name, type_='unique')
@@ -4,19 +4,27 @@ import logging
 import uvicorn
 from awe.api.app import app
 import multiprocessing as mp
-from awe.db import init_engine
+from awe.db import init_engine, DBRole
 from awe.cache import init_cache
 from awe.payment_processor import PaymentProcessor
+from awe.transfer_batcher import TransferBatcher
 
 def start_payment_processor():
-    init_engine()
+    init_engine(DBRole.PROCESSOR)
     init_cache()
     processor = PaymentProcessor()
     processor.start()
 
 
+def start_transfer_batcher():
+    init_engine(DBRole.PROCESSOR)
+    init_cache()
+    batcher = TransferBatcher()
+    batcher.start()
+
+
 def start_api_server():
-    init_engine()
+    init_engine(DBRole.API)
     init_cache()
     uvicorn.run(app, host="0.0.0.0", port=7777)
 
@@ -37,7 +45,14 @@ if __name__ == "__main__":
     payment_processor.daemon = True
     payment_processor.start()
 
+    if settings.solana_batch_transfer_enabled:
+        logger.info("Starting transfer batcher...")
+        transfer_batcher = mp.Process(target=start_transfer_batcher)
+        transfer_batcher.daemon = True
+        transfer_batcher.start()
+
     logger.info("Starting agent manager...")
+    init_engine(DBRole.AGENT)
     AgentManager().run()
 
     logger.info("Awe stopped!")
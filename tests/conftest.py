@@ -0,0 +1,47 @@
+import os
+import tempfile
+import base58
+import pytest
+from solders.keypair import Keypair
+
+# The settings are loaded on import, point them to a throwaway environment first
+# Variables set here take precedence over persisted_data/.env
+
+test_dir = tempfile.mkdtemp(prefix="awe_test_")
+system_payer = Keypair()
+comm_key = Keypair()
+
+test_env = {
+    "AWE_KEEP_ENV_FILE": "1",
+    "REMOVE_ENV_FILE": "False",
+    "DB_CONNECTION_STRING": f"sqlite+pysqlite:///{os.path.join(test_dir, 'db.sqlite')}",
+    "REDIS_CACHE": "redis://127.0.0.1:6379/15",
+    "CELERY_BROKER_URL": "redis://127.0.0.1:6379/14",
+    "CELERY_BACKEND_URL": "redis://127.0.0.1:6379/14",
+    "ADMIN_TOKEN": "test",
+    "SOLANA_NETWORK_ENDPOINT": "http://127.0.0.1:8899",
+    "SOLANA_AWE_METADATA_ADDRESS": "FuFDmG2tuTUzKA3jV3ntQ9VmaST5usXFDsCBFVkUM1PF",
+    "SOLANA_AWE_MINT_ADDRESS": "Bku6qAGAhEn1RESz8FkuFEzwT5nKyWik14idasduiLuS",
+    "SOLANA_AWE_PROGRAM_ID": "6RNWX7FVHCbiw7ivee5amUt4CzsCGkoj5T2QZdVWWYkh",
+    "SOLANA_DEVELOPER_WALLET": "5PGZata9nWHCpkRFXJpy5MLCXkgYRJH7jCKiCAbpjYtB",
+    "SOLANA_SYSTEM_PAYER_PRIVATE_KEY": str(system_payer),
+    "SOLANA_SYSTEM_PAYER_PUBLIC_KEY": str(system_payer.pubkey()),
+    "COMM_ED25519_PRIVATE_KEY": base58.b58encode(bytes(comm_key)).decode(),
+    "COMM_ED25519_PUBLIC_KEY": str(comm_key.pubkey()),
+    "TN_EMISSION_START": "0",
+    "CMC_API_KEY": "test",
+    "LLM_TYPE": "local"
+}
+
+os.environ.update(test_env)
+
+
+@pytest.fixture
+def db():
+    from sqlmodel import SQLModel
+    from awe.db import engine
+    import awe.models
+
+    SQLModel.metadata.create_all(engine)
+    yield engine
+    SQLModel.metadata.drop_all(engine)
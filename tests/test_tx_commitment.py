@@ -0,0 +1,203 @@
+from types import SimpleNamespace
+from unittest.mock import Mock
+import pytest
+from solders.signature import Signature
+from solders.transaction_status import TransactionConfirmationStatus
+from sqlmodel import Session, select
+
+import awe.payment_processor as payment_processor
+from awe.payment_processor import PaymentProcessor
+from awe.blockchain import awe_on_chain
+from awe.models import TgUserDeposit, TgUserAccount
+from awe.models.tg_user_deposit import TgUserDepositStatus
+
+
+# Signature statuses returned by the stub RPC
+rpc_statuses = {
+    "not_found": None,
+    "processed": (TransactionConfirmationStatus.Processed, None),
+    "confirmed": (TransactionConfirmationStatus.Confirmed, None),
+    "confirmed_err": (TransactionConfirmationStatus.Confirmed, "InstructionError"),
+    "finalized": (TransactionConfirmationStatus.Finalized, None),
+    "finalized_err": (TransactionConfirmationStatus.Finalized, "InstructionError")
+}
+
+
+class StubRPC:
+    # Answers getSignatureStatuses and getBlockHeight from memory
+
+    def __init__(self, block_height: int = 100):
+        self.statuses = {}
+        self.block_height = block_height
+
+    def add_tx(self, rpc_status: str) -> str:
+        tx_hash = str(Signature.new_unique())
+        self.statuses[tx_hash] = rpc_statuses[rpc_status]
+        return tx_hash
+
+    def get_signature_statuses(self, sigs, search_transaction_history=False):
+        value = []
+        for sig in sigs:
+            status = self.statuses.get(str(sig))
+            if status is None:
+                value.append(None)
+            else:
+                value.append(SimpleNamespace(confirmation_status=status[0], err=status[1]))
+
+        return SimpleNamespace(value=value)
+
+    def get_block_height(self, commitment=None):
+        return SimpleNamespace(value=self.block_height)
+
+
+@pytest.fixture
+def rpc(monkeypatch):
+    stub = StubRPC()
+    monkeypatch.setattr(awe_on_chain.http_client, "get_signature_statuses", stub.get_signature_statuses)
+    monkeypatch.setattr(awe_on_chain.http_client, "get_block_height", stub.get_block_height)
+    return stub
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    monkeypatch.setattr(payment_processor, "fetch_interval", 0)
+    monkeypatch.setattr("awe.agent_manager.agent_fund.send_user_notification", Mock())
+    return PaymentProcessor()
+
+
+@pytest.mark.parametrize("rpc_status,commitment", [
+    ("not_found", None),
+    ("processed", "processed"),
+    ("confirmed", "confirmed"),
+    ("confirmed_err", "failed"),
+    ("finalized", "finalized"),
+    ("finalized_err", "failed")
+])
+def test_get_txs_commitment(rpc, rpc_status, commitment):
+    tx_hash = rpc.add_tx(rpc_status)
+    assert awe_on_chain.get_txs_commitment([tx_hash]) == [commitment]
+
+
+@pytest.mark.parametrize("rpc_status,provisional,tx_status", [
+    ("processed", True, "pending"),
+    ("confirmed", True, "confirmed"),
+    ("confirmed", False, "pending"),
+    ("confirmed_err", True, "failed"),
+    ("confirmed_err", False, "failed"),
+    ("finalized", True, "success"),
+    ("finalized", False, "success"),
+    ("finalized_err", True, "failed")
+])
+def test_get_tx_status(rpc, processor, rpc_status, provisional, tx_status):
+    tx_hash = rpc.add_tx(rpc_status)
+    assert processor.get_tx_status(tx_hash, rpc.block_height, provisional) == tx_status
+
+
+def test_get_tx_status_not_found(rpc, processor):
+    tx_hash = rpc.add_tx("not_found")
+    assert processor.get_tx_status(tx_hash, rpc.block_height, True) == "pending"
+
+    # Expired once the last valid block height is passed
+    rpc.block_height += 31
+    assert processor.get_tx_status(tx_hash, rpc.block_height - 31, True) == "failed"
+
+
+@pytest.mark.parametrize("rpc_status,approved,failed", [
+    ("not_found", False, False),
+    ("processed", False, False),
+    ("confirmed", True, False),
+    ("confirmed_err", False, True),
+    ("finalized", True, False),
+    ("finalized_err", False, True)
+])
+def test_process_approvals(db, rpc, processor, monkeypatch, rpc_status, approved, failed):
+    monkeypatch.setattr(payment_processor.settings, "solana_provisional_tx_kinds", ["approve"])
+
+    approve_tx_hash = rpc.add_tx(rpc_status)
+    with Session(db) as session:
+        user_deposit = TgUserDeposit(user_agent_id=1, tg_user_id="1", address="address", amount=100, approve_tx_hash=approve_tx_hash)
+        session.add(user_deposit)
+        session.commit()
+        user_deposit_id = user_deposit.id
+
+    on_approved = Mock()
+    on_failed = Mock()
+    processor.process_approvals("User Deposit", TgUserDeposit, TgUserDepositStatus.APPROVING, on_approved, on_failed)
+
+    assert on_approved.called == approved
+    assert on_failed.called == failed
+    if approved:
+        on_approved.assert_called_once_with(user_deposit_id)
+    if failed:
+        on_failed.assert_called_once_with(user_deposit_id)
+
+
+def add_user_deposit(db, tx_hash: str) -> int:
+    with Session(db) as session:
+        user_deposit = TgUserDeposit(
+            user_agent_id=1,
+            tg_user_id="1",
+            address="address",
+            amount=100,
+            tx_hash=tx_hash,
+            tx_last_valid_block_height=100,
+            status=TgUserDepositStatus.TX_SENT
+        )
+        session.add(user_deposit)
+        session.commit()
+        return user_deposit.id
+
+
+def get_user_deposit_state(db, user_deposit_id: int):
+    with Session(db) as session:
+        user_deposit = session.get(TgUserDeposit, user_deposit_id)
+        user_account = session.exec(select(TgUserAccount).where(TgUserAccount.tg_user_id == "1")).first()
+        return user_deposit.status, 0 if user_account is None else user_account.balance
+
+
+def test_process_user_deposit_confirmed_then_finalized(db, rpc, processor, monkeypatch):
+    monkeypatch.setattr(payment_processor.settings, "solana_provisional_tx_kinds", ["user_deposit"])
+    finalize_user_deposit = Mock()
+    monkeypatch.setattr(payment_processor, "finalize_user_deposit", finalize_user_deposit)
+
+    tx_hash = rpc.add_tx("confirmed")
+    user_deposit_id = add_user_deposit(db, tx_hash)
+
+    # Provisional credit at confirmed
+    processor.process_user_deposit()
+    assert get_user_deposit_state(db, user_deposit_id) == (TgUserDepositStatus.TX_CONFIRMED, 100)
+
+    # Not credited twice
+    processor.process_user_deposit()
+    assert get_user_deposit_state(db, user_deposit_id) == (TgUserDepositStatus.TX_CONFIRMED, 100)
+    finalize_user_deposit.assert_not_called()
+
+    rpc.statuses[tx_hash] = rpc_statuses["finalized"]
+    processor.process_user_deposit()
+    finalize_user_deposit.assert_called_once_with(user_deposit_id)
+
+
+def test_process_user_deposit_confirmed_then_failed(db, rpc, processor, monkeypatch):
+    monkeypatch.setattr(payment_processor.settings, "solana_provisional_tx_kinds", ["user_deposit"])
+
+    tx_hash = rpc.add_tx("confirmed")
+    user_deposit_id = add_user_deposit(db, tx_hash)
+
+    processor.process_user_deposit()
+    assert get_user_deposit_state(db, user_deposit_id) == (TgUserDepositStatus.TX_CONFIRMED, 100)
+
+    # The provisional credit is taken back
+    rpc.statuses[tx_hash] = rpc_statuses["finalized_err"]
+    processor.process_user_deposit()
+    assert get_user_deposit_state(db, user_deposit_id) == (TgUserDepositStatus.FAILED, 0)
+
+
+def test_process_user_deposit_failed_at_confirmed(db, rpc, processor, monkeypatch):
+    monkeypatch.setattr(payment_processor.settings, "solana_provisional_tx_kinds", ["user_deposit"])
+
+    tx_hash = rpc.add_tx("confirmed_err")
+    user_deposit_id = add_user_deposit(db, tx_hash)
+
+    # Never credited
+    processor.process_user_deposit()
+    assert get_user_deposit_state(db, user_deposit_id) == (TgUserDepositStatus.FAILED, 0)